@@ -0,0 +1,125 @@
+"""
+Micro-benchmark of the per-message JSON serialization cost, stdlib json vs app.core.codec.
+
+    python -m app.benchmarks.json_codec [--iterations 20000]
+"""
+import argparse
+import base64
+import json
+import timeit
+import uuid
+from datetime import datetime, timezone
+from typing import List, Optional
+
+import pydantic
+
+from app.core import codec
+
+
+class _Configuration(pydantic.BaseModel):
+    id: uuid.UUID
+    action: str
+    data: dict
+
+
+class _Integration(pydantic.BaseModel):
+    id: uuid.UUID
+    name: str
+    base_url: Optional[str]
+    enabled: bool
+    created_at: datetime
+    configurations: List[_Configuration]
+
+
+def _sample_data():
+    now = datetime.now(tz=timezone.utc)
+    observation = {
+        "event_id": str(uuid.uuid4()),
+        "timestamp": str(now),
+        "schema_version": "v1",
+        "event_type": "ObservationReceived",
+        "payload": {
+            "gundi_id": str(uuid.uuid4()),
+            "related_to": None,
+            "owner": "na",
+            "data_provider_id": str(uuid.uuid4()),
+            "source_id": str(uuid.uuid4()),
+            "external_source_id": "test-device",
+            "source_name": "Mariano",
+            "type": "tracking-device",
+            "subject_type": "puma",
+            "recorded_at": str(now),
+            "location": {"lat": -51.688246, "lon": -72.704459},
+            "additional": {"speed_kmph": 5, "battery": 98, "hdop": [0.5] * 20},
+            "observation_type": "obv",
+        },
+    }
+    envelope = {
+        "data": base64.b64encode(json.dumps(observation).encode("utf-8")).decode(),
+        "attributes": {},
+    }
+    attributes = {
+        "gundi_version": "v2",
+        "provider_key": "gundi_traptagger",
+        "gundi_id": uuid.uuid4(),
+        "related_to": "None",
+        "stream_type": "obv",
+        "source_id": uuid.uuid4(),
+        "external_source_id": "test-device",
+        "destination_id": uuid.uuid4(),
+        "data_provider_id": uuid.uuid4(),
+        "annotations": "{}",
+    }
+    transformed = {**observation["payload"], "recorded_at": now, "id": uuid.uuid4()}
+    tracing_context = {
+        "traceparent": f"00-{uuid.uuid4().hex}-{uuid.uuid4().hex[:16]}-01"
+    }
+    integration = _Integration(
+        id=uuid.uuid4(),
+        name="ER Site",
+        base_url="https://gundi-er.pamdas.org",
+        enabled=True,
+        created_at=now,
+        configurations=[
+            _Configuration(id=uuid.uuid4(), action=f"action_{i}", data={"i": i})
+            for i in range(5)
+        ],
+    )
+    return envelope, attributes, transformed, tracing_context, integration
+
+
+def _stdlib_message(envelope, attributes, transformed, tracing_context, integration):
+    json.loads(base64.b64decode(envelope["data"].encode("utf-8")))
+    json.dumps(tracing_context, default=str)
+    json.loads(json.dumps(attributes, default=str))
+    json.dumps(transformed, default=str).encode("utf-8")
+    _Integration.parse_raw(integration.json())
+
+
+def _codec_message(envelope, attributes, transformed, tracing_context, integration):
+    codec.loads(base64.b64decode(envelope["data"].encode("utf-8")))
+    codec.dumps_str(tracing_context)
+    codec.to_jsonable(attributes)
+    codec.dumps(transformed)
+    codec.parse_model(_Integration, codec.dump_model(integration))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--iterations", type=int, default=20000)
+    args = parser.parse_args()
+
+    data = _sample_data()
+    print(f"Codec backend: {codec.BACKEND}")
+    results = {}
+    for name, func in (("stdlib json", _stdlib_message), ("codec", _codec_message)):
+        seconds = min(
+            timeit.repeat(lambda: func(*data), number=args.iterations, repeat=3)
+        )
+        results[name] = seconds / args.iterations * 1_000_000
+        print(f"{name:>12}: {results[name]:.1f} µs/message")
+    print(f"     speedup: {results['stdlib json'] / results['codec']:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
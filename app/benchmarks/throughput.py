@@ -0,0 +1,956 @@
+"""
+End-to-end throughput benchmark of the routing service, with local stand-ins.
+
+Generated v1 and v2 messages are pushed through process_request (or the ASGI
+app) at a given concurrency, with the lifespan of the app running. Redis is
+replaced with an in-memory stand-in, and the portal (v1 and v2 APIs and the
+token endpoint), SMART Connect (login, conservation areas and data models) and
+PubSub (through PUBSUB_EMULATOR_HOST) are served by fake HTTP servers in a
+separate process, so the CPU time measured is the service's only. SMART shares
+the portal server and latency. Each stand-in can be given a latency.
+
+Each scenario (a stream type routed to a destination type) runs in turn, and
+reports messages/sec, p50/p95/p99 latency and CPU time per message. A message
+per source is sent first, so portal lookups are cached as in a steady state.
+Run it with TRACING_ENABLED=false, otherwise spans are exported to Cloud Trace.
+
+    TRACING_ENABLED=false python -m app.benchmarks.throughput [--messages 2000]
+        [--concurrency 50] [--target process_request|asgi] [--redis-latency-ms 0.5]
+        [--portal-latency-ms 50] [--pubsub-latency-ms 20] [--scenarios v2-obv-er,...]
+"""
+import argparse
+import asyncio
+import base64
+import json
+import logging
+import multiprocessing
+import os
+import socket
+import time
+import uuid
+from collections import Counter
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Dict, List
+
+
+# Fake portal and PubSub servers
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _run_fake_servers(
+    *, portal_port, pubsub_port, portal_data, portal_latency, pubsub_latency, ready
+):
+    # Runs in a child process, so the servers don't take CPU time from the service
+    from aiohttp import web
+
+    published = Counter()
+
+    async def delay(latency):
+        if latency:
+            await asyncio.sleep(latency)
+
+    async def token(request):
+        await delay(portal_latency)
+        return web.json_response(
+            {
+                "access_token": "benchmark-token",
+                "refresh_token": "benchmark-token",
+                "token_type": "Bearer",
+                "expires_in": 3600,
+                "refresh_expires_in": 3600,
+            }
+        )
+
+    async def portal_get(request):
+        await delay(portal_latency)
+        path = request.path.rstrip("/")
+        if path.endswith("/integrations/outbound/configurations"):
+            path = f"{path}?inbound_id={request.query.get('inbound_id')}"
+        if (data := portal_data.get(path)) is None:
+            return web.json_response({"detail": "Not found."}, status=404)
+        if isinstance(data, str):  # SMART data models are XML
+            return web.Response(text=data, content_type="application/xml")
+        return web.json_response(data)
+
+    async def smart_login(request):
+        await delay(portal_latency)
+        response = web.Response(status=200)
+        response.set_cookie("JSESSIONID", uuid.uuid4().hex)
+        return response
+
+    async def ensure_device(request):
+        await delay(portal_latency)
+        payload = await request.json()
+        return web.json_response(
+            {
+                "id": str(uuid.uuid4()),
+                "external_id": payload["external_id"],
+                "name": "",
+                "subject_type": None,
+                "inbound_configuration": {"id": payload["inbound_configuration"]},
+                "additional": {},
+            },
+            status=201,
+        )
+
+    async def publish(request):
+        await delay(pubsub_latency)
+        topic = request.match_info["topic"].rsplit(":", 1)[0]
+        messages = (await request.json())["messages"]
+        published[topic] += len(messages)
+        return web.json_response(
+            {"messageIds": [str(uuid.uuid4().int >> 64) for _ in messages]}
+        )
+
+    async def stats(request):
+        return web.json_response({"published": published})
+
+    async def serve():
+        portal = web.Application()
+        portal.router.add_post("/realms/benchmark/protocol/openid-connect/token", token)
+        portal.router.add_post("/api/v1.0/devices", ensure_device)
+        portal.router.add_post(f"{_SMART_PATH}/j_security_check", smart_login)
+        portal.router.add_get("/{path:.*}", portal_get)
+        pubsub = web.Application(client_max_size=10 * 1024 * 1024)
+        pubsub.router.add_post("/v1/projects/{project}/topics/{topic}", publish)
+        pubsub.router.add_get("/stats", stats)
+        for application, port in ((portal, portal_port), (pubsub, pubsub_port)):
+            runner = web.AppRunner(application, access_log=None)
+            await runner.setup()
+            await web.TCPSite(runner, "127.0.0.1", port, backlog=1024).start()
+        ready.set()
+        await asyncio.Event().wait()
+
+    asyncio.run(serve())
+
+
+# In-memory Redis
+
+
+class FakeRedis:
+    """The subset of the Redis client used by the service, with a latency per command."""
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.commands = 0
+        self._data = {}
+        self._expires_at = {}
+
+    async def _call(self):
+        self.commands += 1
+        await asyncio.sleep(
+            self.latency
+        )  # Even without latency a command yields to the event loop
+
+    def _read(self, key):
+        if (expires_at := self._expires_at.get(key)) and expires_at <= time.monotonic():
+            self._data.pop(key, None)
+            self._expires_at.pop(key, None)
+        return self._data.get(key)
+
+    def _write(self, key, value, ttl=None):
+        # Values are read back as strings, like with decode_responses=True
+        self._data[key] = (
+            value.decode("utf-8") if isinstance(value, bytes) else str(value)
+        )
+        if ttl:
+            self._expires_at[key] = time.monotonic() + ttl
+        else:
+            self._expires_at.pop(key, None)
+
+    def _hset(self, key, field, value):
+        # Hashes are kept as dicts of strings, with the TTL of the key
+        hash_ = self._read(key)
+        if hash_ is None:
+            hash_ = self._data[key] = {}
+        hash_[field] = str(value)
+        return 1
+
+    def _expire(self, key, ttl):
+        if self._read(key) is None:
+            return False
+        self._expires_at[key] = time.monotonic() + ttl
+        return True
+
+    async def get(self, key):
+        await self._call()
+        return self._read(key)
+
+    async def hmget(self, key, fields):
+        await self._call()
+        hash_ = self._read(key) or {}
+        return [hash_.get(field) for field in fields]
+
+    async def mget(self, keys, *args):
+        await self._call()
+        keys = [keys, *args] if isinstance(keys, str) else list(keys)
+        return [self._read(key) for key in keys]
+
+    async def set(self, key, value, ex=None, px=None, nx=False):
+        await self._call()
+        if nx and self._read(key) is not None:
+            return None
+        self._write(key, value, ex or (px / 1000 if px else None))
+        return True
+
+    async def setex(self, key, ttl, value):
+        await self._call()
+        self._write(key, value, ttl)
+        return True
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+    async def delete(self, *keys):
+        await self._call()
+        deleted = 0
+        for key in keys:
+            if self._read(key) is not None:
+                del self._data[key]
+                self._expires_at.pop(key, None)
+                deleted += 1
+        return deleted
+
+    async def eval(self, script, numkeys, *args):
+        # The scripts of the event claims and cache locks, all on a single key
+        from app.core import deduplication
+
+        await self._call()
+        key, *argv = args
+        value = self._read(key)
+        if script == deduplication._CLAIM_EVENT_SCRIPT:
+            if value is not None:
+                return value
+            self._write(key, argv[0], int(argv[1]))
+            return 0
+        # The others change the key only if it holds the token
+        if value != str(argv[0]):
+            return 0
+        if script == deduplication._EXTEND_CLAIM_SCRIPT:
+            self._expires_at[key] = time.monotonic() + float(argv[1])
+        elif script == deduplication._COMPLETE_CLAIM_SCRIPT:
+            self._write(key, argv[1], int(argv[2]))
+        else:  # Release of a cache lock or an event claim
+            del self._data[key]
+            self._expires_at.pop(key, None)
+        return 1
+
+
+class FakeSyncRedis:
+    """The synchronous Redis client the SMART client caches conservation areas and data models with."""
+
+    def __init__(self):
+        self._data = {}
+
+    def get(self, name):
+        return self._data.get(name)
+
+    def set(self, name, value, *args, **kwargs):
+        self._data[name] = value
+        return True
+
+
+class FakePipeline:
+    """Buffers commands and sends them to a `FakeRedis` in a single round trip."""
+
+    def __init__(self, redis):
+        self._redis = redis
+        self._commands = []
+
+    def setex(self, key, ttl, value):
+        self._commands.append(lambda: self._redis._write(key, value, ttl))
+        return self
+
+    def hset(self, key, field, value):
+        self._commands.append(lambda: self._redis._hset(key, field, value))
+        return self
+
+    def expire(self, key, ttl):
+        self._commands.append(lambda: self._redis._expire(key, ttl))
+        return self
+
+    async def execute(self):
+        await self._redis._call()
+        commands, self._commands = self._commands, []
+        return [command() for command in commands]
+
+
+# Scenarios
+
+
+@dataclass
+class Scenario:
+    name: str
+    gundi_version: str
+    stream_type: str
+    destination_type: str
+    portal_data: Dict[str, object] = field(default_factory=dict)
+    build_message: object = None
+
+
+def _now():
+    return datetime.now(timezone.utc)
+
+
+def _topic(scenario_name):
+    return f"benchmark-{scenario_name}"
+
+
+def _v1_scenario(name, stream_type, device_ids):
+    inbound_id = str(uuid.uuid4())
+    outbound_id = str(uuid.uuid4())
+    owner_id = str(uuid.uuid4())
+    inbound = {
+        "state": {},
+        "id": inbound_id,
+        "type": str(uuid.uuid4()),
+        "owner": owner_id,
+        "endpoint": "https://logins.example.com/restintegration/",
+        "login": "benchmark",
+        "password": "benchmark",
+        "token": "",
+        "type_slug": "bidtrack",
+        "provider": "bidtrack",
+        "default_devicegroup": str(uuid.uuid4()),
+        "enabled": True,
+        "name": f"Benchmark - {name}",
+    }
+    outbound = {
+        "id": outbound_id,
+        "type": str(uuid.uuid4()),
+        "owner": owner_id,
+        "name": f"Benchmark - {name} to ER",
+        "endpoint": "https://benchmark.pamdas.org/api/v1.0",
+        "state": {},
+        "login": "",
+        "password": "",
+        "token": "benchmark-token",
+        "type_slug": "earth_ranger",
+        "inbound_type_slug": "bidtrack",
+        "additional": {"broker": "gcp_pubsub", "topic": _topic(name)},
+    }
+    configurations = "/api/v1.0/integrations/outbound/configurations"
+    portal_data = {
+        f"/api/v1.0/integrations/inbound/configurations/{inbound_id}": inbound,
+        f"{configurations}/{outbound_id}": outbound,
+        f"{configurations}?inbound_id={inbound_id}": [outbound],
+    }
+
+    def build_message(i):
+        recorded_at = _now().isoformat()
+        observation = {
+            "id": None,
+            "owner": "na",
+            "integration_id": inbound_id,
+            "device_id": device_ids[i % len(device_ids)],
+            "recorded_at": recorded_at,
+            "location": {
+                "x": 35.43935,
+                "y": -1.59083,
+                "z": 0.0,
+                "hdop": None,
+                "vdop": None,
+            },
+            "additional": {"voltage": "7.4", "fuel_level": 71, "speed": "41 kph"},
+            "observation_type": stream_type,
+        }
+        if stream_type == "ps":
+            observation.update(
+                name="Logistics Truck",
+                type="tracking-device",
+                subject_type=None,
+                voltage=None,
+                temperature=None,
+                radio_status=None,
+            )
+        else:
+            observation.update(
+                title="Rainfall",
+                event_type="rainfall_rep",
+                event_details={"amount_mm": 6, "height_m": 3},
+                geometry=None,
+            )
+        return observation, {"observation_type": stream_type, "tracing_context": "{}"}
+
+    return Scenario(
+        name=name,
+        gundi_version="v1",
+        stream_type=stream_type,
+        destination_type="earth_ranger",
+        portal_data=portal_data,
+        build_message=build_message,
+    )
+
+
+_INTEGRATION_TYPES = {
+    "earth_ranger": {
+        "name": "EarthRanger",
+        "actions": ["push_positions", "push_events"],
+    },
+    "movebank": {"name": "Movebank", "actions": ["push_observations"]},
+    "smart_connect": {"name": "SMART Connect", "actions": ["auth", "push_events"]},
+}
+
+# Served by the portal server, under this path
+_SMART_PATH = "/server"
+
+_SMART_DATAMODEL = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<DataModel xmlns="http://www.smartconservationsoftware.org/xml/1.1/datamodel">
+    <languages>
+        <languages code="en"/>
+    </languages>
+    <attributes>
+        <attribute key="species" isrequired="false" type="LIST">
+            <names language_code="en" value="Species"/>
+            <values key="leopard" isactive="true">
+                <names language_code="en" value="Leopard"/>
+            </values>
+            <values key="wilddog" isactive="true">
+                <names language_code="en" value="Wild Dog"/>
+            </values>
+        </attribute>
+    </attributes>
+    <categories>
+        <category key="wildlife" ismultiple="true" isactive="true">
+            <names language_code="en" value="Wildlife"/>
+            <category key="sighting" ismultiple="true" isactive="true">
+                <names language_code="en" value="Sighting"/>
+                <category key="rep" ismultiple="true" isactive="true">
+                    <names language_code="en" value="Report"/>
+                    <attributes isactive="true" attributekey="species"/>
+                </category>
+            </category>
+        </category>
+    </categories>
+</DataModel>
+"""
+
+
+def _organization():
+    return {"id": str(uuid.uuid4()), "name": "Benchmark Organization"}
+
+
+def _connection_integration(integration_id, name, type_value, owner):
+    return {
+        "id": integration_id,
+        "name": name,
+        "owner": owner,
+        "type": {
+            "id": str(uuid.uuid4()),
+            "name": _INTEGRATION_TYPES.get(type_value, {}).get("name", type_value),
+            "value": type_value,
+        },
+        "base_url": f"https://{type_value}.example.com",
+        "status": "healthy",
+        "status_details": "",
+    }
+
+
+def _integration(
+    integration_id, name, type_value, owner, topic, base_url=None, configurations=()
+):
+    integration_type = _INTEGRATION_TYPES[type_value]
+    actions = {
+        action: {
+            "id": str(uuid.uuid4()),
+            "type": "auth" if action == "auth" else "push",
+            "name": action,
+            "value": action,
+        }
+        for action in integration_type["actions"]
+    }
+    return {
+        "id": integration_id,
+        "name": name,
+        "base_url": base_url or f"https://{type_value}.example.com",
+        "enabled": True,
+        "type": {
+            "id": str(uuid.uuid4()),
+            "name": integration_type["name"],
+            "value": type_value,
+            "description": f"{integration_type['name']} benchmark destination",
+            "actions": [
+                {**action, "description": "", "schema": {}}
+                for action in actions.values()
+            ],
+        },
+        "owner": {**owner, "description": ""},
+        "configurations": [
+            {
+                "id": str(uuid.uuid4()),
+                "integration": integration_id,
+                "action": actions[action],
+                "data": data,
+            }
+            for action, data in configurations
+        ],
+        "additional": {"broker": "gcp_pubsub", "topic": topic},
+        "default_route": None,
+        "status": "healthy",
+        "status_details": "",
+    }
+
+
+def _smart_destination(destination_id, name, owner, topic, smart_url, ca_uuid):
+    """A SMART Connect destination, and the responses of its server."""
+    integration = _integration(
+        destination_id,
+        name,
+        "smart_connect",
+        owner,
+        topic,
+        base_url=smart_url,
+        configurations=[
+            (
+                "auth",
+                {"login": "benchmark", "password": "benchmark", "version": "7.5.7"},
+            ),
+            ("push_events", {"ca_uuids": [ca_uuid], "timezone": "UTC"}),
+        ],
+    )
+    conservation_area = {
+        "label": "Benchmark Conservation Area",
+        "status": "ACTIVE",
+        "revision": 1,
+        "uuid": ca_uuid,
+    }
+    smart_data = {
+        f"{_SMART_PATH}/connect/home": {},
+        f"{_SMART_PATH}/api/conservationarea": [conservation_area],
+        f"{_SMART_PATH}/api/metadata/datamodel/{ca_uuid}": _SMART_DATAMODEL,
+    }
+    return integration, smart_data
+
+
+def _v2_scenario(
+    name, stream_type, destination_type, source_ids, smart_url=None, smart_ca_uuid=None
+):
+    owner = _organization()
+    provider_id = str(uuid.uuid4())
+    destination_id = str(uuid.uuid4())
+    route_id = str(uuid.uuid4())
+    provider = _connection_integration(
+        provider_id, "Benchmark Provider", "traptagger", owner
+    )
+    destination = _connection_integration(
+        destination_id, f"Benchmark {destination_type}", destination_type, owner
+    )
+    connection = {
+        "id": provider_id,
+        "provider": provider,
+        "destinations": [destination],
+        "routing_rules": [{"id": route_id, "name": "Benchmark Default Route"}],
+        "default_route": {"id": route_id, "name": "Benchmark Default Route"},
+        "owner": {**owner, "description": ""},
+        "status": "healthy",
+    }
+    route = {
+        "id": route_id,
+        "name": "Benchmark Default Route",
+        "owner": owner["id"],
+        "data_providers": [provider],
+        "destinations": [destination],
+        "configuration": {
+            "id": str(uuid.uuid4()),
+            "name": "Benchmark Event Type Mapping",
+            "data": {
+                "field_mappings": {
+                    provider_id: {
+                        "ev": {
+                            destination_id: {
+                                "map": {
+                                    "Leopard": "leopard_sighting",
+                                    "Wilddog": "wild_dog_sighting",
+                                },
+                                "default": "wildlife_sighting_rep",
+                                "provider_field": "event_details__species",
+                                "destination_field": "event_type",
+                            }
+                        }
+                    }
+                }
+            },
+        },
+        "additional": {},
+    }
+    if destination_type == "smart_connect":
+        integration, portal_data = _smart_destination(
+            destination_id,
+            destination["name"],
+            owner,
+            _topic(name),
+            smart_url,
+            smart_ca_uuid,
+        )
+    else:
+        integration = _integration(
+            destination_id, destination["name"], destination_type, owner, _topic(name)
+        )
+        portal_data = {}
+    portal_data.update(
+        {
+            f"/api/v2/connections/{provider_id}": connection,
+            f"/api/v2/routes/{route_id}": route,
+            f"/api/v2/integrations/{destination_id}": integration,
+        }
+    )
+
+    def build_message(i):
+        now = _now()
+        gundi_id = str(uuid.uuid4())
+        payload = {
+            "gundi_id": gundi_id,
+            "related_to": None,
+            "owner": owner["id"],
+            "data_provider_id": provider_id,
+            "annotations": {},
+            "source_id": str(uuid.uuid4()),
+            "external_source_id": source_ids[i % len(source_ids)],
+            "recorded_at": now.isoformat(),
+            "location": {
+                "lat": -51.688246,
+                "lon": -72.704459,
+                "alt": 0,
+                "hdop": None,
+                "vdop": None,
+            },
+            "observation_type": stream_type,
+        }
+        if stream_type == "obv":
+            event_type = "ObservationReceived"
+            payload.update(
+                source_name="Benchmark Collar",
+                type="tracking-device",
+                subject_type="elephant",
+                additional={"speed_kmph": 30},
+            )
+        elif stream_type == "evu":
+            event_type = "EventUpdateReceived"
+            for key in ("recorded_at", "location"):
+                del payload[key]
+            payload.update(
+                changes={
+                    "title": "Leopard Detected",
+                    "event_type": "wildlife_sighting_rep",
+                    "event_details": {"species": "Leopard"},
+                }
+            )
+        elif stream_type == "att":
+            event_type = "AttachmentReceived"
+            for key in ("recorded_at", "location"):
+                del payload[key]
+            payload.update(
+                related_to=str(uuid.uuid4()),
+                file_path=f"attachments/{gundi_id}_leopard.jpg",
+            )
+        else:
+            event_type = "EventReceived"
+            payload.update(
+                title="Animal Detected",
+                event_type="wildlife_sighting_rep",
+                event_details={"species": "Leopard"},
+                geometry={},
+            )
+        event = {
+            "event_id": str(uuid.uuid4()),
+            "timestamp": now.isoformat(),
+            "schema_version": "v1",
+            "payload": payload,
+            "event_type": event_type,
+        }
+        attributes = {
+            "gundi_version": "v2",
+            "gundi_id": gundi_id,
+            "observation_type": stream_type,
+            "tracing_context": "{}",
+        }
+        return event, attributes
+
+    return Scenario(
+        name=name,
+        gundi_version="v2",
+        stream_type=stream_type,
+        destination_type=destination_type,
+        portal_data=portal_data,
+        build_message=build_message,
+    )
+
+
+def build_scenarios(sources, *, smart_url):
+    device_ids = [f"device-{i:05}" for i in range(sources)]
+    # The SMART scenarios share the conservation area listed by the SMART server
+    smart = dict(smart_url=smart_url, smart_ca_uuid=str(uuid.uuid4()))
+    return [
+        _v1_scenario("v1-ps-er", "ps", device_ids),
+        _v1_scenario("v1-ge-er", "ge", device_ids),
+        _v2_scenario("v2-obv-er", "obv", "earth_ranger", device_ids),
+        _v2_scenario("v2-obv-mb", "obv", "movebank", device_ids),
+        _v2_scenario("v2-ev-er", "ev", "earth_ranger", device_ids),
+        _v2_scenario("v2-evu-er", "evu", "earth_ranger", device_ids),
+        _v2_scenario("v2-att-er", "att", "earth_ranger", device_ids),
+        _v2_scenario("v2-ev-sm", "ev", "smart_connect", device_ids, **smart),
+        _v2_scenario("v2-evu-sm", "evu", "smart_connect", device_ids, **smart),
+        _v2_scenario("v2-att-sm", "att", "smart_connect", device_ids, **smart),
+    ]
+
+
+def build_push_request(scenario, i):
+    """The body of a PubSub push request carrying a new message of the scenario."""
+    data, attributes = scenario.build_message(i)
+    publish_time = _now().strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+    message_id = str(uuid.uuid4().int >> 64)
+    return json.dumps(
+        {
+            "message": {
+                "attributes": attributes,
+                "data": base64.b64encode(json.dumps(data).encode("utf-8")).decode(
+                    "ascii"
+                ),
+                "messageId": message_id,
+                "message_id": message_id,
+                "publishTime": publish_time,
+                "publish_time": publish_time,
+            },
+            "subscription": "projects/benchmark/subscriptions/benchmark",
+        }
+    ).encode("utf-8")
+
+
+_HEADERS = {
+    "content-type": "application/json",
+    "user-agent": "APIs-Google; (+https://developers.google.com/webmasters/APIs-Google.html)",
+}
+
+
+class _PushRequest:
+    """What process_request reads from a starlette Request."""
+
+    def __init__(self, body):
+        self._body = body
+        self.headers = _HEADERS
+
+    async def body(self):
+        return self._body
+
+
+# Runner
+
+
+@dataclass
+class Result:
+    scenario: Scenario
+    seconds: float
+    cpu_seconds: float
+    latencies: List[float]
+    errors: int
+    published: int
+
+    @property
+    def messages(self):
+        return len(self.latencies)
+
+    def percentile(self, p):
+        values = sorted(self.latencies)
+        return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+async def _send(send, body):
+    start = time.perf_counter()
+    try:
+        ok = await send(body)
+    except Exception:
+        ok = False
+    return time.perf_counter() - start, ok
+
+
+async def _run_scenario(
+    send, scenario, *, messages, warm_up, concurrency, published_count
+):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def bounded(body):
+        async with semaphore:
+            return await _send(send, body)
+
+    # Requests are built ahead of time, so only the service is timed
+    for i in range(warm_up):
+        await _send(send, build_push_request(scenario, i))
+    bodies = [build_push_request(scenario, warm_up + i) for i in range(messages)]
+    published_before = await published_count(_topic(scenario.name))
+    cpu_start, start = time.process_time(), time.perf_counter()
+    results = await asyncio.gather(*[bounded(body) for body in bodies])
+    seconds, cpu_seconds = time.perf_counter() - start, time.process_time() - cpu_start
+    # Give background publishers (batches, dead letters) time to flush
+    await asyncio.sleep(1.0)
+    return Result(
+        scenario=scenario,
+        seconds=seconds,
+        cpu_seconds=cpu_seconds,
+        latencies=[latency for latency, _ in results],
+        errors=sum(1 for _, ok in results if not ok),
+        published=await published_count(_topic(scenario.name)) - published_before,
+    )
+
+
+async def run(args, scenarios, *, pubsub_url):
+    # The service is imported after the stand-ins are configured (see main())
+    import aiohttp
+    import httpx
+
+    from smartconnect import cache as smart_cache
+
+    from app.core import deduplication, gundi
+    from app.main import app
+    from app.services import activity_logger, process_messages, smart_datamodels
+
+    redis = FakeRedis(latency=args.redis_latency_ms / 1000)
+    for module in (gundi, deduplication, activity_logger, smart_datamodels):
+        module._cache_db = redis
+    smart_cache.cache = FakeSyncRedis()
+
+    async def process_request(body):
+        response = await process_messages.process_request(request=_PushRequest(body))
+        return response.get("status") == "processed"
+
+    async with aiohttp.ClientSession() as session, httpx.AsyncClient(
+        app=app, base_url="http://routing"
+    ) as client, app.router.lifespan_context(app):
+
+        async def asgi(body):
+            response = await client.post("/", content=body, headers=_HEADERS)
+            return (
+                response.status_code == 200
+                and response.json().get("status") == "processed"
+            )
+
+        async def published_count(topic):
+            async with session.get(f"{pubsub_url}/stats") as response:
+                return (await response.json())["published"].get(topic, 0)
+
+        send = asgi if args.target == "asgi" else process_request
+        results = []
+        for scenario in scenarios:
+            results.append(
+                await _run_scenario(
+                    send,
+                    scenario,
+                    messages=args.messages,
+                    warm_up=args.warm_up,
+                    concurrency=args.concurrency,
+                    published_count=published_count,
+                )
+            )
+    return results, redis
+
+
+def _print_results(results, redis):
+    header = (
+        f"{'scenario':<10} {'version':<7} {'stream':<6} {'destination':<12} "
+        f"{'msg/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'CPU µs/msg':>10} {'errors':>6} {'published':>9}"
+    )
+    print(header)
+    print("-" * len(header))
+    for r in results:
+        s = r.scenario
+        print(
+            f"{s.name:<10} {s.gundi_version:<7} {s.stream_type:<6} {s.destination_type:<12} "
+            f"{r.messages / r.seconds:>8.0f} {r.percentile(50) * 1000:>8.1f} "
+            f"{r.percentile(95) * 1000:>8.1f} {r.percentile(99) * 1000:>8.1f} "
+            f"{r.cpu_seconds / r.messages * 1_000_000:>10.0f} {r.errors:>6} {r.published:>9}"
+        )
+    print(f"Redis commands: {redis.commands}")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument(
+        "--messages", type=int, default=2000, help="Messages per scenario"
+    )
+    parser.add_argument(
+        "--warm-up",
+        type=int,
+        help="Messages per scenario sent before measuring (one per source by default)",
+    )
+    parser.add_argument(
+        "--concurrency", type=int, default=50, help="Requests in flight"
+    )
+    parser.add_argument(
+        "--target", choices=("process_request", "asgi"), default="process_request"
+    )
+    parser.add_argument("--sources", type=int, default=100, help="Devices per scenario")
+    parser.add_argument("--redis-latency-ms", type=float, default=0.5)
+    parser.add_argument("--portal-latency-ms", type=float, default=50.0)
+    parser.add_argument("--pubsub-latency-ms", type=float, default=20.0)
+    parser.add_argument(
+        "--scenarios", help="Comma-separated scenario names (all by default)"
+    )
+    parser.add_argument(
+        "--logs", action="store_true", help="Keep the per-message INFO logs"
+    )
+    args = parser.parse_args()
+    if args.warm_up is None:
+        args.warm_up = args.sources
+    if not args.logs:
+        logging.disable(logging.INFO)
+
+    portal_port, pubsub_port = _free_port(), _free_port()
+    portal_url = f"http://127.0.0.1:{portal_port}"
+    scenarios = build_scenarios(args.sources, smart_url=f"{portal_url}{_SMART_PATH}")
+    if args.scenarios:
+        names = args.scenarios.split(",")
+        scenarios = [s for s in scenarios if s.name in names]
+
+    portal_data = {}
+    for scenario in scenarios:
+        portal_data.update(scenario.portal_data)
+    ready = multiprocessing.Event()
+    servers = multiprocessing.Process(
+        target=_run_fake_servers,
+        kwargs=dict(
+            portal_port=portal_port,
+            pubsub_port=pubsub_port,
+            portal_data=portal_data,
+            portal_latency=args.portal_latency_ms / 1000,
+            pubsub_latency=args.pubsub_latency_ms / 1000,
+            ready=ready,
+        ),
+        daemon=True,
+    )
+    servers.start()
+    ready.wait(timeout=30)
+
+    # The portal and PubSub clients read their endpoints when they are created
+    os.environ.update(
+        KEYCLOAK_ISSUER=f"{portal_url}/realms/benchmark",
+        KEYCLOAK_CLIENT_ID="benchmark",
+        KEYCLOAK_CLIENT_SECRET="benchmark",
+        KEYCLOAK_AUDIENCE="benchmark",
+        CDIP_ADMIN_ENDPOINT=portal_url,
+        GUNDI_API_BASE_URL=f"{portal_url}/api",
+        PUBSUB_EMULATOR_HOST=f"127.0.0.1:{pubsub_port}",
+    )
+
+    print(
+        f"Target: {args.target}, {args.messages} messages per scenario, concurrency {args.concurrency}. "
+        f"Latency: Redis {args.redis_latency_ms} ms, portal {args.portal_latency_ms} ms, "
+        f"PubSub {args.pubsub_latency_ms} ms"
+    )
+    try:
+        results, redis = asyncio.run(
+            run(args, scenarios, pubsub_url=f"http://127.0.0.1:{pubsub_port}")
+        )
+    finally:
+        servers.terminate()
+    _print_results(results, redis)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""
+Micro-benchmark of the per-message tracing overhead, by sampling configuration.
+
+Each message opens the nested spans of the routing of a v2 observation, with
+their attributes, through the span processor and sampler of app.core.tracing.
+Spans are exported to a no-op exporter, so only the in-process cost is measured.
+
+    python -m app.benchmarks.tracing [--iterations 20000] [--ratio 0.01]
+"""
+import argparse
+import timeit
+import uuid
+from unittest import mock
+
+from opentelemetry.sdk.trace import TracerProvider
+from opentelemetry.sdk.trace.export import SpanExporter, SpanExportResult
+from opentelemetry.trace import SpanKind
+
+from app.core import settings
+from app.core.tracing.config import (
+    Tracer,
+    build_sampler,
+    build_span_processor,
+    skip_spans,
+)
+
+
+class _NoOpExporter(SpanExporter):
+    def export(self, spans):
+        return SpanExportResult.SUCCESS
+
+    def shutdown(self):
+        pass
+
+
+_SPANS = (
+    ("routing_service.process_request", SpanKind.CLIENT),
+    ("routing_service.process_observations_event", SpanKind.CONSUMER),
+    ("routing_service.handle_observation_received", SpanKind.CONSUMER),
+    ("routing_service.transform_and_route_observation", SpanKind.CONSUMER),
+    ("routing_service.send_message_to_gcp_pubsub_dispatcher", SpanKind.PRODUCER),
+)
+
+
+def _build_tracer(ratio):
+    with mock.patch.object(settings, "TRACE_SAMPLE_RATIO", ratio), mock.patch.object(
+        settings, "TRACE_SAMPLE_RATIOS_BY_STREAM_TYPE", {}
+    ):
+        provider = TracerProvider(sampler=build_sampler())
+    provider.add_span_processor(build_span_processor(_NoOpExporter()))
+    return provider, Tracer(provider.get_tracer("benchmark"))
+
+
+def _message(tracer, depth=0):
+    name, kind = _SPANS[depth]
+    attributes = {"observation_type": "obv"} if depth == 0 else None
+    with tracer.start_as_current_span(name, kind=kind, attributes=attributes) as span:
+        span.set_attribute("environment", settings.TRACE_ENVIRONMENT)
+        span.set_attribute("destination_id", str(uuid.uuid4()))
+        span.add_event(name=f"{name}.done")
+        if depth + 1 < len(_SPANS):
+            _message(tracer, depth + 1)
+
+
+def _lightweight_message(tracer):
+    with skip_spans():
+        _message(tracer)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--iterations", type=int, default=20000)
+    parser.add_argument("--ratio", type=float, default=0.01)
+    args = parser.parse_args()
+
+    full_provider, full_tracer = _build_tracer(1.0)
+    sampled_provider, sampled_tracer = _build_tracer(args.ratio)
+    print(f"Spans per message: {len(_SPANS)}")
+    results = {}
+    for name, func, tracer in (
+        ("full", _message, full_tracer),
+        (f"ratio {args.ratio}", _message, sampled_tracer),
+        ("lightweight", _lightweight_message, full_tracer),
+    ):
+        seconds = min(
+            timeit.repeat(lambda: func(tracer), number=args.iterations, repeat=3)
+        )
+        results[name] = seconds / args.iterations * 1_000_000
+        print(f"{name:>12}: {results[name]:.1f} µs/message")
+    full_provider.shutdown()
+    sampled_provider.shutdown()
+
+
+if __name__ == "__main__":
+    main()
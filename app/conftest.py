@@ -11,7 +11,12 @@ from pydantic.types import UUID
 from redis import exceptions as redis_exceptions
 from smartconnect import SMARTClientException
 
+from app.core import cache
+from app.core import deduplication
 from app.core.deduplication import EventProcessingStatus
+from app.services.activity_logger import activity_log_emitter
+from app.services.smart_datamodels import smart_datamodels
+from app.services.transformers import transformer_pool
 
 
 def async_return(result):
@@ -20,12 +25,42 @@ def async_return(result):
     return f
 
 
+def mock_event_claims(mock_cache, *claims):
+    """Make the claim script return `claims` in turn (0 if acquired, the current value otherwise), then 0."""
+    claims = iter(claims)
+
+    def eval(script, numkeys, *args):
+        if script == deduplication._CLAIM_EVENT_SCRIPT:
+            return async_return(next(claims, 0))
+        return async_return(1)  # The claim is still ours
+
+    mock_cache.eval.side_effect = eval
+
+
+@pytest.fixture(autouse=True)
+def clear_local_caches():
+    # Don't leak reference data cached in-process from one test to another
+    for local_cache in (
+        cache.connections_cache,
+        cache.routes_cache,
+        cache.integrations_cache,
+        cache.routing_plans_cache,
+        cache.field_mapping_rules_cache,
+    ):
+        local_cache.clear()
+    transformer_pool.clear()
+    smart_datamodels.clear()
+    activity_log_emitter.clear()
+
+
 @pytest.fixture
 def mock_cache(mocker):
     mock_cache = mocker.MagicMock()
-    mock_cache.set.return_value = async_return(None)
+    mock_cache.set.return_value = async_return(True)
     mock_cache.get.return_value = async_return(None)
+    mock_cache.mget.side_effect = lambda keys: async_return([None] * len(keys))
     mock_cache.setex.return_value = async_return(None)
+    mock_cache.eval.return_value = async_return(1)
     mock_cache.incr.return_value = mock_cache
     mock_cache.decr.return_value = async_return(None)
     mock_cache.expire.return_value = mock_cache
@@ -40,7 +75,15 @@ def mock_cache(mocker):
 def mock_deduplication_cache_empty(mocker):
     mock_cache = mocker.MagicMock()
     mock_cache.get.return_value = async_return(None)
+    mock_cache.set.return_value = async_return(True)
     mock_cache.setex.return_value = async_return(None)
+    mock_cache.delete.return_value = async_return(1)
+    mock_cache.hmget.side_effect = lambda key, fields: async_return(
+        [None] * len(fields)
+    )
+    mock_cache.pipeline.return_value = mock_cache
+    mock_cache.execute.return_value = async_return([1, True])
+    mock_event_claims(mock_cache)
     mock_cache.__aenter__.return_value = mock_cache
     mock_cache.__aexit__.return_value = None
     return mock_cache
@@ -49,11 +92,15 @@ def mock_deduplication_cache_empty(mocker):
 @pytest.fixture
 def mock_deduplication_cache_one_miss(mocker):
     mock_cache = mocker.MagicMock()
-    mock_cache.get.side_effect = (
-        async_return(None),
-        async_return("1"),
-    )
+    # The first claim is acquired, the second finds the event processed
+    mock_event_claims(mock_cache, 0, str(EventProcessingStatus.PROCESSED.value))
     mock_cache.setex.return_value = async_return(None)
+    mock_cache.delete.return_value = async_return(1)
+    mock_cache.hmget.side_effect = lambda key, fields: async_return(
+        [None] * len(fields)
+    )
+    mock_cache.pipeline.return_value = mock_cache
+    mock_cache.execute.return_value = async_return([1, True])
     mock_cache.__aenter__.return_value = mock_cache
     mock_cache.__aexit__.return_value = None
     return mock_cache
@@ -3260,3 +3307,22 @@ def eventarc_request_headers():
         "ce-type": "google.cloud.pubsub.topic.v1.messagePublished",
         "ce-time": timestamp,
     }
+
+
+@pytest.fixture
+def smart_transformation_rules():
+    return schemas_v2.SMARTTransformationRules.parse_obj(
+        {
+            "category_map": [
+                {"event_type": "poacher_camp", "category_path": "humanactivity.people"}
+            ],
+            "attribute_map": [
+                {
+                    "from_key": "camp_state",
+                    "to_key": "wildlifestate",
+                    "options_map": [{"from_key": "active", "to_key": "alive"}],
+                    "default_option": "unknown",
+                }
+            ],
+        }
+    )
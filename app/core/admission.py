@@ -0,0 +1,103 @@
+"""
+Admission control for the push endpoint.
+
+Every request in flight holds Redis, portal and PubSub connections, so under a
+burst accepting them all slows down every message. Up to `max_in_flight`
+requests are processed at a time. Above that, requests wait in a FIFO queue for
+up to `queue_timeout` seconds. A request is rejected with 429 if the queue is
+full, and with 503 if it can't be admitted in time. Either way PubSub
+redelivers it later with backoff, instead of it timing out in the middle of
+processing.
+"""
+import asyncio
+import logging
+from collections import deque
+from contextlib import asynccontextmanager
+
+from fastapi import status
+
+from app.core import metrics, settings
+from app.core.errors import AdmissionRejected
+
+
+logger = logging.getLogger(__name__)
+
+
+class AdmissionController:
+    def __init__(self, *, max_in_flight, max_queued, queue_timeout):
+        self.max_in_flight = max_in_flight
+        self.max_queued = max_queued
+        self.queue_timeout = queue_timeout
+        self.in_flight = 0
+        self.rejected = 0
+        self._waiters = deque()
+
+    @property
+    def queued(self):
+        return len(self._waiters)
+
+    def _reject(self, reason, status_code):
+        self.rejected += 1
+        metrics.rejected_requests.labels(reason=reason).inc()
+        raise AdmissionRejected(reason, status_code)
+
+    async def acquire(self):
+        if not self.max_in_flight or (
+            self.in_flight < self.max_in_flight and not self._waiters
+        ):
+            self.in_flight += 1
+            return
+        if len(self._waiters) >= self.max_queued:
+            self._reject("queue_full", status.HTTP_429_TOO_MANY_REQUESTS)
+        # Futures are created per request, so the controller isn't bound to an event loop
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        metrics.queued_requests.set(len(self._waiters))
+        try:
+            # The slot is handed over by release(), in_flight is already counted
+            await asyncio.wait_for(waiter, timeout=self.queue_timeout)
+        except asyncio.TimeoutError:
+            self._reject("queue_timeout", status.HTTP_503_SERVICE_UNAVAILABLE)
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                self.release()  # Admitted just before being cancelled
+            raise
+        finally:
+            try:
+                self._waiters.remove(waiter)
+            except ValueError:
+                pass
+            metrics.queued_requests.set(len(self._waiters))
+
+    def release(self):
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.in_flight -= 1
+
+    @asynccontextmanager
+    async def admit(self):
+        """Hold a slot while the block runs. Raises AdmissionRejected under overload."""
+        await self.acquire()
+        metrics.in_flight_requests.set(self.in_flight)
+        try:
+            yield
+        finally:
+            self.release()
+            metrics.in_flight_requests.set(self.in_flight)
+
+    def stats(self):
+        return {
+            "in_flight": self.in_flight,
+            "queued": self.queued,
+            "rejected": self.rejected,
+        }
+
+
+admission_controller = AdmissionController(
+    max_in_flight=settings.ADMISSION_MAX_IN_FLIGHT,
+    max_queued=settings.ADMISSION_MAX_QUEUED,
+    queue_timeout=settings.ADMISSION_QUEUE_TIMEOUT_SECONDS,
+)
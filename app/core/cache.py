@@ -0,0 +1,248 @@
+"""
+Caching helpers for reference data.
+
+`LocalCache` is an in-process (L1) cache in front of Redis. It stores already
+parsed objects so that hot lookups don't touch the network or pydantic.
+
+`get_or_refresh` protects the portal from stampedes when a Redis key expires:
+concurrent lookups of the same key in a process share one refresh, and a
+short Redis lock lets a single instance refresh it while others wait for the
+new value or fall back to the previous one.
+"""
+import asyncio
+import logging
+import random
+import time
+import uuid
+from collections import OrderedDict
+
+from app.core import settings
+
+
+logger = logging.getLogger(__name__)
+
+
+class LocalCache:
+    def __init__(self, *, name, maxsize, ttl):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+
+    @property
+    def enabled(self):
+        return self.maxsize > 0 and self.ttl > 0
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key, value, ttl=None):
+        if not self.enabled or value is None:
+            return
+        self._entries[key] = (time.monotonic() + (ttl or self.ttl), value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, key):
+        self._entries.pop(key, None)
+
+    def clear(self):
+        self._entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        return {
+            "name": self.name,
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+connections_cache = LocalCache(
+    name="connections",
+    maxsize=settings.L1_CACHE_MAX_CONNECTIONS,
+    ttl=settings.L1_CACHE_CONNECTION_TTL,
+)
+routes_cache = LocalCache(
+    name="routes",
+    maxsize=settings.L1_CACHE_MAX_ROUTES,
+    ttl=settings.L1_CACHE_ROUTE_TTL,
+)
+integrations_cache = LocalCache(
+    name="integrations",
+    maxsize=settings.L1_CACHE_MAX_INTEGRATIONS,
+    ttl=settings.L1_CACHE_INTEGRATION_TTL,
+)
+routing_plans_cache = LocalCache(
+    name="routing_plans",
+    maxsize=settings.ROUTING_PLAN_CACHE_MAX_SIZE,
+    ttl=settings.ROUTING_PLAN_CACHE_TTL,
+)
+field_mapping_rules_cache = LocalCache(
+    name="field_mapping_rules",
+    maxsize=settings.FIELD_MAPPING_RULES_CACHE_MAX_SIZE,
+    ttl=settings.FIELD_MAPPING_RULES_CACHE_TTL,
+)
+
+
+def jittered_ttl(ttl):
+    """Add random jitter to a TTL so keys written together don't expire in lockstep."""
+    jitter = int(ttl * settings.CACHE_TTL_JITTER_RATIO)
+    return ttl + random.randint(0, jitter) if jitter > 0 else ttl
+
+
+def get_stale_key(cache_key):
+    return f"stale.{cache_key}"
+
+
+def get_lock_key(cache_key):
+    return f"lock.{cache_key}"
+
+
+async def write_cache_entry(cache_db, cache_key, ttl, data):
+    """Write a cache entry with jitter, plus a longer-lived copy used as fallback while it's refreshed."""
+    # Both in one round trip, so the copies don't diverge if a write fails
+    pipe = cache_db.pipeline(transaction=True)
+    pipe.setex(cache_key, jittered_ttl(ttl), data)
+    pipe.setex(get_stale_key(cache_key), settings.CACHE_STALE_TTL, data)
+    await pipe.execute()
+
+
+_in_flight = {}
+
+
+async def single_flight(key, fetch):
+    """Run `fetch()` once for all the concurrent callers using the same key."""
+    if (future := _in_flight.get(key)) is None:
+        future = asyncio.ensure_future(fetch())
+        _in_flight[key] = future
+        future.add_done_callback(lambda f: _in_flight.pop(key, None))
+    # Shield it so a cancelled caller doesn't cancel the lookup for the others
+    return await asyncio.shield(future)
+
+
+# Delete the lock only if it's still ours (it may have expired and been taken by another instance)
+_RELEASE_LOCK_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+end
+return 0
+"""
+
+
+async def _acquire_lock(cache_db, lock_key, token):
+    try:
+        return await cache_db.set(
+            lock_key,
+            token,
+            px=int(settings.CACHE_LOCK_TTL_SECONDS * 1000),
+            nx=True,
+        )
+    except Exception as e:
+        # Don't block lookups if Redis is unavailable
+        logger.warning(
+            f"Error acquiring cache lock '{lock_key}': {type(e).__name__}: {e}"
+        )
+        return True
+
+
+async def _release_lock(cache_db, lock_key, token):
+    try:
+        await cache_db.eval(_RELEASE_LOCK_SCRIPT, 1, lock_key, token)
+    except Exception as e:
+        # It will expire anyway
+        logger.warning(
+            f"Error releasing cache lock '{lock_key}': {type(e).__name__}: {e}"
+        )
+
+
+async def _load_stale(cache_db, cache_key, load_cached):
+    """Return the previous value of a key, if any, while it can't be refreshed."""
+    if stale := await cache_db.get(get_stale_key(cache_key)):
+        logger.info(f"Using stale cache entry for '{cache_key}' while it's refreshed.")
+        return load_cached(stale)
+    return None
+
+
+async def _fetch_or_load_stale(cache_db, cache_key, fetch, load_cached):
+    try:
+        if (result := await fetch()) is not None:
+            return result
+    except Exception as e:
+        try:
+            stale = await _load_stale(cache_db, cache_key, load_cached)
+        except Exception:
+            stale = None
+        if stale is None:
+            raise
+        logger.warning(
+            f"Error refreshing cache key '{cache_key}': {type(e).__name__}: {e}"
+        )
+        return stale
+    try:
+        return await _load_stale(cache_db, cache_key, load_cached)
+    except Exception as e:
+        logger.warning(
+            f"Error reading stale cache key '{cache_key}': {type(e).__name__}: {e}"
+        )
+        return None
+
+
+async def _load_with_lock(cache_db, cache_key, fetch, load_cached):
+    lock_key = get_lock_key(cache_key)
+    token = uuid.uuid4().hex
+    if await _acquire_lock(cache_db, lock_key, token):
+        try:
+            return await _fetch_or_load_stale(cache_db, cache_key, fetch, load_cached)
+        finally:
+            await _release_lock(cache_db, lock_key, token)
+
+    # Another instance is refreshing the key. Wait briefly for the new value.
+    loop = asyncio.get_event_loop()
+    deadline = loop.time() + settings.CACHE_LOCK_WAIT_SECONDS
+    try:
+        while loop.time() < deadline:
+            await asyncio.sleep(settings.CACHE_LOCK_POLL_INTERVAL_SECONDS)
+            if cached := await cache_db.get(cache_key):
+                return load_cached(cached)
+        # Use the previous value, if any
+        if (stale := await _load_stale(cache_db, cache_key, load_cached)) is not None:
+            return stale
+    except Exception as e:
+        logger.warning(
+            f"Error waiting for cache key '{cache_key}': {type(e).__name__}: {e}"
+        )
+    return await fetch()
+
+
+async def get_or_refresh(*, cache_db, cache_key, fetch, load_cached):
+    """
+    Refresh a missing cache entry with `fetch()` (which must also write it to the cache),
+    making sure only one caller per process and one process at a time do it.
+    `load_cached` parses an entry written by another instance. If the entry can't be
+    refreshed (`fetch()` returns None or fails), the previous value is used, if any.
+    """
+    return await single_flight(
+        cache_key,
+        lambda: _load_with_lock(cache_db, cache_key, fetch, load_cached),
+    )
@@ -0,0 +1,82 @@
+"""
+JSON codec used for PubSub envelopes and attributes, tracing context and cache entries.
+
+Uses orjson when it's installed (it serializes UUIDs and enums natively) and falls
+back to the stdlib json module otherwise. Both backends produce the same output,
+which matches what was sent with `json.dumps(obj, default=str)` before: datetimes
+as `str(value)` (i.e. "2023-07-11 18:19:19+00:00", not the "T" separated ISO
+format), UUIDs and unknown types as strings, and pydantic models as their dict
+representation. Only the whitespace differs, as the output is compact.
+"""
+import json
+import uuid
+from enum import Enum
+
+import pydantic
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+
+def _default(obj):
+    if isinstance(obj, pydantic.BaseModel):
+        return obj.dict()
+    return str(obj)
+
+
+def _stdlib_default(obj):
+    if isinstance(obj, uuid.UUID):
+        return str(obj)
+    if isinstance(obj, Enum):
+        return obj.value
+    return _default(obj)
+
+
+if orjson is not None:
+    BACKEND = "orjson"
+    # Datetimes are passed to _default, to keep the format of str()
+    _OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+
+    def dumps(obj) -> bytes:
+        return orjson.dumps(obj, default=_default, option=_OPTIONS)
+
+    def loads(data):
+        return orjson.loads(data)
+
+else:
+    BACKEND = "json"
+
+    def dumps(obj) -> bytes:
+        return json.dumps(obj, default=_stdlib_default, separators=(",", ":")).encode(
+            "utf-8"
+        )
+
+    def loads(data):
+        return json.loads(data)
+
+
+def dumps_str(obj) -> str:
+    return dumps(obj).decode("utf-8")
+
+
+def to_jsonable(obj):
+    """Convert UUIDs, datetimes and other complex types to their JSON representation."""
+    return loads(dumps(obj))
+
+
+def dump_model(instance: pydantic.BaseModel) -> bytes:
+    """
+    Serialize a model as `json.dumps(instance.dict(), default=str)` did.
+
+    Unlike `instance.json()`, the `json_encoders` of the model's Config are not
+    applied, as they weren't when models were published that way. Use
+    `instance.json()` for a model whose encoders matter.
+    """
+    return dumps(instance.dict())
+
+
+def parse_model(model_class, data):
+    """Equivalent to `model_class.parse_raw(data)` using the fast backend."""
+    return model_class.parse_obj(loads(data))
@@ -1,10 +1,12 @@
+import asyncio
 import logging
+import uuid
 from enum import Enum, IntEnum
 
 import backoff
 from redis import exceptions as redis_exceptions
 
-from app.core import settings
+from app.core import metrics, settings
 from app.core.utils import get_redis_db
 
 
@@ -17,12 +19,22 @@ _cache_db = get_redis_db()
 class EventProcessingStatus(IntEnum):
     PROCESSED = 1
     UNPROCESSED = 0
+    IN_PROGRESS = 2
 
 
 def get_event_status_key(event_id):
     return f"processed_events.{event_id}"
 
 
+def parse_event_status(value) -> EventProcessingStatus:
+    # A claim holds the status and the token of the instance holding it: "2:<token>"
+    return EventProcessingStatus(int(str(value).split(":", 1)[0]))
+
+
+def get_deliveries_key(event_id):
+    return f"delivered_events.{event_id}"
+
+
 async def get_event_processing_status(event_id) -> EventProcessingStatus:
     @backoff.on_exception(backoff.expo, redis_exceptions.RedisError, max_time=10)
     async def read_from_redis(key):
@@ -35,7 +47,7 @@ async def get_event_processing_status(event_id) -> EventProcessingStatus:
     key = get_event_status_key(event_id)
     try:
         value = await read_from_redis(key) or 0
-        status = EventProcessingStatus(int(value))
+        status = parse_event_status(value)
     except redis_exceptions.RedisError as e:
         logger.warning(
             f"RedisError while reading key '{key}' from Redis:{type(e)} \n {e}",
@@ -72,3 +84,261 @@ async def set_event_processing_status(event_id, status: EventProcessingStatus):
 async def is_event_processed(event_id):
     status = await get_event_processing_status(event_id)
     return status == EventProcessingStatus.PROCESSED
+
+
+# Claim the event unless it's claimed or processed already. Returns 0 if claimed, the current value otherwise.
+_CLAIM_EVENT_SCRIPT = """
+if redis.call("set", KEYS[1], ARGV[1], "NX", "EX", ARGV[2]) then
+    return 0
+end
+return redis.call("get", KEYS[1])
+"""
+
+# A claim is extended, completed or released only by the instance holding it
+# (it may have expired and been taken by another instance)
+_EXTEND_CLAIM_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("expire", KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+_COMPLETE_CLAIM_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    redis.call("set", KEYS[1], ARGV[2], "EX", ARGV[3])
+    return 1
+end
+return 0
+"""
+
+_RELEASE_CLAIM_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+end
+return 0
+"""
+
+
+@backoff.on_exception(backoff.expo, redis_exceptions.RedisError, max_time=10)
+async def _run_script(script, key, *args):
+    return await _cache_db.eval(script, 1, key, *args)
+
+
+def get_claim_value(token):
+    return f"{EventProcessingStatus.IN_PROGRESS.value}:{token}"
+
+
+async def claim_event(event_id, token) -> EventProcessingStatus:
+    """
+    Atomically claim an event for processing, in a single round trip.
+
+    The claim is a SET NX with a short TTL, so only one instance processes an event
+    at a time, and a claim left by an instance that died expires on its own.
+    Returns UNPROCESSED if the claim was acquired. Otherwise the event's status,
+    so duplicates (PROCESSED) can be told apart from events that another
+    instance is processing (IN_PROGRESS).
+    If Redis is unavailable the event is processed, as deduplication is best effort.
+    """
+    if not event_id:
+        return EventProcessingStatus.UNPROCESSED
+
+    key = get_event_status_key(event_id)
+    try:
+        value = await _run_script(
+            _CLAIM_EVENT_SCRIPT,
+            key,
+            get_claim_value(token),
+            settings.EVENT_PROCESSING_CLAIM_TTL,
+        )
+        if value == 0:
+            return EventProcessingStatus.UNPROCESSED
+        return parse_event_status(value)
+    except redis_exceptions.RedisError as e:
+        logger.warning(
+            f"RedisError while claiming key '{key}' in Redis:{type(e)} \n {e}",
+        )
+    except Exception as e:
+        logger.warning(
+            f"Unknown Error while claiming key '{key}' in Redis:{type(e)} \n {e}",
+        )
+    return EventProcessingStatus.UNPROCESSED
+
+
+async def extend_claim(event_id, token) -> bool:
+    """Reset the TTL of the claim of an event that is still being processed. Returns False if the claim was lost."""
+    if not event_id:
+        return True
+
+    key = get_event_status_key(event_id)
+    try:
+        return bool(
+            await _cache_db.eval(
+                _EXTEND_CLAIM_SCRIPT,
+                1,
+                key,
+                get_claim_value(token),
+                settings.EVENT_PROCESSING_CLAIM_TTL,
+            )
+        )
+    except Exception as e:
+        # The next attempt may succeed before the claim expires
+        logger.warning(
+            f"Error while extending the claim of key '{key}' in Redis:{type(e)} \n {e}",
+        )
+    return True
+
+
+async def complete_event(event_id, token):
+    """Mark a claimed event as PROCESSED, if the claim is still ours."""
+    if not event_id:
+        return
+
+    key = get_event_status_key(event_id)
+    try:
+        await _run_script(
+            _COMPLETE_CLAIM_SCRIPT,
+            key,
+            get_claim_value(token),
+            EventProcessingStatus.PROCESSED.value,
+            settings.EVENT_PROCESSING_STATUS_TTL,
+        )
+    except redis_exceptions.RedisError as e:
+        logger.warning(
+            f"RedisError while writing status for key '{key}' from Redis:{type(e)} \n {e}",
+        )
+    except Exception as e:
+        logger.warning(
+            f"Unknown Error while writing status for key '{key}' from Redis:{type(e)} \n {e}",
+        )
+
+
+async def release_event(event_id, token):
+    """Drop the claim of an event that failed, if it's still ours, so a redelivery can process it."""
+    if not event_id:
+        return
+
+    key = get_event_status_key(event_id)
+    try:
+        await _run_script(_RELEASE_CLAIM_SCRIPT, key, get_claim_value(token))
+    except redis_exceptions.RedisError as e:
+        logger.warning(
+            f"RedisError while releasing key '{key}' in Redis:{type(e)} \n {e}",
+        )
+    except Exception as e:
+        logger.warning(
+            f"Unknown Error while releasing key '{key}' in Redis:{type(e)} \n {e}",
+        )
+
+
+async def get_delivered_destinations(event_id, destination_ids) -> set:
+    """
+    The destinations an event was delivered to already, read in a single round trip.
+
+    A message is retried as a whole when one of its destinations fails, and the
+    ledger lets the retry skip the destinations that got it the first time.
+    The ledger of an event is a hash with a field per destination delivered.
+    """
+
+    @backoff.on_exception(backoff.expo, redis_exceptions.RedisError, max_time=10)
+    async def read_from_redis(key, fields):
+        return await _cache_db.hmget(key, fields)
+
+    destination_ids = [str(destination_id) for destination_id in destination_ids]
+    if not event_id or not destination_ids:
+        return set()
+
+    try:
+        values = await read_from_redis(get_deliveries_key(event_id), destination_ids)
+    except redis_exceptions.RedisError as e:
+        logger.warning(
+            f"RedisError while reading deliveries of event '{event_id}' from Redis:{type(e)} \n {e}",
+        )
+        return set()
+    except Exception as e:
+        logger.warning(
+            f"Unknown Error while reading deliveries of event '{event_id}' from Redis:{type(e)} \n {e}",
+        )
+        return set()
+    return {
+        destination_id
+        for destination_id, value in zip(destination_ids, values or [])
+        if value
+    }
+
+
+async def set_destination_delivered(event_id, destination_id):
+    @backoff.on_exception(backoff.expo, redis_exceptions.RedisError, max_time=10)
+    async def write_to_redis(key, field, ttl):
+        pipe = _cache_db.pipeline(transaction=True)
+        pipe.hset(key, field, 1)
+        pipe.expire(key, ttl)
+        return await pipe.execute()
+
+    if not event_id:
+        return
+
+    key = get_deliveries_key(event_id)
+    try:
+        await write_to_redis(key, str(destination_id), settings.DELIVERY_LEDGER_TTL)
+    except redis_exceptions.RedisError as e:
+        logger.warning(
+            f"RedisError while writing delivery to '{destination_id}' for key '{key}' in Redis:{type(e)} \n {e}",
+        )
+    except Exception as e:
+        logger.warning(
+            f"Unknown Error while writing delivery to '{destination_id}' for key '{key}' in Redis:{type(e)} \n {e}",
+        )
+
+
+class EventClaim:
+    """
+    Async context manager that holds the claim of an event while it's processed.
+
+        async with EventClaim(event_id) as claim:
+            if not claim.acquired:
+                ...  # Processed already, or being processed elsewhere (see `status`)
+
+    The claim's TTL is extended periodically while the block runs, so a slow event
+    isn't claimed by a redelivery meanwhile. When the block exits normally the event
+    is marked as PROCESSED. If it raises, the claim is released so the message can be retried.
+    Each claim has its own token, so a claim that expired and was taken by another
+    instance is left alone.
+    """
+
+    def __init__(self, event_id):
+        self.event_id = event_id
+        self.token = uuid.uuid4().hex
+        self.status = None
+        self._keep_alive = None
+
+    @property
+    def acquired(self):
+        return self.status == EventProcessingStatus.UNPROCESSED
+
+    async def __aenter__(self):
+        with metrics.timer(metrics.dedup_seconds):
+            self.status = await claim_event(self.event_id, self.token)
+        if self.acquired and self.event_id:
+            self._keep_alive = asyncio.ensure_future(self._extend_claim())
+        return self
+
+    async def _extend_claim(self):
+        interval = settings.EVENT_PROCESSING_CLAIM_TTL / 3
+        while True:
+            await asyncio.sleep(interval)
+            if not await extend_claim(self.event_id, self.token):
+                logger.warning(
+                    f"The claim of event '{self.event_id}' expired while it was processed."
+                )
+                return
+
+    async def __aexit__(self, exc_type, exc, tb):
+        if self._keep_alive:
+            self._keep_alive.cancel()
+        if not self.acquired:
+            return False
+        if exc_type is None:
+            await complete_event(self.event_id, self.token)
+        else:
+            await release_event(self.event_id, self.token)
+        return False
@@ -16,3 +16,16 @@ class IndeterminableCAException(Exception):
 
 class ObservationUUIDValueException(Exception):
     pass
+
+
+class AdmissionRejected(Exception):
+    def __init__(self, reason, status_code):
+        super().__init__(reason)
+        self.reason = reason
+        self.status_code = status_code
+
+
+class EventInProgress(Exception):
+    def __init__(self, event_id):
+        super().__init__(f"Event '{event_id}' is being processed by another instance")
+        self.event_id = event_id
@@ -1,12 +1,24 @@
+import asyncio
 import logging
+import time
 import aiohttp
-from typing import List
+from dataclasses import dataclass, field
+from functools import partial
+from typing import Dict, List, Optional
 from uuid import UUID
 import httpx
 from gundi_core import schemas
 from pydantic import BaseModel, parse_obj_as
 from redis import exceptions as redis_exceptions
 from app import settings
+from app.core import codec, metrics
+from app.core.cache import (
+    connections_cache,
+    routes_cache,
+    integrations_cache,
+    get_or_refresh,
+    write_cache_entry,
+)
 from app.core.local_logging import ExtraKeys
 from app.core.utils import (
     get_redis_db,
@@ -62,7 +74,7 @@ async def get_outbound_config_detail(
     cached = await _cache_db.get(cache_key)
 
     if cached:
-        config = schemas.OutboundConfiguration.parse_raw(cached)
+        config = codec.parse_model(schemas.OutboundConfiguration, cached)
         logger.debug(
             "Using cached outbound integration detail",
             extra={
@@ -75,6 +87,20 @@ async def get_outbound_config_detail(
 
     logger.debug(f"Cache miss for outbound integration detail", extra={**extra_dict})
 
+    return await get_or_refresh(
+        cache_db=_cache_db,
+        cache_key=cache_key,
+        fetch=partial(
+            _fetch_outbound_config_detail,
+            outbound_id=outbound_id,
+            cache_key=cache_key,
+            extra_dict=extra_dict,
+        ),
+        load_cached=partial(codec.parse_model, schemas.OutboundConfiguration),
+    )
+
+
+async def _fetch_outbound_config_detail(*, outbound_id, cache_key, extra_dict):
     try:
         response = await _portal.get_outbound_integration(
             integration_id=str(outbound_id)
@@ -124,7 +150,9 @@ async def get_outbound_config_detail(
             )
         else:
             if config:  # don't cache empty response
-                await _cache_db.setex(cache_key, _cache_ttl, config.json())
+                await write_cache_entry(
+                    _cache_db, cache_key, _cache_ttl, codec.dump_model(config)
+                )
             return config
 
 
@@ -143,7 +171,7 @@ async def get_inbound_integration_detail(
     cached = await _cache_db.get(cache_key)
 
     if cached:
-        config = schemas.IntegrationInformation.parse_raw(cached)
+        config = codec.parse_model(schemas.IntegrationInformation, cached)
         logger.debug(
             "Using cached inbound integration detail",
             extra={**extra_dict, "integration_detail": config},
@@ -152,6 +180,20 @@ async def get_inbound_integration_detail(
 
     logger.debug(f"Cache miss for inbound integration detai", extra={**extra_dict})
 
+    return await get_or_refresh(
+        cache_db=_cache_db,
+        cache_key=cache_key,
+        fetch=partial(
+            _fetch_inbound_integration_detail,
+            integration_id=integration_id,
+            cache_key=cache_key,
+            extra_dict=extra_dict,
+        ),
+        load_cached=partial(codec.parse_model, schemas.IntegrationInformation),
+    )
+
+
+async def _fetch_inbound_integration_detail(*, integration_id, cache_key, extra_dict):
     try:
         response = await _portal.get_inbound_integration(
             integration_id=str(integration_id)
@@ -197,7 +239,9 @@ async def get_inbound_integration_detail(
             )
         else:
             if config:  # don't cache empty response
-                await _cache_db.setex(cache_key, _cache_ttl, config.json())
+                await write_cache_entry(
+                    _cache_db, cache_key, _cache_ttl, codec.dump_model(config)
+                )
             return config
 
 
@@ -205,6 +249,10 @@ class OutboundConfigurations(BaseModel):
     configurations: List[schemas.OutboundConfiguration]
 
 
+def _load_cached_outbound_configurations(cached):
+    return codec.parse_model(OutboundConfigurations, cached).configurations
+
+
 async def get_all_outbound_configs_for_id(
     inbound_id: UUID, device_id
 ) -> List[schemas.OutboundConfiguration]:
@@ -217,7 +265,7 @@ async def get_all_outbound_configs_for_id(
     cached = await _cache_db.get(cache_key)
 
     if cached:
-        configs = OutboundConfigurations.parse_raw(cached).configurations
+        configs = _load_cached_outbound_configurations(cached)
         logger.debug(
             "Using cached destinations", extra={**extra_dict, "destinations": configs}
         )
@@ -225,6 +273,23 @@ async def get_all_outbound_configs_for_id(
 
     logger.debug(f"Cache miss for device_destinations", extra={**extra_dict})
 
+    return await get_or_refresh(
+        cache_db=_cache_db,
+        cache_key=cache_key,
+        fetch=partial(
+            _fetch_all_outbound_configs_for_id,
+            inbound_id=inbound_id,
+            device_id=device_id,
+            cache_key=cache_key,
+            extra_dict=extra_dict,
+        ),
+        load_cached=_load_cached_outbound_configurations,
+    )
+
+
+async def _fetch_all_outbound_configs_for_id(
+    *, inbound_id, device_id, cache_key, extra_dict
+):
     try:
         resp = await _portal.get_outbound_integration_list(
             inbound_id=str(inbound_id), device_id=str(device_id)
@@ -276,7 +341,9 @@ async def get_all_outbound_configs_for_id(
         else:
             configs = OutboundConfigurations(configurations=configurations)
             if configurations:  # don't cache empty response
-                await _cache_db.setex(cache_key, _cache_ttl, configs.json())
+                await write_cache_entry(
+                    _cache_db, cache_key, _cache_ttl, codec.dump_model(configs)
+                )
             return configs.configurations
 
 
@@ -336,7 +403,7 @@ async def ensure_device_integration(integration_id, device_id: str):
     cached = await _cache_db.get(cache_key)
 
     if cached:
-        device = schemas.Device.parse_raw(cached)
+        device = codec.parse_model(schemas.Device, cached)
         logger.info(
             "Using cached Device %s",
             device.external_id,
@@ -351,6 +418,23 @@ async def ensure_device_integration(integration_id, device_id: str):
         extra={"integration_id": integration_id, "device_id": device_id},
     )
 
+    return await get_or_refresh(
+        cache_db=_cache_db,
+        cache_key=cache_key,
+        fetch=partial(
+            _fetch_device_integration,
+            integration_id=integration_id,
+            device_id=device_id,
+            cache_key=cache_key,
+            extra_dict=extra_dict,
+        ),
+        load_cached=partial(codec.parse_model, schemas.Device),
+    )
+
+
+async def _fetch_device_integration(
+    *, integration_id, device_id, cache_key, extra_dict
+):
     try:
         device_data = await _portal.ensure_device(str(integration_id), device_id)
         if device_data:
@@ -365,7 +449,9 @@ async def ensure_device_integration(integration_id, device_id: str):
             )
 
         if device:  # don't cache empty response
-            await _cache_db.setex(cache_key, _cache_ttl, device.json())
+            await write_cache_entry(
+                _cache_db, cache_key, _cache_ttl, codec.dump_model(device)
+            )
         return device
 
     except Exception as e:
@@ -393,8 +479,9 @@ async def write_to_cache_safe(key, ttl, instance, extra_dict):
         logger.warning(
             f"[write_to_cache_safe]> Ignoring null instance.", extra={**extra_dict}
         )
+        return
     try:
-        await _cache_db.setex(key, ttl, instance.json())
+        await write_cache_entry(_cache_db, key, ttl, codec.dump_model(instance))
     except redis_exceptions.ConnectionError as e:
         logger.warning(
             f"ConnectionError while writing to Cache: {e}", extra={**extra_dict}
@@ -405,11 +492,38 @@ async def write_to_cache_safe(key, ttl, instance, extra_dict):
         )
 
 
+async def _fetch_connection(*, connection_id, cache_key, extra_dict):
+    connection = None
+    try:
+        connection = await portal_v2.get_connection_details(
+            integration_id=connection_id
+        )
+    except Exception as e:
+        logger.exception(
+            f"Error while getting connection from the portal:\n{type(e)}: {e}",
+            extra={**extra_dict},
+        )
+        await log_portal_lookup_error(
+            action_id="get_connection",
+            resource_id=connection_id,
+            exception=e,
+        )
+    else:
+        await write_to_cache_safe(
+            key=cache_key, ttl=_cache_ttl, instance=connection, extra_dict=extra_dict
+        )
+    return connection
+
+
 async def get_connection(*, connection_id):
     connection = None
     extra_dict = {"connection_id": connection_id}
+    start = time.perf_counter()
     try:
         cache_key = f"connection_detail.{connection_id}"
+        if connection := connections_cache.get(cache_key):
+            metrics.observe_lookup("get_connection", start, hit=True)
+            return connection
         try:
             cached_data = await _cache_db.get(cache_key)
         except Exception as e:
@@ -423,30 +537,25 @@ async def get_connection(*, connection_id):
                 "Connection details retrieved from cache.",
                 extra={**extra_dict, "cache_key": cache_key},
             )
-            connection = schemas.v2.Connection.parse_raw(cached_data)
+            connection = codec.parse_model(schemas.v2.Connection, cached_data)
         else:  # Not in cache, retrieve it from the portal
             logger.debug(
                 "Cache Miss. Retrieving connection details from the portal..",
                 extra={**extra_dict, "cache_key": cache_key},
             )
-            try:
-                connection = await portal_v2.get_connection_details(
-                    integration_id=connection_id
-                )
-            except Exception as e:
-                logger.exception(
-                    f"Error while getting connection from the portal:\n{type(e)}: {e}",
-                    extra={**extra_dict},
-                )
-                await log_portal_lookup_error(
-                    action_id="get_connection",
-                    resource_id=connection_id,
-                    exception=e,
-                )
-            else:
-                await write_to_cache_safe(
-                    key=cache_key, ttl=_cache_ttl, instance=connection, extra_dict=extra_dict
-                )
+            connection = await get_or_refresh(
+                cache_db=_cache_db,
+                cache_key=cache_key,
+                fetch=partial(
+                    _fetch_connection,
+                    connection_id=connection_id,
+                    cache_key=cache_key,
+                    extra_dict=extra_dict,
+                ),
+                load_cached=partial(codec.parse_model, schemas.v2.Connection),
+            )
+        metrics.observe_lookup("get_connection", start, hit=bool(cached_data))
+        connections_cache.set(cache_key, connection)
     except Exception as e:
         logger.exception(
             f"Internal Error while getting connection details:\n{type(e)}: {e}",
@@ -456,40 +565,63 @@ async def get_connection(*, connection_id):
         return connection
 
 
+async def _fetch_route(*, route_id, data_provider_id, cache_key, extra_dict):
+    route = None
+    try:
+        route = await portal_v2.get_route_details(route_id=route_id)
+    except Exception as e:
+        logger.exception(
+            f"Error while getting route details from the portal: {e}",
+            extra={**extra_dict},
+        )
+        if data_provider_id:
+            await log_portal_lookup_error(
+                action_id="get_route",
+                resource_id=data_provider_id,
+                exception=e,
+            )
+    else:
+        await write_to_cache_safe(
+            key=cache_key, ttl=_cache_ttl, instance=route, extra_dict=extra_dict
+        )
+    return route
+
+
 async def get_route(*, route_id, data_provider_id=None):
     route = None
     extra_dict = {"connection_id": route_id}
+    start = time.perf_counter()
     try:
         cache_key = f"route_detail.{route_id}"
+        if route := routes_cache.get(cache_key):
+            metrics.observe_lookup("get_route", start, hit=True)
+            return route
         cached_data = await _cache_db.get(cache_key)
         if cached_data:
             logger.debug(
                 "Route details retrieved from cache.",
                 extra={**extra_dict, "cache_key": cache_key},
             )
-            route = schemas.v2.Route.parse_raw(cached_data)
+            route = codec.parse_model(schemas.v2.Route, cached_data)
         else:  # Not in cache, retrieve it from the portal
             logger.debug(
                 "Cache Miss. Retrieving route details from the portal..",
                 extra={**extra_dict, "cache_key": cache_key},
             )
-            try:
-                route = await portal_v2.get_route_details(route_id=route_id)
-            except Exception as e:
-                logger.exception(
-                    f"Error while getting route details from the portal: {e}",
-                    extra={**extra_dict},
-                )
-                if data_provider_id:
-                    await log_portal_lookup_error(
-                        action_id="get_route",
-                        resource_id=data_provider_id,
-                        exception=e,
-                    )
-            else:
-                await write_to_cache_safe(
-                    key=cache_key, ttl=_cache_ttl, instance=route, extra_dict=extra_dict
-                )
+            route = await get_or_refresh(
+                cache_db=_cache_db,
+                cache_key=cache_key,
+                fetch=partial(
+                    _fetch_route,
+                    route_id=route_id,
+                    data_provider_id=data_provider_id,
+                    cache_key=cache_key,
+                    extra_dict=extra_dict,
+                ),
+                load_cached=partial(codec.parse_model, schemas.v2.Route),
+            )
+        metrics.observe_lookup("get_route", start, hit=bool(cached_data))
+        routes_cache.set(cache_key, route)
     except redis_exceptions.ConnectionError as e:
         logger.exception(
             f"ConnectionError while reading route details from Cache: {e}",
@@ -503,41 +635,63 @@ async def get_route(*, route_id, data_provider_id=None):
         return route
 
 
+async def _fetch_integration(*, integration_id, cache_key, extra_dict):
+    integration = None
+    try:
+        integration = await portal_v2.get_integration_details(
+            integration_id=integration_id
+        )
+    except Exception as e:
+        logger.exception(
+            f"Error while getting integration details from the portal: {e}",
+            extra={**extra_dict},
+        )
+        await log_portal_lookup_error(
+            action_id="get_integration",
+            resource_id=integration_id,
+            exception=e,
+        )
+    else:
+        await write_to_cache_safe(
+            key=cache_key, ttl=_cache_ttl, instance=integration, extra_dict=extra_dict
+        )
+    return integration
+
+
 async def get_integration(*, integration_id):
     integration = None
     extra_dict = {"integration_id": integration_id}
+    start = time.perf_counter()
     try:
         cache_key = f"integration_v2_detail.{integration_id}"
+        if integration := integrations_cache.get(cache_key):
+            metrics.observe_lookup("get_integration", start, hit=True)
+            return integration
         cached_data = await _cache_db.get(cache_key)
         if cached_data:
             logger.debug(
                 "Integration details retrieved from cache.",
                 extra={**extra_dict, "cache_key": cache_key},
             )
-            integration = schemas.v2.Integration.parse_raw(cached_data)
+            integration = codec.parse_model(schemas.v2.Integration, cached_data)
         else:  # Not in cache, retrieve it from the portal
             logger.debug(
                 "Cache Miss. Retrieving integration details from the portal..",
                 extra={**extra_dict, "cache_key": cache_key},
             )
-            try:
-                integration = await portal_v2.get_integration_details(
-                    integration_id=integration_id
-                )
-            except Exception as e:
-                logger.exception(
-                    f"Error while getting integration details from the portal: {e}",
-                    extra={**extra_dict},
-                )
-                await log_portal_lookup_error(
-                    action_id="get_integration",
-                    resource_id=integration_id,
-                    exception=e,
-                )
-            else:
-                await write_to_cache_safe(
-                    key=cache_key, ttl=_cache_ttl, instance=integration, extra_dict=extra_dict
-                )
+            integration = await get_or_refresh(
+                cache_db=_cache_db,
+                cache_key=cache_key,
+                fetch=partial(
+                    _fetch_integration,
+                    integration_id=integration_id,
+                    cache_key=cache_key,
+                    extra_dict=extra_dict,
+                ),
+                load_cached=partial(codec.parse_model, schemas.v2.Integration),
+            )
+        metrics.observe_lookup("get_integration", start, hit=bool(cached_data))
+        integrations_cache.set(cache_key, integration)
     except redis_exceptions.ConnectionError as e:
         logger.exception(
             f"ConnectionError while reading integration details from Cache: {e}",
@@ -550,3 +704,165 @@ async def get_integration(*, integration_id):
         )
     finally:
         return integration
+
+
+@dataclass
+class ResolvedRouting:
+    """Reference data needed to route a v2 message from a data provider."""
+
+    connection: Optional[schemas.v2.Connection] = None
+    route: Optional[schemas.v2.Route] = None
+    integrations: Dict[str, schemas.v2.Integration] = field(default_factory=dict)
+
+    def get_integration(self, integration_id):
+        return self.integrations.get(str(integration_id))
+
+
+@dataclass
+class _Lookup:
+    name: str  # For metrics, e.g. "get_route"
+    local_cache: object
+    cache_key: str
+    model: type
+    fetch: object
+
+
+async def _read_many_from_cache(cache_keys, extra_dict):
+    try:
+        return await _cache_db.mget(cache_keys)
+    except Exception as e:
+        logger.warning(
+            f"Error while reading {len(cache_keys)} keys from Cache: {type(e).__name__}: {e}",
+            extra={**extra_dict},
+        )
+        return [None] * len(cache_keys)
+
+
+def _parse_cached(lookup, cached_data, extra_dict):
+    try:
+        return codec.parse_model(lookup.model, cached_data)
+    except Exception as e:
+        logger.warning(
+            f"Error parsing cached data for '{lookup.cache_key}': {type(e).__name__}: {e}",
+            extra={**extra_dict},
+        )
+        return None
+
+
+async def _resolve_many(lookups, extra_dict):
+    """
+    Resolve several cache keys together: in-process cache first, then a single
+    MGET for what's missing, and finally concurrent portal lookups for the misses.
+    """
+    start = time.perf_counter()
+    values = [lookup.local_cache.get(lookup.cache_key) for lookup in lookups]
+    pending = [i for i, value in enumerate(values) if value is None]
+    for lookup, value in zip(lookups, values):
+        if value is not None:
+            metrics.observe_lookup(lookup.name, start, hit=True)
+    if not pending:
+        return values
+
+    cached_data = await _read_many_from_cache(
+        [lookups[i].cache_key for i in pending], extra_dict
+    )
+    misses = []
+    for i, data in zip(pending, cached_data):
+        if data and (value := _parse_cached(lookups[i], data, extra_dict)):
+            values[i] = value
+            metrics.observe_lookup(lookups[i].name, start, hit=True)
+        else:
+            misses.append(i)
+
+    if misses:
+        logger.debug(
+            f"Cache Miss. Retrieving {len(misses)} objects from the portal..",
+            extra={**extra_dict, "cache_keys": [lookups[i].cache_key for i in misses]},
+        )
+        fetched = await asyncio.gather(
+            *[
+                get_or_refresh(
+                    cache_db=_cache_db,
+                    cache_key=lookups[i].cache_key,
+                    fetch=lookups[i].fetch,
+                    load_cached=partial(codec.parse_model, lookups[i].model),
+                )
+                for i in misses
+            ],
+            return_exceptions=True,
+        )
+        for i, value in zip(misses, fetched):
+            metrics.observe_lookup(lookups[i].name, start, hit=False)
+            if isinstance(value, Exception):
+                logger.error(
+                    f"Error retrieving '{lookups[i].cache_key}': {type(value).__name__}: {value}",
+                    extra={**extra_dict},
+                )
+            else:
+                values[i] = value
+
+    for i in pending:
+        lookups[i].local_cache.set(lookups[i].cache_key, values[i])
+    return values
+
+
+async def resolve_routing(*, data_provider_id) -> ResolvedRouting:
+    """
+    Resolve the connection of a data provider, its default route and the
+    integrations of all its destinations. Once the connection is known, the route
+    and the integrations are read from Redis in one round trip and any cache
+    misses are retrieved from the portal concurrently.
+    """
+    connection = await get_connection(connection_id=data_provider_id)
+    if not connection:
+        return ResolvedRouting()
+
+    extra_dict = {"connection_id": data_provider_id}
+    lookups = []
+    route_id = connection.default_route.id if connection.default_route else None
+    if route_id:
+        cache_key = f"route_detail.{route_id}"
+        lookups.append(
+            _Lookup(
+                name="get_route",
+                local_cache=routes_cache,
+                cache_key=cache_key,
+                model=schemas.v2.Route,
+                fetch=partial(
+                    _fetch_route,
+                    route_id=route_id,
+                    data_provider_id=data_provider_id,
+                    cache_key=cache_key,
+                    extra_dict={"connection_id": route_id},
+                ),
+            )
+        )
+    destination_ids = list(dict.fromkeys(str(d.id) for d in connection.destinations))
+    for integration_id in destination_ids:
+        cache_key = f"integration_v2_detail.{integration_id}"
+        lookups.append(
+            _Lookup(
+                name="get_integration",
+                local_cache=integrations_cache,
+                cache_key=cache_key,
+                model=schemas.v2.Integration,
+                fetch=partial(
+                    _fetch_integration,
+                    integration_id=integration_id,
+                    cache_key=cache_key,
+                    extra_dict={"integration_id": integration_id},
+                ),
+            )
+        )
+
+    values = await _resolve_many(lookups, extra_dict)
+    route = values.pop(0) if route_id else None
+    return ResolvedRouting(
+        connection=connection,
+        route=route,
+        integrations={
+            integration_id: integration
+            for integration_id, integration in zip(destination_ids, values)
+            if integration
+        },
+    )
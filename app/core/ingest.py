@@ -0,0 +1,126 @@
+"""
+Decoding of incoming PubSub messages.
+
+The body is read and decoded once. The fields needed to discard a message
+(event id, event type, version and publish time) are peeked from the decoded
+bytes, so duplicate or too old messages are rejected without parsing the
+whole observation. The payload is only parsed when it's accessed.
+"""
+import binascii
+import logging
+import re
+
+from app.core import codec
+
+
+logger = logging.getLogger(__name__)
+
+
+# Top-level string fields can be read without a full parse when they are the
+# first or the last member of the system event (which is how Gundi serializes them).
+_FIRST_MEMBER = r'^\s*\{{\s*"{key}"\s*:\s*"([^"\\]*)"'
+_LAST_MEMBER = r'"{key}"\s*:\s*"([^"\\]*)"\s*\}}\s*$'
+_PEEK_WINDOW = 256  # bytes
+
+
+def _compile(key):
+    return (
+        re.compile(_FIRST_MEMBER.format(key=key).encode("utf-8")),
+        re.compile(_LAST_MEMBER.format(key=key).encode("utf-8")),
+    )
+
+
+_PEEK_PATTERNS = {
+    "event_id": _compile("event_id"),
+    "event_type": _compile("event_type"),
+}
+
+
+def peek_field(data: bytes, key: str):
+    """Read a top-level string field from the head or the tail of the JSON document."""
+    first_member, last_member = _PEEK_PATTERNS[key]
+    if match := first_member.match(data, 0, _PEEK_WINDOW):
+        return match.group(1).decode("utf-8")
+    tail_start = max(len(data) - _PEEK_WINDOW, 0)
+    if match := last_member.search(data, tail_start):
+        return match.group(1).decode("utf-8")
+    return None
+
+
+class IngestMessage:
+    """A received PubSub message whose payload is parsed lazily."""
+
+    _NOT_PARSED = object()
+
+    def __init__(
+        self, *, data: bytes, attributes, pubsub_message_id=None, timestamp=None
+    ):
+        self.data = data
+        self.attributes = attributes or {}
+        self.pubsub_message_id = pubsub_message_id
+        self.timestamp = timestamp
+        self._payload = self._NOT_PARSED
+
+    @classmethod
+    def from_payload(cls, payload, **kwargs):
+        message = cls(data=b"", **kwargs)
+        message._payload = payload
+        return message
+
+    @property
+    def is_parsed(self):
+        return self._payload is not self._NOT_PARSED
+
+    @property
+    def payload(self):
+        if not self.is_parsed:
+            self._payload = codec.loads(self.data) if self.data else {}
+        return self._payload
+
+    def to_bytes(self):
+        """The payload as it was received, so discarded messages are forwarded without parsing them."""
+        if self.data:
+            return self.data
+        return codec.dumps(self.payload)
+
+    @property
+    def gundi_version(self):
+        return self.attributes.get("gundi_version", "v1")
+
+    @property
+    def stream_type(self):
+        return self.attributes.get("observation_type")
+
+    def _get_field(self, key):
+        if self.gundi_version == "v1":
+            return None  # v1 observations aren't wrapped in a system event
+        if not self.is_parsed and (value := peek_field(self.data, key)):
+            return value
+        return self.payload.get(key)
+
+    @property
+    def event_id(self):
+        return self._get_field("event_id")
+
+    @property
+    def event_type(self):
+        return self._get_field("event_type")
+
+
+def decode_push_request(body: bytes, headers) -> IngestMessage:
+    """Decode the body of a PubSub push (or Eventarc) request."""
+    envelope = codec.loads(body)
+    pubsub_message = envelope["message"]
+    data = pubsub_message.get("data")
+    if not data:
+        logger.warning(f"message contained no payload")
+    return IngestMessage(
+        data=binascii.a2b_base64(data) if data else b"",
+        attributes=pubsub_message.get("attributes"),
+        pubsub_message_id=pubsub_message.get("message_id"),
+        timestamp=(
+            pubsub_message.get("publish_time")
+            or pubsub_message.get("time")
+            or headers.get("ce-time")
+        ),
+    )
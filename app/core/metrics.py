@@ -0,0 +1,124 @@
+"""
+Prometheus metrics of the routing service, exposed on /metrics.
+
+Metrics are registered in the default registry of prometheus_client. Labels
+are bounded (lookups, transformer classes, topics, discard reasons), and the
+histograms share a small set of latency buckets, so they stay cheap enough to
+record on every message.
+"""
+import time
+from contextlib import contextmanager
+
+from prometheus_client import Counter, Gauge, Histogram
+
+
+# Latency buckets in seconds, from in-process work to slow remote calls
+LATENCY_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+
+
+@contextmanager
+def timer(histogram, **labels):
+    """Observe the time spent in the block, in seconds."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        (histogram.labels(**labels) if labels else histogram).observe(
+            time.perf_counter() - start
+        )
+
+
+# Stages of the processing of a message
+decode_seconds = Histogram(
+    "routing_decode_seconds",
+    "Time to decode a received PubSub message.",
+    buckets=LATENCY_BUCKETS,
+)
+dedup_seconds = Histogram(
+    "routing_dedup_seconds",
+    "Time to claim a message for processing (deduplication check).",
+    buckets=LATENCY_BUCKETS,
+)
+lookup_seconds = Histogram(
+    "routing_lookup_seconds",
+    "Time to resolve reference data, by lookup and whether it was cached (hit) or read from the portal (miss).",
+    ["lookup", "cache"],
+    buckets=LATENCY_BUCKETS,
+)
+transform_seconds = Histogram(
+    "routing_transform_seconds",
+    "Time to transform a message for a destination, by transformer class.",
+    ["transformer"],
+    buckets=LATENCY_BUCKETS,
+)
+publish_seconds = Histogram(
+    "routing_publish_seconds",
+    "Time to publish to a PubSub topic, by topic.",
+    ["topic"],
+    buckets=LATENCY_BUCKETS,
+)
+
+# Messages not routed
+discarded_messages = Counter(
+    "routing_discarded_messages",
+    "Messages discarded, by reason (e.g. duplicate, too_old, unsupported_version).",
+    ["reason"],
+)
+dead_lettered_messages = Counter(
+    "routing_dead_lettered_messages",
+    "Messages published to the dead letter topic, by reason.",
+    ["reason"],
+)
+dead_letters_spooled = Counter(
+    "routing_dead_letters_spooled",
+    "Dead letters that couldn't be published and were written to the spool file, by reason.",
+    ["reason"],
+)
+dead_letters_lost = Counter(
+    "routing_dead_letters_lost",
+    "Dead letters that could be neither published nor spooled, by reason.",
+    ["reason"],
+)
+
+
+def observe_lookup(lookup, start, hit):
+    lookup_seconds.labels(lookup=lookup, cache="hit" if hit else "miss").observe(
+        time.perf_counter() - start
+    )
+
+
+# Admission control of the push endpoint (app/core/admission.py)
+in_flight_requests = Gauge(
+    "routing_in_flight_requests",
+    "Requests being processed by the push endpoint.",
+)
+queued_requests = Gauge(
+    "routing_queued_requests",
+    "Requests waiting to be admitted by the push endpoint.",
+)
+rejected_requests = Counter(
+    "routing_rejected_requests",
+    "Requests rejected by admission control, to be redelivered later.",
+    ["reason"],
+)
+
+# Activity logs (app/services/activity_logger.py)
+activity_logs_dropped = Counter(
+    "routing_activity_logs_dropped",
+    "Activity logs dropped because the emitter queue was full.",
+)
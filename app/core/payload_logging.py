@@ -0,0 +1,95 @@
+"""
+Payload logging policy for the hot path.
+
+Payloads are formatted lazily (only when a log record or span attribute is
+really emitted), with a bounded repr so big patrols or SMART requests aren't
+stringified in full, capped in size with a truncation marker, and sampled.
+"""
+import logging
+import random
+import reprlib
+
+import pydantic
+
+from app.core import settings
+
+
+TRUNCATION_MARKER = "...[truncated]"
+
+
+class _BoundedRepr(reprlib.Repr):
+    """A repr that stops descending into big or deeply nested payloads."""
+
+    def __init__(self, max_length):
+        super().__init__()
+        self.maxlevel = 4
+        self.maxdict = 20
+        self.maxlist = 10
+        self.maxtuple = 10
+        self.maxset = 10
+        self.maxstring = max_length
+        self.maxother = max_length
+
+    def repr_instance(self, x, level):
+        if isinstance(x, pydantic.BaseModel):
+            return f"{type(x).__name__}({self.repr1(x.__dict__, level)})"
+        return super().repr_instance(x, level)
+
+
+def truncate(text, max_length=None):
+    max_length = max_length or settings.PAYLOAD_LOG_MAX_LENGTH
+    if len(text) <= max_length:
+        return text
+    return text[:max_length] + TRUNCATION_MARKER
+
+
+def format_payload(payload, max_length=None):
+    max_length = max_length or settings.PAYLOAD_LOG_MAX_LENGTH
+    if isinstance(payload, (str, bytes)):
+        # Slice before decoding/formatting so big bodies are never copied in full
+        text = payload[: max_length + 1]
+        if isinstance(text, bytes):
+            text = text.decode("utf-8", errors="replace")
+        if len(payload) > max_length:
+            return text[:max_length] + TRUNCATION_MARKER
+        return text
+    return truncate(_BoundedRepr(max_length).repr(payload), max_length)
+
+
+class LazyPayload:
+    """Defers formatting a payload until a log record is really emitted."""
+
+    __slots__ = ("payload", "max_length")
+
+    def __init__(self, payload, max_length=None):
+        self.payload = payload
+        self.max_length = max_length
+
+    def __str__(self):
+        return format_payload(self.payload, self.max_length)
+
+    __repr__ = __str__
+
+
+def is_sampled():
+    sample_rate = settings.PAYLOAD_LOG_SAMPLE_RATE
+    if sample_rate >= 1.0:
+        return True
+    return random.random() < sample_rate
+
+
+def log_payload(logger, msg, *payloads, level=logging.DEBUG):
+    """
+    Log `msg` with %-style placeholders filled with the given payloads.
+    Nothing is formatted unless the level is enabled and the message is sampled.
+    """
+    if not logger.isEnabledFor(level) or not is_sampled():
+        return
+    logger.log(level, msg, *[LazyPayload(p) for p in payloads])
+
+
+def set_payload_attribute(span, key, payload):
+    """Set a capped payload attribute on a span, if it's recording and sampled."""
+    if not span.is_recording() or not is_sampled():
+        return
+    span.set_attribute(key, format_payload(payload))
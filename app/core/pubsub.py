@@ -1,21 +1,448 @@
 import asyncio
+import base64
 import backoff
 import aiohttp
-import json
 import logging
+import os
+from contextlib import asynccontextmanager
 from opentelemetry.trace import SpanKind
 from gcloud.aio import pubsub
-from app.core import tracing, settings
+from app.core import codec, metrics, tracing, settings
+from app.core.payload_logging import LazyPayload
+from app.core.utils import fill_batch
 
 
 logger = logging.getLogger(__name__)
 
 
+class PublisherManager:
+    """Process-wide PubSub publisher backed by a keep-alive connection pool.
+
+    Started on application startup and closed on shutdown. While it's running,
+    every publish reuses the same HTTP session (and OAuth token) instead of
+    opening a new connection per message. Requests of the pooled session time
+    out after `timeout` seconds, unless a call sets a shorter timeout.
+    """
+
+    def __init__(
+        self, *, pool_size, pool_size_per_host, keepalive_timeout, timeout=60.0
+    ):
+        self.pool_size = pool_size
+        self.pool_size_per_host = pool_size_per_host
+        self.keepalive_timeout = keepalive_timeout
+        self.timeout = timeout
+        self._session = None
+        self._client = None
+
+    @property
+    def is_running(self):
+        return self._client is not None
+
+    async def start(self):
+        if self.is_running:
+            return
+        connector = aiohttp.TCPConnector(
+            limit=self.pool_size,
+            limit_per_host=self.pool_size_per_host,
+            keepalive_timeout=self.keepalive_timeout,
+        )
+        self._session = aiohttp.ClientSession(
+            connector=connector,
+            raise_for_status=True,
+            timeout=aiohttp.ClientTimeout(total=self.timeout),
+        )
+        self._client = pubsub.PublisherClient(session=self._session)
+        logger.info(
+            f"PubSub publisher started (pool size: {self.pool_size}, per host: {self.pool_size_per_host})."
+        )
+
+    async def close(self):
+        session, self._session, self._client = self._session, None, None
+        if session:
+            await session.close()
+            logger.info("PubSub publisher closed.")
+
+    @asynccontextmanager
+    async def client(self, timeout: aiohttp.ClientTimeout):
+        """Yield a PublisherClient, pooled when the manager is running.
+
+        Outside the app lifecycle (scripts, unit tests) it falls back to a
+        short-lived session so publishing still works.
+        """
+        if self.is_running:
+            yield self._client
+            return
+        async with aiohttp.ClientSession(
+            raise_for_status=True, timeout=timeout
+        ) as session:
+            yield pubsub.PublisherClient(session=session)
+
+
+publisher = PublisherManager(
+    pool_size=settings.PUBSUB_PUBLISHER_POOL_SIZE,
+    pool_size_per_host=settings.PUBSUB_PUBLISHER_POOL_SIZE_PER_HOST,
+    keepalive_timeout=settings.PUBSUB_PUBLISHER_KEEPALIVE_TIMEOUT_SECONDS,
+    timeout=settings.PUBSUB_PUBLISHER_TIMEOUT_SECONDS,
+)
+
+
+class _TopicBatch:
+    def __init__(self):
+        self.messages = []
+        self.futures = []
+        self.size = 0
+        self.timer = None
+
+
+class BatchPublisher:
+    """Buffer messages per topic and publish them together.
+
+    A batch is flushed when it reaches `max_messages` or `max_bytes`, or when
+    `linger_seconds` have passed since its first message. Each caller awaits
+    its own future, which resolves (or raises) with the outcome of the batch
+    publish, so callers keep their retry semantics.
+    """
+
+    def __init__(self, *, max_messages, max_bytes, linger_seconds, timeout):
+        self.max_messages = max_messages
+        self.max_bytes = max_bytes
+        self.linger_seconds = linger_seconds
+        self.timeout = timeout
+        self._batches = {}
+        self._pending_flushes = set()
+        self._running = False
+
+    @property
+    def is_running(self):
+        return self._running
+
+    async def start(self):
+        self._running = True
+
+    async def close(self):
+        """Stop accepting messages and flush everything that is buffered."""
+        self._running = False
+        await self.flush()
+
+    async def publish(self, topic_name, message, size=0):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        batch = self._batches.get(topic_name)
+        if batch and batch.size + size > self.max_bytes:
+            self._flush_topic(
+                topic_name
+            )  # Adding this message would exceed the size limit
+        batch = self._batches.setdefault(topic_name, _TopicBatch())
+        batch.messages.append(message)
+        batch.futures.append(future)
+        batch.size += size
+        if len(batch.messages) >= self.max_messages or batch.size >= self.max_bytes:
+            self._flush_topic(topic_name)
+        elif batch.timer is None:
+            batch.timer = loop.call_later(
+                self.linger_seconds, self._flush_topic, topic_name
+            )
+        return await future
+
+    async def flush(self):
+        for topic_name in list(self._batches):
+            self._flush_topic(topic_name)
+        if self._pending_flushes:
+            await asyncio.gather(*self._pending_flushes, return_exceptions=True)
+
+    def _flush_topic(self, topic_name):
+        batch = self._batches.pop(topic_name, None)
+        if not batch:
+            return
+        if batch.timer:
+            batch.timer.cancel()
+        task = asyncio.ensure_future(self._publish_batch(topic_name, batch))
+        self._pending_flushes.add(task)
+        task.add_done_callback(self._pending_flushes.discard)
+
+    async def _publish_batch(self, topic_name, batch):
+        timeout_settings = aiohttp.ClientTimeout(total=self.timeout)
+        try:
+            async with publisher.client(timeout=timeout_settings) as client:
+                topic = client.topic_path(settings.GCP_PROJECT_ID, topic_name)
+                with metrics.timer(metrics.publish_seconds, topic=topic_name):
+                    response = await client.publish(
+                        topic, batch.messages, timeout=int(self.timeout)
+                    )
+        except Exception as e:
+            logger.warning(
+                f"Error publishing a batch of {len(batch.messages)} messages to {topic_name}: {type(e).__name__}: {e}"
+            )
+            for future in batch.futures:
+                if not future.done():
+                    future.set_exception(e)
+        else:
+            message_ids = (response or {}).get("messageIds", [])
+            for i, future in enumerate(batch.futures):
+                if not future.done():
+                    future.set_result({"messageIds": message_ids[i : i + 1]})
+
+
+batch_publisher = BatchPublisher(
+    max_messages=settings.PUBSUB_BATCH_MAX_MESSAGES,
+    max_bytes=settings.PUBSUB_BATCH_MAX_BYTES,
+    linger_seconds=settings.PUBSUB_BATCH_LINGER_SECONDS,
+    timeout=60.0,
+)
+
+
+def _count_dead_letters(counter, entries):
+    for _, attributes in entries:
+        counter.labels(reason=attributes.get("dead_letter_reason") or "unknown").inc()
+
+
+class DeadLetterSpooler:
+    """Publish dead letters in the background, in batches.
+
+    Handlers enqueue their dead letters and return right away. A worker
+    publishes them to DEAD_LETTER_TOPIC in batches of up to `max_messages`,
+    waiting up to `linger_seconds` to fill a batch. When the queue is full, or
+    a batch can't be published within `timeout`, the dead letters are appended
+    to the spool file instead of being dropped. The spool file is replayed every
+    `replay_interval` seconds while the spooler runs, and whatever is still
+    queued is spooled on close. `spool_path` must be on a durable volume, or the
+    spooled dead letters are lost when the instance is replaced.
+    """
+
+    def __init__(
+        self,
+        *,
+        max_queued,
+        max_messages,
+        linger_seconds,
+        timeout,
+        spool_path,
+        replay_interval,
+    ):
+        self.max_queued = max_queued
+        self.max_messages = max_messages
+        self.linger_seconds = linger_seconds
+        self.timeout = timeout
+        self.spool_path = spool_path
+        self.replay_interval = replay_interval
+        self.published = 0
+        self.spooled = 0
+        self._queue = None
+        self._worker = None
+        self._replayer = None
+        self._pending = []
+        self._overflow = []
+        self._spooling = None
+        self._spool_lock = None
+
+    @property
+    def is_running(self):
+        return self._worker is not None
+
+    async def start(self):
+        if self.is_running:
+            return
+        if not self.spool_path:
+            raise ValueError(
+                "DEAD_LETTER_SPOOL_PATH must be set to a path on a durable volume"
+            )
+        self._queue = asyncio.Queue(maxsize=self.max_queued)
+        self._spool_lock = asyncio.Lock()
+        self._worker = asyncio.ensure_future(self._run())
+        self._replayer = asyncio.ensure_future(self._replay_periodically())
+
+    async def close(self):
+        """Stop the worker and publish what is still queued, or spool it for the next start."""
+        worker, self._worker = self._worker, None
+        if worker is None:
+            return
+        self._replayer.cancel()
+        worker.cancel()
+        await asyncio.gather(worker, self._replayer, return_exceptions=True)
+        entries, self._pending = self._pending, []
+        while not self._queue.empty():
+            entries.append(self._queue.get_nowait())
+        for i in range(0, len(entries), self.max_messages):
+            batch = entries[i : i + self.max_messages]
+            try:
+                await self._publish_batch(batch)
+            except Exception as e:
+                logger.warning(
+                    f"Error publishing {len(batch)} dead letters on close, spooled to {self.spool_path}: {type(e).__name__}: {e}"
+                )
+                self._spool_later(batch)
+            else:
+                self.published += len(batch)
+                _count_dead_letters(metrics.dead_lettered_messages, batch)
+        if self._spooling:
+            await self._spooling
+
+    def enqueue(self, data: bytes, attributes: dict):
+        try:
+            self._queue.put_nowait((data, attributes))
+        except asyncio.QueueFull:
+            self._spool_later([(data, attributes)])
+
+    async def _run(self):
+        while True:
+            # The batch is kept in _pending so close() can spool it if the worker is cancelled meanwhile
+            batch = await fill_batch(
+                self._queue,
+                self._pending,
+                max_messages=self.max_messages,
+                linger_seconds=self.linger_seconds,
+            )
+            try:
+                await self._publish_batch(batch)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(
+                    f"Error publishing {len(batch)} dead letters, spooled to {self.spool_path}: {type(e).__name__}: {e}"
+                )
+                self._spool_later(batch)
+            else:
+                self.published += len(batch)
+                _count_dead_letters(metrics.dead_lettered_messages, batch)
+            self._pending = []
+
+    async def _publish_batch(self, batch):
+        timeout_settings = aiohttp.ClientTimeout(total=self.timeout)
+        async with publisher.client(timeout=timeout_settings) as client:
+            topic = client.topic_path(
+                settings.GCP_PROJECT_ID, settings.DEAD_LETTER_TOPIC
+            )
+            messages = [
+                pubsub.PubsubMessage(data, **attributes) for data, attributes in batch
+            ]
+            with metrics.timer(
+                metrics.publish_seconds, topic=settings.DEAD_LETTER_TOPIC
+            ):
+                await asyncio.wait_for(
+                    client.publish(topic, messages, timeout=int(self.timeout)),
+                    self.timeout,
+                )
+
+    def _spool_later(self, entries):
+        # A single writer appends whatever overflowed meanwhile, without blocking the caller
+        self._overflow.extend(entries)
+        if self._spooling is None:
+            self._spooling = asyncio.ensure_future(self._spool_overflow())
+
+    async def _spool_overflow(self):
+        try:
+            while self._overflow:
+                entries, self._overflow = self._overflow, []
+                await self._spool(entries)
+        finally:
+            self._spooling = None
+
+    async def _spool(self, entries):
+        loop = asyncio.get_running_loop()
+        try:
+            async with self._spool_lock:
+                await loop.run_in_executor(None, self._write_spool_file, entries)
+        except Exception as e:
+            logger.error(
+                f"Error spooling {len(entries)} dead letters to {self.spool_path}, they are lost: {type(e).__name__}: {e}"
+            )
+            _count_dead_letters(metrics.dead_letters_lost, entries)
+        else:
+            self.spooled += len(entries)
+            _count_dead_letters(metrics.dead_letters_spooled, entries)
+
+    def _write_spool_file(self, entries):
+        os.makedirs(os.path.dirname(self.spool_path) or ".", exist_ok=True)
+        with open(self.spool_path, "ab") as spool_file:
+            for data, attributes in entries:
+                spool_file.write(
+                    codec.dumps(
+                        {
+                            "data": base64.b64encode(data).decode("ascii"),
+                            "attributes": attributes,
+                        }
+                    )
+                    + b"\n"
+                )
+
+    async def _replay_periodically(self):
+        while True:
+            replay = asyncio.ensure_future(self._replay_spool())
+            try:
+                await asyncio.shield(replay)
+            except asyncio.CancelledError:
+                # The entries read from the file are queued anyway, close() publishes or spools them
+                await asyncio.gather(replay, return_exceptions=True)
+                raise
+            except Exception as e:
+                logger.warning(
+                    f"Error replaying the dead letters spooled to {self.spool_path}: {type(e).__name__}: {e}"
+                )
+            await asyncio.sleep(self.replay_interval)
+
+    async def _replay_spool(self):
+        loop = asyncio.get_running_loop()
+        async with self._spool_lock:
+            entries = await loop.run_in_executor(None, self._read_spool_file)
+        # Entries that don't fit in the queue are spooled again
+        for data, attributes in entries:
+            self.enqueue(data, attributes)
+        if entries:
+            logger.info(f"{len(entries)} spooled dead letters queued for publishing.")
+
+    def _read_spool_file(self):
+        # Move the file aside first, so entries spooled meanwhile go to a new file
+        replay_path = f"{self.spool_path}.replay"
+        try:
+            os.replace(self.spool_path, replay_path)
+        except FileNotFoundError:
+            return []
+        entries = []
+        with open(replay_path, "rb") as spool_file:
+            for line in spool_file:
+                try:
+                    entry = codec.loads(line)
+                    data = base64.b64decode(entry["data"])
+                except Exception as e:
+                    logger.warning(
+                        f"Skipping corrupt dead letter in spool file: {type(e).__name__}: {e}"
+                    )
+                    continue
+                entries.append((data, entry.get("attributes") or {}))
+        os.remove(replay_path)
+        return entries
+
+    def stats(self):
+        return {
+            "queued": self._queue.qsize() if self._queue else 0,
+            "published": self.published,
+            "spooled": self.spooled,
+        }
+
+
+dead_letter_spooler = DeadLetterSpooler(
+    max_queued=settings.DEAD_LETTER_QUEUE_MAX_SIZE,
+    max_messages=settings.DEAD_LETTER_BATCH_MAX_MESSAGES,
+    linger_seconds=settings.DEAD_LETTER_BATCH_LINGER_SECONDS,
+    timeout=settings.DEAD_LETTER_PUBLISH_TIMEOUT_SECONDS,
+    spool_path=settings.DEAD_LETTER_SPOOL_PATH,
+    replay_interval=settings.DEAD_LETTER_SPOOL_REPLAY_INTERVAL_SECONDS,
+)
+
+
+def get_topic_name(destination_id, broker_config):
+    # Get the topic name from config or use a default naming convention
+    return broker_config.get(
+        "topic",
+        f"destination-{destination_id}-{settings.GCP_ENVIRONMENT}",  # Try with a default name for older integrations
+    ).strip()
+
+
 @backoff.on_exception(
     backoff.expo, (aiohttp.ClientError, asyncio.TimeoutError), max_tries=20
 )
 async def send_message_to_gcp_pubsub_dispatcher(
-    message, attributes, destination, broker_config, ordering_key=""
+    message, attributes, destination, broker_config, ordering_key="", topic_name=None
 ):
     with tracing.tracer.start_as_current_span(  # Trace observations with Open Telemetry
         "routing_service.send_message_to_gcp_pubsub_dispatcher",
@@ -24,42 +451,45 @@ async def send_message_to_gcp_pubsub_dispatcher(
         destination_id_str = str(destination.id)
         current_span.set_attribute("destination_id", destination_id_str)
         # Propagate OTel context in message attributes
-        tracing_context = json.dumps(
-            tracing.pubsub_instrumentation.build_context_headers(),
-            default=str,
+        tracing_context = codec.dumps_str(
+            tracing.pubsub_instrumentation.build_context_headers()
         )
         attributes["tracing_context"] = tracing_context
-        timeout_settings = aiohttp.ClientTimeout(total=60.0)
-        async with aiohttp.ClientSession(
-            raise_for_status=True, timeout=timeout_settings
-        ) as session:
-            client = pubsub.PublisherClient(session=session)
-            # Get the topic name from config or use a default naming convention
-            topic_name = broker_config.get(
-                "topic",
-                f"destination-{destination_id_str}-{settings.GCP_ENVIRONMENT}",  # Try with a default name for older integrations
-            ).strip()
-            current_span.set_attribute("topic", topic_name)
-            topic = client.topic_path(settings.GCP_PROJECT_ID, topic_name)
-            # Serialize UUIDs or other complex types to string
-            attributes_clean = json.loads(json.dumps(attributes, default=str))
-            ordering_key_clean = str(ordering_key)
-            messages = [pubsub.PubsubMessage(message, ordering_key=ordering_key_clean, **attributes_clean)]
-            logger.info(f"Sending observation to PubSub topic {topic_name}..")
-            try:
-                response = await client.publish(
-                    topic, messages, timeout=int(timeout_settings.total)
+        if not topic_name:
+            topic_name = get_topic_name(destination_id_str, broker_config)
+        current_span.set_attribute("topic", topic_name)
+        # Serialize UUIDs or other complex types to string
+        attributes_clean = codec.to_jsonable(attributes)
+        ordering_key_clean = str(ordering_key)
+        pubsub_message = pubsub.PubsubMessage(
+            message, ordering_key=ordering_key_clean, **attributes_clean
+        )
+        logger.info(f"Sending observation to PubSub topic {topic_name}..")
+        try:
+            if batch_publisher.is_running:
+                message_size = len(message) + sum(
+                    len(k) + len(str(v)) for k, v in attributes_clean.items()
                 )
-            except Exception as e:
-                error_msg = (
-                    f"Error sending observation to PubSub topic {topic_name}: {e}."
+                current_span.set_attribute("is_batched", True)
+                response = await batch_publisher.publish(
+                    topic_name, pubsub_message, size=message_size
                 )
-                logger.exception(error_msg)
-                current_span.set_attribute("error", error_msg)
-                raise e
             else:
-                logger.info(f"Observation sent successfully.")
-                logger.debug(f"GCP PubSub response: {response}")
+                timeout_settings = aiohttp.ClientTimeout(total=60.0)
+                async with publisher.client(timeout=timeout_settings) as client:
+                    topic = client.topic_path(settings.GCP_PROJECT_ID, topic_name)
+                    with metrics.timer(metrics.publish_seconds, topic=topic_name):
+                        response = await client.publish(
+                            topic, [pubsub_message], timeout=int(timeout_settings.total)
+                        )
+        except Exception as e:
+            error_msg = f"Error sending observation to PubSub topic {topic_name}: {e}."
+            logger.exception(error_msg)
+            current_span.set_attribute("error", error_msg)
+            raise e
+        else:
+            logger.info(f"Observation sent successfully.")
+            logger.debug(f"GCP PubSub response: {response}")
         current_span.add_event(
             name="routing_service.transformed_observation_sent_to_dispatcher"
         )
@@ -69,68 +499,100 @@ async def send_event_to_integration_events_topic(event):
     """Publish a gundi_core system event to the integration events topic.
 
     Best-effort: any failure is logged and swallowed. The caller's path must
-    not be affected by activity-log delivery problems.
+    not be affected by activity-log delivery problems. Returns whether it was published.
+    """
+    return await send_events_to_integration_events_topic([event])
+
+
+async def send_events_to_integration_events_topic(events):
+    """Publish gundi_core system events to the integration events topic, in a single request.
+
+    Best-effort, like send_event_to_integration_events_topic(). Returns whether they were published.
     """
     with tracing.tracer.start_as_current_span(
         "routing_service.send_event_to_integration_events_topic", kind=SpanKind.PRODUCER
     ) as current_span:
         topic_name = settings.INTEGRATION_EVENTS_TOPIC
         current_span.set_attribute("topic", topic_name)
+        current_span.set_attribute("events_qty", len(events))
         try:
             timeout_settings = aiohttp.ClientTimeout(
                 total=settings.INTEGRATION_EVENTS_PUBLISH_TIMEOUT_SECONDS
             )
-            async with aiohttp.ClientSession(
-                raise_for_status=True, timeout=timeout_settings
-            ) as session:
-                client = pubsub.PublisherClient(session=session)
+            async with publisher.client(timeout=timeout_settings) as client:
                 topic = client.topic_path(settings.GCP_PROJECT_ID, topic_name)
-                payload = json.dumps(event.dict(), default=str).encode("utf-8")
-                messages = [pubsub.PubsubMessage(payload)]
-                await client.publish(
-                    topic, messages, timeout=int(timeout_settings.total)
-                )
+                messages = [
+                    pubsub.PubsubMessage(codec.dump_model(event)) for event in events
+                ]
+                with metrics.timer(metrics.publish_seconds, topic=topic_name):
+                    await client.publish(
+                        topic, messages, timeout=int(timeout_settings.total)
+                    )
         except Exception as e:
             logger.warning(
-                f"Failed to publish activity log to {topic_name}: {type(e).__name__}: {e}"
+                f"Failed to publish {len(events)} activity logs to {topic_name}: {type(e).__name__}: {e}"
             )
             current_span.set_attribute("error", str(e))
+            return False
+        return True
 
 
-async def send_observation_to_dead_letter_topic(transformed_observation, attributes):
+async def send_observation_to_dead_letter_topic(
+    transformed_observation, attributes, reason=None
+):
     with tracing.tracer.start_as_current_span(
         "send_message_to_dead_letter_topic", kind=SpanKind.CLIENT
     ) as current_span:
-        print(f"Forwarding observation to dead letter topic: {transformed_observation}")
-        # Publish to another PubSub topic
-        connect_timeout, read_timeout = settings.DEFAULT_REQUESTS_TIMEOUT
-        timeout_settings = aiohttp.ClientTimeout(
-            sock_connect=connect_timeout, sock_read=read_timeout
+        logger.info(
+            "Forwarding observation to dead letter topic: %s",
+            LazyPayload(transformed_observation),
         )
-        async with aiohttp.ClientSession(
-            raise_for_status=True, timeout=timeout_settings
-        ) as session:
-            client = pubsub.PublisherClient(session=session)
-            # Get the topic
-            topic_name = settings.DEAD_LETTER_TOPIC
-            current_span.set_attribute("topic", topic_name)
-            topic = client.topic_path(settings.GCP_PROJECT_ID, topic_name)
-            # Prepare the payload
-            binary_payload = json.dumps(transformed_observation, default=str).encode(
-                "utf-8"
+        topic_name = settings.DEAD_LETTER_TOPIC
+        current_span.set_attribute("topic", topic_name)
+        # Prepare the payload
+        binary_payload = (
+            transformed_observation
+            if isinstance(transformed_observation, bytes)
+            else codec.dumps(transformed_observation)
+        )
+        if reason:
+            attributes = {**attributes, "dead_letter_reason": reason}
+            current_span.set_attribute("dead_letter_reason", reason)
+        if dead_letter_spooler.is_running:
+            # Published (and counted) in the background, the caller doesn't wait for it
+            dead_letter_spooler.enqueue(binary_payload, attributes)
+            current_span.set_attribute("is_spooled", True)
+        else:
+            # Publish to another PubSub topic
+            connect_timeout, read_timeout = settings.DEFAULT_REQUESTS_TIMEOUT
+            timeout_settings = aiohttp.ClientTimeout(
+                total=connect_timeout + read_timeout,
+                sock_connect=connect_timeout,
+                sock_read=read_timeout,
             )
-            messages = [pubsub.PubsubMessage(binary_payload, **attributes)]
-            logger.info(f"Sending observation to PubSub topic {topic_name}..")
-            try:  # Send to pubsub
-                response = await client.publish(topic, messages)
-            except Exception as e:
-                logger.exception(
-                    f"Error sending observation to dead letter topic {topic_name}: {e}. Please check if the topic exists or review settings."
-                )
-                raise e
-            else:
-                logger.info(f"Observation sent to the dead letter topic successfully.")
-                logger.debug(f"GCP PubSub response: {response}")
+            async with publisher.client(timeout=timeout_settings) as client:
+                # Get the topic
+                topic = client.topic_path(settings.GCP_PROJECT_ID, topic_name)
+                messages = [pubsub.PubsubMessage(binary_payload, **attributes)]
+                logger.info(f"Sending observation to PubSub topic {topic_name}..")
+                try:  # Send to pubsub
+                    with metrics.timer(metrics.publish_seconds, topic=topic_name):
+                        response = await client.publish(
+                            topic, messages, timeout=int(timeout_settings.total)
+                        )
+                except Exception as e:
+                    logger.exception(
+                        f"Error sending observation to dead letter topic {topic_name}: {e}. Please check if the topic exists or review settings."
+                    )
+                    raise e
+                else:
+                    metrics.dead_lettered_messages.labels(
+                        reason=reason or "unknown"
+                    ).inc()
+                    logger.info(
+                        f"Observation sent to the dead letter topic successfully."
+                    )
+                    logger.debug(f"GCP PubSub response: {response}")
 
         current_span.set_attribute("is_sent_to_dead_letter_queue", True)
         current_span.add_event(
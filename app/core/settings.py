@@ -57,6 +57,11 @@ GCP_ENVIRONMENT = env.str("GCP_ENVIRONMENT", "dev")
 DEAD_LETTER_TOPIC = env.str("DEAD_LETTER_TOPIC", "transformer-dead-letter-dev")
 MAX_EVENT_AGE_SECONDS = env.int("MAX_EVENT_AGE_SECONDS", 86400)  # 24hrs
 EVENT_PROCESSING_STATUS_TTL = env.int("EVENT_PROCESSING_STATUS_TTL", 3600)
+# How long an event stays claimed if the instance processing it dies. Extended while it is processed.
+EVENT_PROCESSING_CLAIM_TTL = env.int("EVENT_PROCESSING_CLAIM_TTL", 120)
+# Destinations an event was delivered to are remembered while a failed message is likely to be redelivered.
+# The TTL is reset on every delivery of the event.
+DELIVERY_LEDGER_TTL = env.int("DELIVERY_LEDGER_TTL", EVENT_PROCESSING_STATUS_TTL)
 
 # Destination integration *types* that use the generic-model path: cdip-routing
 # publishes a GundiDelivery envelope and the destination's action runner does
@@ -64,9 +69,7 @@ EVENT_PROCESSING_STATUS_TTL = env.int("EVENT_PROCESSING_STATUS_TTL", 3600)
 # integration type slug so operators never have to set `additional.generic_model`
 # per integration — registering, say, a `cmore` destination is enough. Add a new
 # generic-model destination type here (env override) when it's onboarded.
-GENERIC_MODEL_DESTINATION_TYPES = env.list(
-    "GENERIC_MODEL_DESTINATION_TYPES", ["cmore"]
-)
+GENERIC_MODEL_DESTINATION_TYPES = env.list("GENERIC_MODEL_DESTINATION_TYPES", ["cmore"])
 
 # Topic for portal-visible activity logs published as gundi_core system events.
 INTEGRATION_EVENTS_TOPIC = env.str(
@@ -78,3 +81,136 @@ ACTIVITY_LOG_DEDUP_TTL = env.int("ACTIVITY_LOG_DEDUP_TTL", 3600)
 INTEGRATION_EVENTS_PUBLISH_TIMEOUT_SECONDS = env.int(
     "INTEGRATION_EVENTS_PUBLISH_TIMEOUT_SECONDS", 60
 )
+
+# Shared PubSub publisher: keep-alive connection pool reused across requests.
+PUBSUB_PUBLISHER_POOL_SIZE = env.int("PUBSUB_PUBLISHER_POOL_SIZE", 100)
+PUBSUB_PUBLISHER_POOL_SIZE_PER_HOST = env.int("PUBSUB_PUBLISHER_POOL_SIZE_PER_HOST", 50)
+PUBSUB_PUBLISHER_KEEPALIVE_TIMEOUT_SECONDS = env.float(
+    "PUBSUB_PUBLISHER_KEEPALIVE_TIMEOUT_SECONDS", 60.0
+)
+# Upper bound of any request of the pooled session, so a stalled connection can't hang a handler
+PUBSUB_PUBLISHER_TIMEOUT_SECONDS = env.float("PUBSUB_PUBLISHER_TIMEOUT_SECONDS", 60.0)
+# Micro-batching of dispatcher messages per topic. A batch is published when it
+# reaches the max messages or bytes, or after the linger time, whichever is first.
+PUBSUB_BATCHING_ENABLED = env.bool("PUBSUB_BATCHING_ENABLED", False)
+PUBSUB_BATCH_MAX_MESSAGES = env.int("PUBSUB_BATCH_MAX_MESSAGES", 100)
+PUBSUB_BATCH_MAX_BYTES = env.int("PUBSUB_BATCH_MAX_BYTES", 1024 * 1024)  # 1MB
+PUBSUB_BATCH_LINGER_SECONDS = env.float("PUBSUB_BATCH_LINGER_SECONDS", 0.01)
+
+# Max destinations resolved, transformed and published in parallel per message.
+# Defaults to 1 (sequential, one destination after another); raise it to fan out.
+DESTINATION_FANOUT_CONCURRENCY = env.int("DESTINATION_FANOUT_CONCURRENCY", 1)
+
+# Streaming pull worker (app/subscribers/pull_worker.py), alternative to the push endpoint.
+PULL_SUBSCRIPTION_NAME = env.str(
+    "PULL_SUBSCRIPTION_NAME", f"routing-transformer-{GCP_ENVIRONMENT}"
+)
+PULL_MAX_OUTSTANDING_MESSAGES = env.int("PULL_MAX_OUTSTANDING_MESSAGES", 50)
+PULL_MAX_OUTSTANDING_BYTES = env.int(
+    "PULL_MAX_OUTSTANDING_BYTES", 10 * 1024 * 1024
+)  # 10MB
+PULL_NUM_PRODUCERS = env.int("PULL_NUM_PRODUCERS", 1)
+PULL_MAX_MESSAGES_PER_PRODUCER = env.int("PULL_MAX_MESSAGES_PER_PRODUCER", 100)
+PULL_ACK_WINDOW_SECONDS = env.float("PULL_ACK_WINDOW_SECONDS", 0.3)
+PULL_ACK_DEADLINE_SECONDS = env.int("PULL_ACK_DEADLINE_SECONDS", 60)
+
+# Payload logging policy (app/core/payload_logging.py): max chars per logged payload or span attribute,
+# and the fraction of messages whose payloads are logged/traced at all.
+PAYLOAD_LOG_MAX_LENGTH = env.int("PAYLOAD_LOG_MAX_LENGTH", 1024)
+PAYLOAD_LOG_SAMPLE_RATE = env.float("PAYLOAD_LOG_SAMPLE_RATE", 1.0)
+
+# In-process (L1) cache of parsed connections, routes and integrations, in front of Redis.
+# Keep the TTLs below PORTAL_CONFIG_OBJECT_CACHE_TTL so config changes propagate quickly. Set a TTL to 0 to disable it.
+L1_CACHE_CONNECTION_TTL = env.int("L1_CACHE_CONNECTION_TTL", 15)
+L1_CACHE_ROUTE_TTL = env.int("L1_CACHE_ROUTE_TTL", 15)
+L1_CACHE_INTEGRATION_TTL = env.int("L1_CACHE_INTEGRATION_TTL", 15)
+L1_CACHE_MAX_CONNECTIONS = env.int("L1_CACHE_MAX_CONNECTIONS", 1000)
+L1_CACHE_MAX_ROUTES = env.int("L1_CACHE_MAX_ROUTES", 1000)
+L1_CACHE_MAX_INTEGRATIONS = env.int("L1_CACHE_MAX_INTEGRATIONS", 2000)
+
+# Stampede protection for reference data lookups (app/core/cache.py)
+CACHE_TTL_JITTER_RATIO = env.float("CACHE_TTL_JITTER_RATIO", 0.1)
+CACHE_STALE_TTL = env.int("CACHE_STALE_TTL", 3600)  # Previous values kept as fallback
+CACHE_LOCK_TTL_SECONDS = env.float("CACHE_LOCK_TTL_SECONDS", 10.0)
+CACHE_LOCK_WAIT_SECONDS = env.float("CACHE_LOCK_WAIT_SECONDS", 2.0)
+CACHE_LOCK_POLL_INTERVAL_SECONDS = env.float("CACHE_LOCK_POLL_INTERVAL_SECONDS", 0.1)
+
+# Compiled routing plans per data provider (app/services/routing_plan.py). They are rebuilt when the
+# connection, route or destination integrations change; the TTL only bounds how long unused plans are kept.
+ROUTING_PLAN_CACHE_MAX_SIZE = env.int("ROUTING_PLAN_CACHE_MAX_SIZE", 1000)
+ROUTING_PLAN_CACHE_TTL = env.int("ROUTING_PLAN_CACHE_TTL", 3600)
+
+# Max transformer instances (i.e. SMART clients with their data models) kept warm across messages
+TRANSFORMER_POOL_MAX_SIZE = env.int("TRANSFORMER_POOL_MAX_SIZE", 500)
+
+# SMART data models shared across instances through Redis (app/services/smart_datamodels.py).
+# Copies older than the refresh age are still used while they are downloaded again in the background.
+SMART_DATAMODEL_REFRESH_SECONDS = env.int("SMART_DATAMODEL_REFRESH_SECONDS", 3600)
+SMART_DATAMODEL_REFRESH_INTERVAL_SECONDS = env.int(
+    "SMART_DATAMODEL_REFRESH_INTERVAL_SECONDS", 300
+)
+SMART_DATAMODEL_CACHE_TTL = env.int(
+    "SMART_DATAMODEL_CACHE_TTL", 60 * 60 * 24 * 7
+)  # Fallback when SMART is down
+SMART_DATAMODEL_CACHE_MAX_SIZE = env.int("SMART_DATAMODEL_CACHE_MAX_SIZE", 500)
+# Event types whose SMART category path is memoised per data model index
+SMART_CATEGORY_PATHS_MAX_SIZE = env.int("SMART_CATEGORY_PATHS_MAX_SIZE", 5000)
+
+# Timezone resolution (app/services/timezones.py). Results are cached on a grid of TIMEZONE_CACHE_PRECISION decimals.
+TIMEZONE_FINDER_IN_MEMORY = env.bool("TIMEZONE_FINDER_IN_MEMORY", False)
+TIMEZONE_CACHE_PRECISION = env.int("TIMEZONE_CACHE_PRECISION", 2)
+TIMEZONE_CACHE_MAX_SIZE = env.int("TIMEZONE_CACHE_MAX_SIZE", 50000)
+
+# Prefetch SMART reference data when a transformer is built, and on startup for these destinations (integration ids)
+SMART_WARM_UP_ENABLED = env.bool("SMART_WARM_UP_ENABLED", True)
+SMART_WARM_UP_CONCURRENCY = env.int("SMART_WARM_UP_CONCURRENCY", 5)
+SMART_WARM_UP_DESTINATION_IDS = env.list("SMART_WARM_UP_DESTINATION_IDS", [])
+
+# Compiled field mapping rules, keyed by route configuration and a hash of its field mappings
+FIELD_MAPPING_RULES_CACHE_MAX_SIZE = env.int("FIELD_MAPPING_RULES_CACHE_MAX_SIZE", 5000)
+FIELD_MAPPING_RULES_CACHE_TTL = env.int("FIELD_MAPPING_RULES_CACHE_TTL", 3600)
+
+# Admission control of the push endpoint (app/core/admission.py). Above the in-flight limit requests wait
+# for up to the queue timeout, and are rejected (503) after it, or right away (429) if the queue is full,
+# so PubSub redelivers them later with backoff. Set ADMISSION_MAX_IN_FLIGHT to 0 to disable it.
+ADMISSION_MAX_IN_FLIGHT = env.int("ADMISSION_MAX_IN_FLIGHT", 200)
+ADMISSION_MAX_QUEUED = env.int("ADMISSION_MAX_QUEUED", 200)
+ADMISSION_QUEUE_TIMEOUT_SECONDS = env.float("ADMISSION_QUEUE_TIMEOUT_SECONDS", 1.0)
+
+# Dead letters are published in the background, in batches (app/core/pubsub.py). When the queue is full or PubSub
+# is failing they are appended to the spool file, which is replayed periodically. Enabling it requires
+# DEAD_LETTER_SPOOL_PATH on a durable volume (not /tmp on Cloud Run, which is lost with the instance).
+DEAD_LETTER_SPOOLER_ENABLED = env.bool("DEAD_LETTER_SPOOLER_ENABLED", False)
+DEAD_LETTER_QUEUE_MAX_SIZE = env.int("DEAD_LETTER_QUEUE_MAX_SIZE", 10000)
+DEAD_LETTER_BATCH_MAX_MESSAGES = env.int("DEAD_LETTER_BATCH_MAX_MESSAGES", 100)
+DEAD_LETTER_BATCH_LINGER_SECONDS = env.float("DEAD_LETTER_BATCH_LINGER_SECONDS", 0.5)
+DEAD_LETTER_PUBLISH_TIMEOUT_SECONDS = env.float(
+    "DEAD_LETTER_PUBLISH_TIMEOUT_SECONDS", 10.0
+)
+DEAD_LETTER_SPOOL_PATH = env.str("DEAD_LETTER_SPOOL_PATH", None)
+DEAD_LETTER_SPOOL_REPLAY_INTERVAL_SECONDS = env.float(
+    "DEAD_LETTER_SPOOL_REPLAY_INTERVAL_SECONDS", 60.0
+)
+
+# Activity logs are emitted in the background, in batches (app/services/activity_logger.py). Repeats are
+# suppressed in-process for ACTIVITY_LOG_LOCAL_DEDUP_SECONDS before the Redis dedup; they are dropped if the queue is full.
+ACTIVITY_LOG_EMITTER_ENABLED = env.bool("ACTIVITY_LOG_EMITTER_ENABLED", True)
+ACTIVITY_LOG_QUEUE_MAX_SIZE = env.int("ACTIVITY_LOG_QUEUE_MAX_SIZE", 1000)
+ACTIVITY_LOG_BATCH_MAX_MESSAGES = env.int("ACTIVITY_LOG_BATCH_MAX_MESSAGES", 100)
+ACTIVITY_LOG_BATCH_LINGER_SECONDS = env.float("ACTIVITY_LOG_BATCH_LINGER_SECONDS", 1.0)
+ACTIVITY_LOG_LOCAL_DEDUP_SECONDS = env.int("ACTIVITY_LOG_LOCAL_DEDUP_SECONDS", 60)
+ACTIVITY_LOG_LOCAL_DEDUP_MAX_SIZE = env.int("ACTIVITY_LOG_LOCAL_DEDUP_MAX_SIZE", 10000)
+
+# Trace sampling (app/core/tracing/config.py). Traces are sampled by ratio, overridden per stream type,
+# e.g. TRACE_SAMPLE_RATIOS_BY_STREAM_TYPE="ev=1.0,evu=1.0,obv=0.01". Nested spans follow their parent.
+TRACE_SAMPLE_RATIO = env.float("TRACE_SAMPLE_RATIO", 1.0)
+TRACE_SAMPLE_RATIOS_BY_STREAM_TYPE = env.dict(
+    "TRACE_SAMPLE_RATIOS_BY_STREAM_TYPE", subcast_values=float, default={}
+)
+# Stream types processed without creating spans at all, e.g. "obv"
+TRACING_LIGHTWEIGHT_STREAM_TYPES = env.list("TRACING_LIGHTWEIGHT_STREAM_TYPES", [])
+# Span export (BatchSpanProcessor)
+TRACE_EXPORT_MAX_QUEUE_SIZE = env.int("TRACE_EXPORT_MAX_QUEUE_SIZE", 2048)
+TRACE_EXPORT_MAX_BATCH_SIZE = env.int("TRACE_EXPORT_MAX_BATCH_SIZE", 512)
+TRACE_EXPORT_SCHEDULE_DELAY_MILLIS = env.int("TRACE_EXPORT_SCHEDULE_DELAY_MILLIS", 5000)
+TRACE_EXPORT_TIMEOUT_MILLIS = env.int("TRACE_EXPORT_TIMEOUT_MILLIS", 30000)
@@ -12,6 +12,7 @@ from opentelemetry.instrumentation.aiohttp_client import AioHttpClientInstrument
 from opentelemetry.instrumentation.httpx import HTTPXClientInstrumentor
 from . import config
 from . import pubsub_instrumentation
+from .config import is_lightweight, skip_spans
 
 # Using the X-Cloud-Trace-Context header
 set_global_textmap(CloudTraceFormatPropagator())
@@ -1,12 +1,120 @@
 # Open telemetry metrics (Distributed Tracing)
+import contextvars
+from contextlib import contextmanager, nullcontext
+
 from opentelemetry import trace
 from opentelemetry.sdk.resources import Resource
 from opentelemetry.exporter.cloud_trace import CloudTraceSpanExporter
 from opentelemetry.sdk.trace import TracerProvider
 from opentelemetry.sdk.trace.export import BatchSpanProcessor
+from opentelemetry.sdk.trace.sampling import ParentBased, Sampler, TraceIdRatioBased
 from app.core import settings
 
 
+# Stream types are read from this span attribute when the root span of a message is sampled
+STREAM_TYPE_ATTRIBUTE = "observation_type"
+
+
+class StreamTypeSampler(Sampler):
+    """
+    Sample a ratio of the traces, with a different ratio per stream type.
+
+    The stream type is taken from the attributes the span is started with, so it
+    applies to the span that starts the processing of a message. Nested spans
+    follow the decision of their parent (see build_sampler()).
+    """
+
+    def __init__(self, ratio, ratios_by_stream_type=None):
+        self._default = TraceIdRatioBased(ratio)
+        self._by_stream_type = {
+            stream_type: TraceIdRatioBased(stream_ratio)
+            for stream_type, stream_ratio in (ratios_by_stream_type or {}).items()
+        }
+
+    def should_sample(
+        self,
+        parent_context,
+        trace_id,
+        name,
+        kind=None,
+        attributes=None,
+        links=None,
+        trace_state=None,
+    ):
+        stream_type = (attributes or {}).get(STREAM_TYPE_ATTRIBUTE)
+        sampler = self._by_stream_type.get(stream_type, self._default)
+        return sampler.should_sample(
+            parent_context, trace_id, name, kind, attributes, links, trace_state
+        )
+
+    def get_description(self):
+        ratios = {k: s.rate for k, s in self._by_stream_type.items()}
+        return f"StreamTypeSampler{{{self._default.rate}, {ratios}}}"
+
+
+def build_sampler():
+    ratio_sampler = StreamTypeSampler(
+        ratio=settings.TRACE_SAMPLE_RATIO,
+        ratios_by_stream_type=settings.TRACE_SAMPLE_RATIOS_BY_STREAM_TYPE,
+    )
+    # Messages carry the context of the service that sent them. Sampled remote parents
+    # are sampled again by stream type, so the ratio applies on entry to this service.
+    return ParentBased(root=ratio_sampler, remote_parent_sampled=ratio_sampler)
+
+
+def build_span_processor(exporter):
+    # BatchSpanProcessor buffers spans and sends them in batches in a background thread
+    return BatchSpanProcessor(
+        exporter,
+        max_queue_size=settings.TRACE_EXPORT_MAX_QUEUE_SIZE,
+        schedule_delay_millis=settings.TRACE_EXPORT_SCHEDULE_DELAY_MILLIS,
+        max_export_batch_size=settings.TRACE_EXPORT_MAX_BATCH_SIZE,
+        export_timeout_millis=settings.TRACE_EXPORT_TIMEOUT_MILLIS,
+    )
+
+
+_spans_skipped = contextvars.ContextVar("spans_skipped", default=False)
+_NO_SPAN = nullcontext(trace.INVALID_SPAN)
+
+
+@contextmanager
+def skip_spans(skip=True):
+    """While active (in this task and the tasks it starts) no spans are created."""
+    token = _spans_skipped.set(skip)
+    try:
+        yield
+    finally:
+        _spans_skipped.reset(token)
+
+
+def is_lightweight(stream_type):
+    """Whether messages of this stream type are processed without spans."""
+    return stream_type in settings.TRACING_LIGHTWEIGHT_STREAM_TYPES
+
+
+class Tracer:
+    """
+    A tracer that creates no spans within skip_spans().
+
+    The lightweight mode avoids the span overhead (span objects, attributes and
+    context switches) on the hot path of high-volume streams, which sampling
+    alone doesn't, as unsampled spans are still created.
+    """
+
+    def __init__(self, tracer):
+        self._tracer = tracer
+
+    def start_as_current_span(self, name, *args, **kwargs):
+        if _spans_skipped.get():
+            return _NO_SPAN
+        return self._tracer.start_as_current_span(name, *args, **kwargs)
+
+    def start_span(self, name, *args, **kwargs):
+        if _spans_skipped.get():
+            return trace.INVALID_SPAN
+        return self._tracer.start_span(name, *args, **kwargs)
+
+
 def configure_tracer(name: str, version: str = ""):
     if settings.TRACING_ENABLED:
         resource = Resource.create(
@@ -15,13 +123,8 @@ def configure_tracer(name: str, version: str = ""):
                 "service.version": version,
             }
         )
-        tracer_provider = TracerProvider(resource=resource)
+        tracer_provider = TracerProvider(resource=resource, sampler=build_sampler())
         cloud_trace_exporter = CloudTraceSpanExporter()
-        tracer_provider.add_span_processor(
-            # BatchSpanProcessor buffers spans and sends them in batches in a
-            # background thread. The default parameters are sensible, but can be
-            # tweaked to optimize your performance
-            BatchSpanProcessor(cloud_trace_exporter)
-        )
+        tracer_provider.add_span_processor(build_span_processor(cloud_trace_exporter))
         trace.set_tracer_provider(tracer_provider)
-    return trace.get_tracer(name, version)
+    return Tracer(trace.get_tracer(name, version))
@@ -1,13 +1,18 @@
-import json
+import logging
 
 from opentelemetry import propagate, context
 
+from app.core import codec
+
+
+logger = logging.getLogger(__name__)
+
 
 def load_context_from_attributes(attributes):
-    print(f"[tracing.load_context_from_attributes]> attributes: {attributes}")
-    carrier = json.loads(attributes.get("tracing_context", "{}"))
+    logger.debug("[tracing.load_context_from_attributes]> attributes: %s", attributes)
+    carrier = codec.loads(attributes.get("tracing_context", "{}"))
     ctx = propagate.extract(carrier=carrier)
-    print(f"[tracing.load_context_from_attributes]> ctx: {ctx}")
+    logger.debug("[tracing.load_context_from_attributes]> ctx: %s", ctx)
     context.attach(ctx)
 
 
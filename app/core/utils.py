@@ -1,3 +1,4 @@
+import asyncio
 import logging
 from enum import Enum
 import aioredis
@@ -68,3 +69,49 @@ def is_valid_position(gundi_version: str, location):
 
 def get_provider_key(provider):
     return f"gundi_{provider.type.value}_{str(provider.id)}"
+
+
+async def gather_with_concurrency(coroutines, limit: int = 1):
+    """Run coroutines with at most `limit` of them in flight at once.
+
+    Every coroutine runs to completion. If any of them failed, the first error
+    (in input order) is raised after all have finished, so callers keep the
+    same failure semantics they had when running them one after another.
+    """
+    semaphore = asyncio.Semaphore(max(limit, 1))
+
+    async def run(coroutine):
+        async with semaphore:
+            return await coroutine
+
+    results = await asyncio.gather(
+        *[run(coroutine) for coroutine in coroutines], return_exceptions=True
+    )
+    for result in results:
+        if isinstance(result, BaseException):
+            raise result
+    return results
+
+
+async def fill_batch(
+    queue: asyncio.Queue, batch: list, *, max_messages: int, linger_seconds: float
+):
+    """Wait for an item of the queue, then add more to `batch` for up to `linger_seconds`.
+
+    Items are appended to the given list, so a caller that is cancelled meanwhile
+    still has the ones taken from the queue.
+    """
+    batch.append(await queue.get())
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + linger_seconds
+    while len(batch) < max_messages:
+        if not queue.empty():
+            batch.append(queue.get_nowait())
+            continue
+        if (remaining := deadline - loop.time()) <= 0:
+            break
+        try:
+            batch.append(await asyncio.wait_for(queue.get(), remaining))
+        except asyncio.TimeoutError:
+            break
+    return batch
@@ -1,18 +1,33 @@
 import logging
 import os
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, Request, status
 from fastapi.encoders import jsonable_encoder
 from fastapi.exceptions import RequestValidationError
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+from app.core.admission import admission_controller
+from app.core.errors import AdmissionRejected, EventInProgress
+from app.core.payload_logging import log_payload
+from app.services.lifecycle import background_services
 from app.services.process_messages import process_request
 
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Long-lived resources shared across requests
+    async with background_services():
+        yield
+
+
 # For running behind a proxy, we'll want to configure the root path for OpenAPI browser.
 root_path = os.environ.get("ROOT_PATH", "")
 app = FastAPI(
     title="Gundi Routing Transformer Service",
     description="Service to transform and route messages from data providers to dispatchers",
     version="1",
+    lifespan=lifespan,
 )
 
 origins = [
@@ -41,6 +56,15 @@ def health_check(
     return {"status": "healthy"}
 
 
+@app.get(
+    "/metrics",
+    tags=["metrics"],
+    summary="Prometheus metrics",
+)
+def metrics_endpoint():
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+
 @app.post(
     "/",
     summary="Process a message from Pub/Sub",
@@ -48,10 +72,30 @@ def health_check(
 async def process_cloud_event(
     request: Request,
 ):
-    body = await request.body()
-    headers = request.headers
-    print(f"Message Received.\n RAW body: {body}\n headers: {headers}")
-    return await process_request(request=request)
+    try:
+        async with admission_controller.admit():
+            log_payload(
+                logger,
+                "Message Received.\n RAW body: %s\n headers: %s",
+                await request.body(),
+                request.headers,
+            )
+            return await process_request(request=request)
+    except AdmissionRejected as e:
+        # PubSub redelivers the message later, with backoff
+        logger.warning(
+            f"Message rejected by admission control ({e.reason}). {admission_controller.stats()}"
+        )
+        return JSONResponse(
+            status_code=e.status_code,
+            content={"status": "rejected", "reason": e.reason},
+        )
+    except EventInProgress as e:
+        # PubSub redelivers the message later, in case the other instance fails
+        return JSONResponse(
+            status_code=status.HTTP_409_CONFLICT,
+            content={"status": "rejected", "reason": str(e)},
+        )
 
 
 @app.exception_handler(RequestValidationError)
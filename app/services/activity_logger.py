@@ -1,3 +1,4 @@
+import asyncio
 import logging
 from hashlib import md5
 
@@ -7,9 +8,13 @@ from gundi_core.events.integrations import (
     LogLevel,
 )
 
-from app.core import settings
-from app.core.pubsub import send_event_to_integration_events_topic
-from app.core.utils import get_redis_db
+from app.core import metrics, settings
+from app.core.cache import LocalCache
+from app.core.pubsub import (
+    send_event_to_integration_events_topic,
+    send_events_to_integration_events_topic,
+)
+from app.core.utils import fill_batch, get_redis_db
 
 
 logger = logging.getLogger(__name__)
@@ -24,31 +29,191 @@ def _dedup_key(action_id: str, resource_id: str, exception: Exception) -> str:
     return f"activity_log_emitted.{action_id}.{resource_id}.{signature}"
 
 
+def _build_portal_lookup_error_event(
+    *, action_id, resource_id, error_type, error_message
+):
+    return IntegrationActionCustomLog(
+        payload=CustomActivityLog(
+            integration_id=str(resource_id),
+            action_id=action_id,
+            title=f"Portal lookup failed: {action_id}",
+            level=LogLevel.ERROR,
+            data={
+                "error_type": error_type,
+                "error_message": error_message,
+            },
+        )
+    )
+
+
+async def _already_emitted(keys) -> set:
+    """The keys logged by any instance within the dedup TTL. Raises on Redis errors."""
+    values = await _cache_db.mget(keys)
+    return {key for key, value in zip(keys, values) if value}
+
+
+async def _mark_emitted(keys):
+    """Dedup across instances, once the activity logs are published. Raises on Redis errors."""
+    pipe = _cache_db.pipeline(transaction=False)
+    for key in keys:
+        pipe.setex(key, settings.ACTIVITY_LOG_DEDUP_TTL, 1)
+    await pipe.execute()
+
+
+class ActivityLogEmitter:
+    """Emit activity logs in the background, in batches.
+
+    When the portal is down every message fails the same lookups, so activity
+    logs are first deduplicated in-process for `dedup_window` seconds, then
+    queued. A worker checks the Redis dedup keys and publishes what is left to
+    INTEGRATION_EVENTS_TOPIC in batches. The dedup keys are recorded only once
+    the activity logs are queued (in-process) or published (Redis), so a
+    dropped or failed log doesn't suppress the next one. When the queue is
+    full, activity logs are dropped and counted, as they are best effort.
+    """
+
+    def __init__(
+        self, *, max_queued, max_messages, linger_seconds, dedup_window, dedup_max_size
+    ):
+        self.max_queued = max_queued
+        self.max_messages = max_messages
+        self.linger_seconds = linger_seconds
+        self.published = 0
+        self.dropped = 0
+        self.deduplicated = 0
+        self._recent = LocalCache(
+            name="activity_logs", maxsize=dedup_max_size, ttl=dedup_window
+        )
+        self._queue = None
+        self._worker = None
+        self._pending = []
+
+    @property
+    def is_running(self):
+        return self._worker is not None
+
+    def is_recent(self, key) -> bool:
+        """Whether the key was emitted by this instance within the dedup window."""
+        if self._recent.get(key):
+            self.deduplicated += 1
+            return True
+        return False
+
+    def remember(self, key):
+        self._recent.set(key, True)
+
+    def emit(self, key, **log):
+        try:
+            self._queue.put_nowait((key, log))
+        except asyncio.QueueFull:
+            self.dropped += 1
+            metrics.activity_logs_dropped.inc()
+            logger.debug(f"Activity log queue full, '{key}' dropped.")
+        else:
+            self.remember(key)
+
+    async def start(self):
+        if self.is_running:
+            return
+        self._queue = asyncio.Queue(maxsize=self.max_queued)
+        self._worker = asyncio.ensure_future(self._run())
+
+    async def close(self):
+        """Stop the worker and publish what is still queued."""
+        worker, self._worker = self._worker, None
+        if worker is None:
+            return
+        worker.cancel()
+        await asyncio.gather(worker, return_exceptions=True)
+        entries, self._pending = self._pending, []
+        while not self._queue.empty():
+            entries.append(self._queue.get_nowait())
+        for i in range(0, len(entries), self.max_messages):
+            await self._emit_batch(entries[i : i + self.max_messages])
+
+    async def _run(self):
+        while True:
+            # The batch is kept in _pending so close() can publish it if the worker is cancelled meanwhile
+            batch = await fill_batch(
+                self._queue,
+                self._pending,
+                max_messages=self.max_messages,
+                linger_seconds=self.linger_seconds,
+            )
+            await self._emit_batch(batch)
+            self._pending = []
+
+    async def _emit_batch(self, batch):
+        try:
+            logs = dict(batch)  # One activity log per key
+            try:
+                emitted = await _already_emitted(list(logs))
+            except Exception as e:
+                logger.warning(
+                    f"activity_logger: suppressed error while deduplicating {len(logs)} activity logs: {type(e).__name__}: {e}"
+                )
+                return
+            keys = [key for key in logs if key not in emitted]
+            events = [_build_portal_lookup_error_event(**logs[key]) for key in keys]
+            if events and await send_events_to_integration_events_topic(events):
+                self.published += len(events)
+                await _mark_emitted(keys)
+        except Exception as e:
+            logger.warning(
+                f"activity_logger: suppressed error while emitting {len(batch)} activity logs: {type(e).__name__}: {e}"
+            )
+
+    def clear(self):
+        self._recent.clear()
+
+    def stats(self):
+        return {
+            "queued": self._queue.qsize() if self._queue else 0,
+            "published": self.published,
+            "deduplicated": self.deduplicated,
+            "dropped": self.dropped,
+        }
+
+
+activity_log_emitter = ActivityLogEmitter(
+    max_queued=settings.ACTIVITY_LOG_QUEUE_MAX_SIZE,
+    max_messages=settings.ACTIVITY_LOG_BATCH_MAX_MESSAGES,
+    linger_seconds=settings.ACTIVITY_LOG_BATCH_LINGER_SECONDS,
+    dedup_window=settings.ACTIVITY_LOG_LOCAL_DEDUP_SECONDS,
+    dedup_max_size=settings.ACTIVITY_LOG_LOCAL_DEDUP_MAX_SIZE,
+)
+
+
 async def log_portal_lookup_error(
     *, action_id: str, resource_id: str, exception: Exception
 ) -> None:
-    """Publish an activity log for a failed portal lookup, deduped via Redis.
+    """Publish an activity log for a failed portal lookup, deduped in-process and via Redis.
 
+    While the emitter is running it's queued and published in the background.
     Never raises. A Redis or PubSub problem must not affect the caller's path.
     """
     try:
         key = _dedup_key(action_id, str(resource_id), exception)
-        if await _cache_db.set(key, 1, ex=settings.ACTIVITY_LOG_DEDUP_TTL, nx=True) is None:
-            return  # Already logged within the dedup window.
+        if activity_log_emitter.is_recent(key):
+            return  # Already logged by this instance within the dedup window.
 
-        event = IntegrationActionCustomLog(
-            payload=CustomActivityLog(
-                integration_id=str(resource_id),
-                action_id=action_id,
-                title=f"Portal lookup failed: {action_id}",
-                level=LogLevel.ERROR,
-                data={
-                    "error_type": type(exception).__name__,
-                    "error_message": str(exception),
-                },
-            )
+        log = dict(
+            action_id=action_id,
+            resource_id=resource_id,
+            error_type=type(exception).__name__,
+            error_message=str(exception),
         )
-        await send_event_to_integration_events_topic(event)
+        if activity_log_emitter.is_running:
+            activity_log_emitter.emit(key, **log)
+            return
+
+        if await _already_emitted([key]):
+            return  # Already logged within the dedup window.
+        if await send_event_to_integration_events_topic(
+            _build_portal_lookup_error_event(**log)
+        ):
+            activity_log_emitter.remember(key)
+            await _mark_emitted([key])
     except Exception as e:
         logger.warning(
             f"activity_logger: suppressed error while logging portal lookup failure "
@@ -24,15 +24,21 @@ from gundi_core.events.transformers import (
     MessageTransformedInReach,
 )
 from opentelemetry.trace import SpanKind
-from app.core import settings, tracing
+from app.core import metrics, settings, tracing
+from app.core.deduplication import get_delivered_destinations, set_destination_delivered
 from app.core.errors import ReferenceDataError
-from app.core.gundi import get_connection, get_route, get_integration
+from app.core.gundi import resolve_routing
 from app.core.local_logging import ExtraKeys
+from app.core.payload_logging import log_payload, set_payload_attribute
 from app.core.utils import Broker
-from app.core.utils import get_provider_key
+from app.core.utils import gather_with_concurrency
 from app.core.pubsub import send_message_to_gcp_pubsub_dispatcher
+from app.services.routing_plan import (
+    DestinationPlan,
+    RoutingPlan,
+    get_routing_plan,
+)
 from app.services.transformers import (
-    build_transformed_message_attributes,
     build_gcp_pubsub_message,
     get_source_id,
     get_data_provider_id,
@@ -43,22 +49,6 @@ from app.services.transformers import (
 logger = logging.getLogger(__name__)
 
 
-def _uses_generic_model(destination_integration) -> bool:
-    """Whether a destination uses the generic-model path (publish a
-    GundiDelivery for its action runner to transform) instead of a legacy
-    in-process Transformer.
-
-    Decided by the destination's integration *type* (e.g. ``cmore``) via
-    ``settings.GENERIC_MODEL_DESTINATION_TYPES`` so it requires no per-integration
-    config. The legacy per-integration ``additional.generic_model`` flag is still
-    honored as an override for one-off opt-in.
-    """
-    type_value = getattr(getattr(destination_integration, "type", None), "value", None)
-    if type_value and type_value in settings.GENERIC_MODEL_DESTINATION_TYPES:
-        return True
-    return bool((destination_integration.additional or {}).get("generic_model"))
-
-
 transformer_events_by_data_type = {
     "EREvent": EventTransformedER,
     "EREventUpdate": EventUpdateTransformedER,
@@ -80,45 +70,38 @@ def build_transformer_event(transformed_observation):
     return Event(payload=transformed_observation)
 
 
-def _build_provider_info(provider) -> ProviderInfo:
-    provider_type = ""
-    if getattr(provider, "type", None) is not None:
-        provider_type = getattr(provider.type, "value", "") or ""
+def _build_gundi_delivery(
+    *, observation, provider_info, route_configuration
+) -> GundiDelivery:
+    return GundiDelivery(
+        payload=observation,
+        route_configuration=route_configuration,
+        provider=provider_info,
+    )
 
-    owner_id = ""
-    owner_name = ""
-    if getattr(provider, "owner", None) is not None:
-        owner_id = str(getattr(provider.owner, "id", "") or "")
-        owner_name = getattr(provider.owner, "name", "") or ""
 
-    return ProviderInfo(
-        provider_id=str(provider.id),
-        provider_type=provider_type,
-        provider_name=getattr(provider, "name", "") or "",
-        owner_id=owner_id,
-        owner_name=owner_name,
-    )
+def _check_broker(destination_plan: DestinationPlan, current_span):
+    if destination_plan.broker != Broker.GCP_PUBSUB.value:
+        current_span.set_attribute("broker", destination_plan.broker)
+        raise ReferenceDataError(
+            f"Broker '{destination_plan.broker}' is no longer supported. Please use `{Broker.GCP_PUBSUB.value}` instead."
+        )
 
 
-def _build_gundi_delivery(*, observation, provider, route_configuration) -> GundiDelivery:
-    return GundiDelivery(
-        payload=observation,
-        route_configuration=route_configuration,
-        provider=_build_provider_info(provider),
+def _get_ordering_key(observation):
+    # Set ordering key only for updates
+    return (
+        str(observation.gundi_id)
+        if observation.observation_type == StreamPrefixEnum.event_update.value
+        else ""
     )
 
 
 async def _publish_gundi_delivery(
     *,
     observation,
-    destination,
-    destination_integration,
-    provider,
-    provider_key,
-    route_configuration,
-    broker_config,
-    destination_str,
-    provider_str,
+    plan: RoutingPlan,
+    destination_plan: DestinationPlan,
     current_span,
 ):
     """Generic-model publish path: wrap the Gundi payload in a GundiDelivery
@@ -126,23 +109,18 @@ async def _publish_gundi_delivery(
     is responsible for transformation."""
 
     # Validate broker — same restriction as the legacy path.
-    broker_value = (broker_config or {}).get("broker", Broker.GCP_PUBSUB.value).strip().lower()
-    if broker_value != Broker.GCP_PUBSUB.value:
-        current_span.set_attribute("broker", broker_value)
-        raise ReferenceDataError(
-            f"Broker '{broker_value}' is no longer supported. Please use `{Broker.GCP_PUBSUB.value}` instead."
-        )
+    _check_broker(destination_plan, current_span)
 
     try:
         delivery = _build_gundi_delivery(
             observation=observation,
-            provider=provider,
-            route_configuration=route_configuration,
+            provider_info=plan.provider_info,
+            route_configuration=plan.route_configuration,
         )
     except Exception as e:
         error_msg = (
             f"Error building GundiDelivery for observation {observation.gundi_id} "
-            f"from {provider_str} for destination {destination_str}: "
+            f"from {plan.provider_str} for destination {destination_plan.destination_str}: "
             f"{type(e).__name__}: {e}. Discarded."
         )
         logger.exception(error_msg)
@@ -151,64 +129,169 @@ async def _publish_gundi_delivery(
         current_span.add_event(
             name="routing_service.observation_discarded_on_generic_envelope_error"
         )
-        return
+        metrics.discarded_messages.labels(reason="generic_envelope_error").inc()
+        return False
 
-    attributes = build_transformed_message_attributes(
-        observation=observation,
-        destination=destination,
-        gundi_version="v2",
-        provider_key=provider_key,
+    attributes = destination_plan.build_attributes(observation)
+
+    pubsub_message = build_gcp_pubsub_message(payload=delivery.dict(exclude_none=True))
+    await send_message_to_gcp_pubsub_dispatcher(
+        message=pubsub_message,
+        attributes=attributes,
+        destination=destination_plan.destination,
+        broker_config=destination_plan.broker_config,
+        ordering_key=_get_ordering_key(observation),
+        topic_name=destination_plan.topic_name,
+    )
+    logger.info(
+        f"Observation {observation.gundi_id} published as GundiDelivery to {destination_plan.destination_str}.",
+        extra=attributes,
     )
+    return True
+
+
+async def _route_observation_to_destination(
+    *,
+    observation,
+    plan: RoutingPlan,
+    destination_plan: DestinationPlan,
+    current_span,
+    event_id=None,
+):
+    """Transform and publish an observation for a single destination.
+
+    Transformer errors only discard this destination. A ReferenceDataError
+    propagates so the whole message is retried. Deliveries are recorded in
+    the ledger so a retry doesn't send the observation again.
+    """
+    destination = destination_plan.destination
+    destination_str = destination_plan.destination_str
+    provider_str = plan.provider_str
+    if not destination_plan.integration:
+        error = f"Integration details for destination '{destination.id}' not found."
+        current_span.set_attribute("error", error)
+        raise ReferenceDataError(error)
+
+    # Generic-model path: publish a GundiDelivery envelope and let
+    # the action runner perform destination-specific transformation.
+    if destination_plan.uses_generic_model:
+        if await _publish_gundi_delivery(
+            observation=observation,
+            plan=plan,
+            destination_plan=destination_plan,
+            current_span=current_span,
+        ):
+            await set_destination_delivered(
+                event_id=event_id, destination_id=destination.id
+            )
+        return
+
+    # Transform the observation for the destination
+    try:
+        stream_type = observation.observation_type
+        transformed_observation = await transform_observation_v2(
+            observation=observation,
+            destination=destination_plan.integration,
+            provider=plan.provider,
+            route_configuration=plan.route_configuration,
+            rules=destination_plan.get_rules(stream_type),
+            transformer=destination_plan.get_transformer(stream_type),
+        )
+    except Exception as e:
+        error_msg = f"Error transforming observation {observation.gundi_id} from {provider_str} for destination {destination_str}: {type(e).__name__}: {e}. Discarded."
+        logger.exception(error_msg)
+        current_span.set_attribute("error", error_msg)
+        current_span.set_attribute("is_discarded", True)
+        current_span.add_event(
+            name="routing_service.observation_discarded_on_transformer_error"
+        )
+        metrics.discarded_messages.labels(reason="transformer_error").inc()
+        return  # Skip this destination, the others are not affected
+
+    if not transformed_observation:
+        logger.warning(
+            f"Observation {observation.gundi_id} from {provider_str} could not be transformed for destination {destination_str}. Discarded."
+        )
+        current_span.set_attribute("is_discarded", True)
+        current_span.add_event(
+            name="routing_service.observation_discarded_by_transformer"
+        )
+        metrics.discarded_messages.labels(reason="not_transformed").inc()
+        return
 
-    pubsub_message = build_gcp_pubsub_message(
-        payload=delivery.dict(exclude_none=True)
+    logger.debug(
+        f"Observation {observation.gundi_id} from {provider_str} transformed for destination {destination_str}."
     )
-    ordering_key = (
-        str(observation.gundi_id)
-        if observation.observation_type == StreamPrefixEnum.event_update.value
-        else ""
+    # Add metadata used to dispatch the observation
+    attributes = destination_plan.build_attributes(
+        observation,
+        # Field mappings overrides take precedence
+        provider_key=getattr(transformed_observation, "provider_key", None),
+    )
+    log_payload(
+        logger,
+        "Transformed observation: %s, attributes: %s",
+        transformed_observation,
+        attributes,
     )
+
+    _check_broker(destination_plan, current_span)
+
+    # Build message for dispatcher
+    if isinstance(transformed_observation, dict):
+        # Pass the data as a raw dict for backward compatibility with older dispatchers (e.g. Movebank)
+        pubsub_message_payload = transformed_observation
+    else:
+        # Build system event using pydantic models
+        pubsub_message_payload = build_transformer_event(transformed_observation).dict(
+            exclude_none=True
+        )
+
+    # Publish to a GCP PubSub topic
+    pubsub_message = build_gcp_pubsub_message(payload=pubsub_message_payload)
     await send_message_to_gcp_pubsub_dispatcher(
         message=pubsub_message,
         attributes=attributes,
         destination=destination,
-        broker_config=broker_config,
-        ordering_key=ordering_key,
+        broker_config=destination_plan.broker_config,
+        ordering_key=_get_ordering_key(observation),
+        topic_name=destination_plan.topic_name,
     )
     logger.info(
-        f"Observation {observation.gundi_id} published as GundiDelivery to {destination_str}.",
+        f"Observation {observation.gundi_id} transformed and sent to pubsub topic successfully.",
         extra=attributes,
     )
+    await set_destination_delivered(event_id=event_id, destination_id=destination.id)
 
 
-async def transform_and_route_observation(observation):
+async def transform_and_route_observation(observation, event_id=None):
     with tracing.tracer.start_as_current_span(
         "routing_service.transform_and_route_observation", kind=SpanKind.CONSUMER
     ) as current_span:
         try:
             # ToDo: Implement a destination resolution algorithm considering all the routes and filters
-            connection = await get_connection(
-                connection_id=observation.data_provider_id
+            # The connection, its default route and the destination integrations are resolved together
+            routing = await resolve_routing(
+                data_provider_id=observation.data_provider_id
             )
+            connection = routing.connection
             if not connection:
                 error = f"Connection '{observation.data_provider_id}' not found."
                 current_span.set_attribute("error", error)
                 raise ReferenceDataError(error)
-            provider = connection.provider
-            destinations = connection.destinations
-            default_route = await get_route(
-                route_id=connection.default_route.id,
-                data_provider_id=observation.data_provider_id,
-            )
-            if not default_route:
+            if not routing.route:
                 error = f"Default route '{connection.default_route.id}', for provider '{observation.data_provider_id}' not found."
                 current_span.set_attribute("error", error)
                 raise ReferenceDataError(error)
-            route_configuration = default_route.configuration
-            provider_key = get_provider_key(provider)  # i.e. gundi_cellstop_abc1234..
+            # Everything that doesn't depend on the message is compiled once per data provider
+            plan = get_routing_plan(
+                data_provider_id=observation.data_provider_id, routing=routing
+            )
+            destinations = plan.destinations
+            current_span.set_attribute("routing_plan_version", plan.version)
             current_span.set_attribute("destinations_qty", len(destinations))
             current_span.set_attribute(
-                "destinations", str([str(d.id) for d in destinations])
+                "destinations", str([str(d.destination.id) for d in destinations])
             )
             if len(destinations) < 1:
                 current_span.add_event(
@@ -226,121 +309,33 @@ async def transform_and_route_observation(observation):
                     },
                 )
 
-            provider_str = f"'{connection.provider.owner.name} - {connection.provider.name}'({connection.provider.id})"
-            for destination in destinations:
-                # Get additional configuration for the destination
-                destination_integration = await get_integration(
-                    integration_id=destination.id
-                )
-                broker_config = destination_integration.additional
-                destination_str = (
-                    f"'{destination.owner.name} - {destination.name}'({destination.id})"
-                )
+            # Skip the destinations that got the observation in a previous attempt
+            if delivered := await get_delivered_destinations(
+                event_id, [d.destination.id for d in destinations]
+            ):
+                destinations = [
+                    d for d in destinations if str(d.destination.id) not in delivered
+                ]
+            current_span.set_attribute(
+                "destinations_already_delivered_qty", len(delivered)
+            )
+            current_span.set_attribute(
+                "destinations_already_delivered", str(sorted(delivered))
+            )
 
-                # Generic-model path: publish a GundiDelivery envelope and let
-                # the action runner perform destination-specific transformation.
-                if _uses_generic_model(destination_integration):
-                    await _publish_gundi_delivery(
+            await gather_with_concurrency(
+                [
+                    _route_observation_to_destination(
                         observation=observation,
-                        destination=destination,
-                        destination_integration=destination_integration,
-                        provider=provider,
-                        provider_key=provider_key,
-                        route_configuration=route_configuration,
-                        broker_config=broker_config,
-                        destination_str=destination_str,
-                        provider_str=provider_str,
+                        plan=plan,
+                        destination_plan=destination_plan,
                         current_span=current_span,
+                        event_id=event_id,
                     )
-                    continue
-
-                # Transform the observation for the destination
-                try:
-                    transformed_observation = await transform_observation_v2(
-                        observation=observation,
-                        destination=destination_integration,
-                        provider=provider,
-                        route_configuration=route_configuration,
-                    )
-                except Exception as e:
-                    error_msg = f"Error transforming observation {observation.gundi_id} from {provider_str} for destination {destination_str}: {type(e).__name__}: {e}. Discarded."
-                    logger.exception(error_msg)
-                    current_span.set_attribute("error", error_msg)
-                    current_span.set_attribute("is_discarded", True)
-                    current_span.add_event(
-                        name="routing_service.observation_discarded_on_transformer_error"
-                    )
-                    continue  # Skip this destination and try the next one
-
-                if not transformed_observation:
-                    logger.warning(
-                        f"Observation {observation.gundi_id} from {provider_str} could not be transformed for destination {destination_str}. Discarded."
-                    )
-                    current_span.set_attribute("is_discarded", True)
-                    current_span.add_event(
-                        name="routing_service.observation_discarded_by_transformer"
-                    )
-                    continue
-
-                logger.debug(
-                    f"Observation {observation.gundi_id} from {provider_str} transformed for destination {destination_str}."
-                )
-                # Add metadata used to dispatch the observation
-                attributes = build_transformed_message_attributes(
-                    observation=observation,
-                    destination=destination,
-                    gundi_version="v2",
-                    provider_key=getattr(
-                        transformed_observation, "provider_key", provider_key
-                    ),  # Field mappings overrides take precedence
-                )
-                logger.debug(
-                    f"Transformed observation: {repr(transformed_observation)}, attributes: {attributes}"
-                )
-
-                if (
-                    broker_type := broker_config.get("broker", Broker.GCP_PUBSUB.value)
-                    .strip()
-                    .lower()
-                    != Broker.GCP_PUBSUB.value
-                ):
-                    current_span.set_attribute("broker", broker_type)
-                    raise ReferenceDataError(
-                        f"Broker '{broker_type}' is no longer supported. Please use `{Broker.GCP_PUBSUB.value}` instead."
-                    )
-
-                # Build message for dispatcher
-                if isinstance(transformed_observation, dict):
-                    # Pass the data as a raw dict for backward compatibility with older dispatchers (e.g. Movebank)
-                    pubsub_message_payload = transformed_observation
-                else:
-                    # Build system event using pydantic models
-                    pubsub_message_payload = build_transformer_event(
-                        transformed_observation
-                    ).dict(exclude_none=True)
-
-                # Publish to a GCP PubSub topic
-                pubsub_message = build_gcp_pubsub_message(
-                    payload=pubsub_message_payload
-                )
-                # Set ordering key only for updates
-                ordering_key = (
-                    str(observation.gundi_id)
-                    if observation.observation_type
-                    == StreamPrefixEnum.event_update.value
-                    else ""
-                )
-                await send_message_to_gcp_pubsub_dispatcher(
-                    message=pubsub_message,
-                    attributes=attributes,
-                    destination=destination,
-                    broker_config=broker_config,
-                    ordering_key=ordering_key,
-                )
-                logger.info(
-                    f"Observation {observation.gundi_id} transformed and sent to pubsub topic successfully.",
-                    extra=attributes,
-                )
+                    for destination_plan in destinations
+                ],
+                limit=settings.DESTINATION_FANOUT_CONCURRENCY,
+            )
         except ReferenceDataError as e:
             error_msg = (
                 f"External error occurred obtaining reference data for observation: {e}",
@@ -379,16 +374,20 @@ async def handle_observation_received(event: ObservationReceived):
     with tracing.tracer.start_as_current_span(
         "routing_service.handle_observation_received", kind=SpanKind.CONSUMER
     ) as current_span:
-        current_span.set_attribute("payload", repr(event.payload))
-        await transform_and_route_observation(observation=event.payload)
+        set_payload_attribute(current_span, "payload", event.payload)
+        await transform_and_route_observation(
+            observation=event.payload, event_id=str(event.event_id)
+        )
 
 
 async def handle_event_received(event: EventReceived):
     with tracing.tracer.start_as_current_span(
         "routing_service.handle_event_received", kind=SpanKind.CONSUMER
     ) as current_span:
-        current_span.set_attribute("payload", repr(event.payload))
-        await transform_and_route_observation(observation=event.payload)
+        set_payload_attribute(current_span, "payload", event.payload)
+        await transform_and_route_observation(
+            observation=event.payload, event_id=str(event.event_id)
+        )
 
 
 async def handle_event_update(event: EventUpdateReceived):
@@ -396,25 +395,31 @@ async def handle_event_update(event: EventUpdateReceived):
         "routing_service.handle_event_update", kind=SpanKind.CONSUMER
     ) as current_span:
         event_update = event.payload
-        current_span.set_attribute("payload", repr(event.payload))
-        current_span.set_attribute("changes", str(event_update.changes))
-        await transform_and_route_observation(observation=event_update)
+        set_payload_attribute(current_span, "payload", event.payload)
+        set_payload_attribute(current_span, "changes", event_update.changes)
+        await transform_and_route_observation(
+            observation=event_update, event_id=str(event.event_id)
+        )
 
 
 async def handle_attachment_received(event: AttachmentReceived):
     with tracing.tracer.start_as_current_span(
         "routing_service.handle_attachment_received", kind=SpanKind.CONSUMER
     ) as current_span:
-        current_span.set_attribute("payload", repr(event.payload))
-        await transform_and_route_observation(observation=event.payload)
+        set_payload_attribute(current_span, "payload", event.payload)
+        await transform_and_route_observation(
+            observation=event.payload, event_id=str(event.event_id)
+        )
 
 
 async def handle_text_message_received(event: TextMessageReceived):
     with tracing.tracer.start_as_current_span(
         "routing_service.handle_text_message_received", kind=SpanKind.CONSUMER
     ) as current_span:
-        current_span.set_attribute("payload", repr(event.payload))
-        await transform_and_route_observation(observation=event.payload)
+        set_payload_attribute(current_span, "payload", event.payload)
+        await transform_and_route_observation(
+            observation=event.payload, event_id=str(event.event_id)
+        )
 
 
 event_handlers = {
@@ -0,0 +1,42 @@
+"""
+Startup and shutdown of the background components, shared by the entry points.
+
+The push endpoint (app.main) and the pull worker (app.subscribers.pull_worker)
+run the same components, so messages are published, dead-lettered and logged
+the same way whichever way they are received.
+"""
+import asyncio
+from contextlib import asynccontextmanager
+
+from app.core import settings
+from app.core.pubsub import publisher, batch_publisher, dead_letter_spooler
+from app.services.activity_logger import activity_log_emitter
+from app.services.smart_datamodels import smart_datamodels
+from app.services.transformers import warm_up_destinations
+
+
+@asynccontextmanager
+async def background_services():
+    """Run the long-lived resources shared across messages while the block runs."""
+    await publisher.start()
+    if settings.PUBSUB_BATCHING_ENABLED:
+        await batch_publisher.start()
+    if settings.DEAD_LETTER_SPOOLER_ENABLED:
+        await dead_letter_spooler.start()
+    if settings.ACTIVITY_LOG_EMITTER_ENABLED:
+        await activity_log_emitter.start()
+    await smart_datamodels.start()
+    # Don't delay startup, the first messages share the same lookups
+    warm_up_task = asyncio.ensure_future(
+        warm_up_destinations(settings.SMART_WARM_UP_DESTINATION_IDS)
+    )
+    try:
+        yield
+    finally:
+        warm_up_task.cancel()
+        await smart_datamodels.close()
+        # Flush pending batches, dead letters and activity logs before closing the connection pool
+        await batch_publisher.close()
+        await dead_letter_spooler.close()
+        await activity_log_emitter.close()
+        await publisher.close()
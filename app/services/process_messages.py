@@ -1,16 +1,21 @@
 import logging
 from datetime import datetime, timezone
-from app.core import tracing
+from app.core import metrics, tracing
 from opentelemetry.trace import SpanKind
 from gundi_core import schemas
-from app.core.deduplication import set_event_processing_status, EventProcessingStatus
-from app.core.deduplication import is_event_processed
+from app.core.deduplication import (
+    EventClaim,
+    EventProcessingStatus,
+    get_delivered_destinations,
+    set_destination_delivered,
+)
+from app.core.ingest import IngestMessage, decode_push_request
 from app.core.local_logging import ExtraKeys
-from app.core.utils import Broker
-from app.core.errors import ReferenceDataError
+from app.core.payload_logging import log_payload, set_payload_attribute
+from app.core.utils import Broker, gather_with_concurrency
+from app.core.errors import EventInProgress, ReferenceDataError
 from app.services.event_handlers import event_handlers, event_schemas
 from app.services.transformers import (
-    extract_fields_from_message,
     build_gcp_pubsub_message,
     get_source_id,
     get_data_provider_id,
@@ -18,10 +23,14 @@ from app.services.transformers import (
     build_transformed_message_attributes,
 )
 from app.core.gundi import (
-    get_all_outbound_configs_for_id, update_observation_with_device_configuration,
+    get_all_outbound_configs_for_id,
+    update_observation_with_device_configuration,
 )
 from app.core import settings
-from app.core.pubsub import send_message_to_gcp_pubsub_dispatcher, send_observation_to_dead_letter_topic
+from app.core.pubsub import (
+    send_message_to_gcp_pubsub_dispatcher,
+    send_observation_to_dead_letter_topic,
+)
 
 
 logger = logging.getLogger(__name__)
@@ -29,34 +38,122 @@ logger = logging.getLogger(__name__)
 
 async def process_observation_event(raw_message, attributes):
     with tracing.tracer.start_as_current_span(
-            "routing_service.process_observations_event", kind=SpanKind.CONSUMER
+        "routing_service.process_observations_event", kind=SpanKind.CONSUMER
     ) as current_span:
-        logger.debug(f"Message received: \npayload: {raw_message} \nattributes: {attributes}")
+        log_payload(
+            logger,
+            "Message received: \npayload: %s \nattributes: %s",
+            raw_message,
+            attributes,
+        )
         current_span.add_event(name="routing_service.observations_received_at_consumer")
         event_type = raw_message.get("event_type")
         if schema_version := raw_message.get("schema_version") != "v1":
-            logger.warning(f"Schema version '{schema_version}' not supported. Message discarded.")
+            logger.warning(
+                f"Schema version '{schema_version}' not supported. Message discarded."
+            )
+            metrics.discarded_messages.labels(reason="unsupported_schema_version").inc()
             return
         # ToDo: Discard duplicate events
         current_span.set_attribute("system_event_type", event_type)
-        current_span.set_attribute("observation_type", str(raw_message.get("observation_type")))
-        current_span.set_attribute("message", str(raw_message))
+        current_span.set_attribute(
+            "observation_type", str(raw_message.get("observation_type"))
+        )
+        set_payload_attribute(current_span, "message", raw_message)
         current_span.set_attribute("environment", settings.TRACE_ENVIRONMENT)
         current_span.set_attribute("service", "cdip-routing")
         try:
             handler = event_handlers[event_type]
         except KeyError:
             logger.warning(f"Event of type '{event_type}' unknown. Ignored.")
+            metrics.discarded_messages.labels(reason="unknown_event_type").inc()
             return
         try:
             schema = event_schemas[event_type]
         except KeyError:
-            logger.warning(f"Event Schema for '{event_type}' not found. Message discarded.")
+            logger.warning(
+                f"Event Schema for '{event_type}' not found. Message discarded."
+            )
         parsed_event = schema.parse_obj(raw_message)
-        result = await handler(event=parsed_event)
-        # Keep track of processed events for deduplication
-        await set_event_processing_status(event_id=str(parsed_event.event_id), status=EventProcessingStatus.PROCESSED)
-        return result
+        return await handler(event=parsed_event)
+
+
+async def _route_observation_to_destination(
+    *,
+    observation,
+    raw_observation,
+    attributes,
+    destination,
+    gundi_version,
+    message_id,
+    observation_logging_extra,
+    current_span,
+):
+    """Transform and publish a v1 observation for a single destination.
+
+    Transformer errors send the raw observation to the dead-letter topic and
+    skip only this destination. A ReferenceDataError propagates so the whole
+    message is retried. Deliveries are recorded in the ledger so a retry
+    doesn't send the observation again.
+    """
+    # Get additional configuration for the destination
+    broker_config = destination.additional
+
+    try:  # Transform the observation for the destination
+        transformed_observation = await transform_observation_to_destination_schema(
+            observation=observation,
+            destination=destination,
+            gundi_version=gundi_version,
+        )
+    except Exception as e:
+        error_msg = (
+            f"Error transforming observation. Sending to dead-letter. {type(e)}: {e}"
+        )
+        logger.exception(error_msg)
+        await send_observation_to_dead_letter_topic(
+            raw_observation, attributes, reason="transformation_error"
+        )
+        current_span.set_attribute("error", error_msg)
+        return  # Skip this destination, the others are not affected
+
+    if not transformed_observation:
+        return
+
+    transformed_attributes = build_transformed_message_attributes(
+        observation=observation,
+        destination=destination,
+        gundi_version=gundi_version,
+    )
+    log_payload(
+        logger,
+        "Transformed observation: %s, attributes: %s",
+        transformed_observation,
+        transformed_attributes,
+    )
+
+    broker_type = broker_config.get("broker", Broker.GCP_PUBSUB.value).strip().lower()
+    current_span.set_attribute("broker", broker_type)
+    if broker_type != Broker.GCP_PUBSUB.value:
+        raise ReferenceDataError(
+            f"Broker '{broker_type}' is no longer supported. Please use `{Broker.GCP_PUBSUB}` instead."
+        )
+    # Route to a GCP PubSub topic
+    pubsub_message = build_gcp_pubsub_message(payload=transformed_observation)
+    await send_message_to_gcp_pubsub_dispatcher(
+        message=pubsub_message,
+        attributes=transformed_attributes,
+        destination=destination,
+        broker_config=broker_config,
+    )
+    logger.info(
+        "Observation transformed and sent to pubsub topic successfully.",
+        extra={
+            **observation_logging_extra,
+            **transformed_attributes,
+            "destination_id": str(destination.id),
+        },
+    )
+    await set_destination_delivered(event_id=message_id, destination_id=destination.id)
 
 
 async def process_observation(raw_observation, attributes, message_id=None):
@@ -71,16 +168,18 @@ async def process_observation(raw_observation, attributes, message_id=None):
         "routing_service.process_observation", kind=SpanKind.CONSUMER
     ) as current_span:
         current_span.add_event(name="routing_service.observations_received_at_consumer")
-        current_span.set_attribute("message", str(raw_observation))
+        set_payload_attribute(current_span, "message", raw_observation)
         current_span.set_attribute("environment", settings.TRACE_ENVIRONMENT)
         current_span.set_attribute("service", "cdip-routing")
         try:
             logger.debug(f"message received")
-            logger.debug(f"observation: {raw_observation}")
-            logger.debug(f"attributes: {attributes}")
+            log_payload(logger, "observation: %s", raw_observation)
+            logger.debug("attributes: %s", attributes)
             # Get the schema version to process it accordingly
             gundi_version = attributes.get("gundi_version", "v1")
-            schema = schemas.models_by_stream_type[raw_observation.get("observation_type")]
+            schema = schemas.models_by_stream_type[
+                raw_observation.get("observation_type")
+            ]
             observation = schema.parse_obj(raw_observation)
             observation_logging_extra = {
                 ExtraKeys.DeviceId: observation.device_id,
@@ -97,7 +196,7 @@ async def process_observation(raw_observation, attributes, message_id=None):
         except Exception as e:
             logger.exception(
                 f"Exception occurred prior to processing observation: \n{observation_logging_extra} \n error: {e}",
-                extra={   # FixMe: Extra is ignored by GCP
+                extra={  # FixMe: Extra is ignored by GCP
                     ExtraKeys.AttentionNeeded: True,
                     ExtraKeys.Observation: raw_observation,
                 },
@@ -107,9 +206,6 @@ async def process_observation(raw_observation, attributes, message_id=None):
         try:
             if observation:
                 await update_observation_with_device_configuration(observation)
-                provider = None
-                route_configuration = None
-                provider_key = None
                 destinations = await get_all_outbound_configs_for_id(
                     observation.integration_id, observation.device_id
                 )
@@ -133,71 +229,36 @@ async def process_observation(raw_observation, attributes, message_id=None):
                         },
                     )
 
-                for destination in destinations:
-                    # Get additional configuration for the destination
-                    broker_config = destination.additional
-
-                    try:  # Transform the observation for the destination
-                        transformed_observation = await transform_observation_to_destination_schema(
-                                observation=observation,
-                                destination=destination,
-                                provider=provider,
-                                route_configuration=route_configuration,
-                                gundi_version=gundi_version,
-                        )
-                    except Exception as e:
-                        error_msg = (
-                            f"Error transforming observation. Sending to dead-letter. {type(e)}: {e}"
-                        )
-                        logger.exception(error_msg)
-                        await send_observation_to_dead_letter_topic(raw_observation, attributes)
-                        current_span.set_attribute("error", error_msg)
-                        continue  # Skip to the next destination
-
-                    if not transformed_observation:
-                        continue
-
-                    attributes = build_transformed_message_attributes(
-                        observation=observation,
-                        destination=destination,
-                        gundi_version=gundi_version,
-                        provider_key=provider_key,
-                    )
-                    logger.debug(
-                        f"Transformed observation: {transformed_observation}, attributes: {attributes}"
-                    )
+                # Skip the destinations that got the observation in a previous attempt
+                if delivered := await get_delivered_destinations(
+                    message_id, [d.id for d in destinations]
+                ):
+                    destinations = [
+                        d for d in destinations if str(d.id) not in delivered
+                    ]
+                current_span.set_attribute(
+                    "destinations_already_delivered_qty", len(delivered)
+                )
+                current_span.set_attribute(
+                    "destinations_already_delivered", str(sorted(delivered))
+                )
 
-                    broker_type = (
-                        broker_config.get("broker", Broker.GCP_PUBSUB.value).strip().lower()
-                    )
-                    current_span.set_attribute("broker", broker_type)
-                    if broker_type != Broker.GCP_PUBSUB.value:
-                        raise ReferenceDataError(
-                            f"Broker '{broker_type}' is no longer supported. Please use `{Broker.GCP_PUBSUB}` instead."
+                await gather_with_concurrency(
+                    [
+                        _route_observation_to_destination(
+                            observation=observation,
+                            raw_observation=raw_observation,
+                            attributes=attributes,
+                            destination=destination,
+                            gundi_version=gundi_version,
+                            message_id=message_id,
+                            observation_logging_extra=observation_logging_extra,
+                            current_span=current_span,
                         )
-                    # Route to a GCP PubSub topic
-                    pubsub_message = build_gcp_pubsub_message(
-                        payload=transformed_observation
-                    )
-                    await send_message_to_gcp_pubsub_dispatcher(
-                        message=pubsub_message,
-                        attributes=attributes,
-                        destination=destination,
-                        broker_config=broker_config,
-                    )
-                    logger.info(
-                        "Observation transformed and sent to pubsub topic successfully.",
-                        extra={
-                            **observation_logging_extra,
-                            **attributes,
-                            "destination_id": str(destination.id),
-                        },
-                    )
-                    # Keep track of processed events for deduplication
-                    await set_event_processing_status(
-                        event_id=message_id,
-                        status=EventProcessingStatus.PROCESSED
-                    )
+                        for destination in destinations
+                    ],
+                    limit=settings.DESTINATION_FANOUT_CONCURRENCY,
+                )
             else:
                 logger.error(
                     "Logic error, expecting 'observation' to be not None.",
@@ -262,57 +323,95 @@ def is_too_old(timestamp):
 
 
 async def process_request(request):
-    # Extract the observation and attributes from the request
-    json_data = await request.json()
-    headers = request.headers
-    pubsub_message = json_data["message"]
-    payload, attributes = extract_fields_from_message(pubsub_message)
+    # Decode the request body once. The payload is parsed later, only if the message isn't discarded.
+    body = await request.body()
+    with metrics.timer(metrics.decode_seconds):
+        message = decode_push_request(body, request.headers)
+    return await process_message(message)
+
+
+async def process_message(message: IngestMessage):
+    """
+    Check the age of, deduplicate and dispatch a received PubSub message
+    to the handler of its Gundi version. Shared by the push endpoint and the pull worker.
+    """
+    # Messages of the lightweight stream types are processed without spans
+    with tracing.skip_spans(tracing.is_lightweight(message.stream_type)):
+        return await _process_message(message)
+
+
+async def _process_message(message: IngestMessage):
+    attributes = message.attributes
+    pubsub_message_id = message.pubsub_message_id
     # Load tracing context
     tracing.pubsub_instrumentation.load_context_from_attributes(attributes)
     with tracing.tracer.start_as_current_span(
-        "routing_service.process_request", kind=SpanKind.CLIENT
+        "routing_service.process_request",
+        kind=SpanKind.CLIENT,
+        # Used to sample the trace by stream type
+        attributes={"observation_type": str(message.stream_type)},
     ) as current_span:
-        pubsub_message_id = pubsub_message.get("message_id")
-        system_event_id = payload.get("event_id")
+        system_event_id = message.event_id
         current_span.set_attribute("pubsub_message_id", str(pubsub_message_id))
         current_span.set_attribute("system_event_id", str(system_event_id))
-        logger.debug(f"Received PubsubMessage(PubSub ID:{pubsub_message_id}, System Event ID: {system_event_id}): {pubsub_message}")
-        # Discard duplicate events by checking if the event_id has been processed before
-        message_id = system_event_id or pubsub_message_id  # system_event_id is not available in v1 messages
-        if message_id and await is_event_processed(event_id=message_id):
-            logger.warning(
-                f"Message discarded. Event with ID '{message_id}' has already been processed (possible duplicate)."
-            )
-            current_span.set_attribute("is_duplicate", True)
-            await send_observation_to_dead_letter_topic(payload, attributes)
-            return {
-                "status": "discarded",
-                "reason": "Event has already been processed (possible duplicate)."
-            }
+        logger.debug(
+            f"Processing PubsubMessage(PubSub ID:{pubsub_message_id}, System Event ID: {system_event_id})"
+        )
+        # Cheap checks first: the age of the message, then duplicates. The payload is parsed last.
         # Handle maximum retries and age of the event
-        timestamp = pubsub_message.get("publish_time") or pubsub_message.get("time") or headers.get("ce-time")
-        if is_too_old(timestamp=timestamp):
+        if is_too_old(timestamp=message.timestamp):
             logger.warning(
                 f"Message discarded. The message is too old or the retry time limit has been reached."
             )
             current_span.set_attribute("is_too_old", True)
-            await send_observation_to_dead_letter_topic(payload, attributes)
-            return {
-                "status": "discarded",
-                "reason": "Message is too old or the retry time limit has been reach",
-            }
-        if (version := attributes.get("gundi_version", "v1")) == "v1":
-            await process_observation(payload, attributes, message_id)
-        elif version == "v2":
-            await process_observation_event(payload, attributes)
-        else:
-            logger.warning(
-                f"Message discarded. Version '{version}' is not supported by this dispatcher."
+            metrics.discarded_messages.labels(reason="too_old").inc()
+            await send_observation_to_dead_letter_topic(
+                message.to_bytes(), attributes, reason="too_old"
             )
-            await send_observation_to_dead_letter_topic(payload, attributes)
             return {
                 "status": "discarded",
-                "reason": f"Gundi '{version}' messages are not supported",
+                "reason": "Message is too old or the retry time limit has been reach",
             }
+        # Claim the event, so duplicates are discarded even if they are processed concurrently
+        message_id = (
+            system_event_id or pubsub_message_id
+        )  # system_event_id is not available in v1 messages
+        async with EventClaim(message_id) as claim:
+            if claim.status == EventProcessingStatus.IN_PROGRESS:
+                # Not acked, so it's redelivered if the other instance fails to process it
+                logger.info(
+                    f"Message rejected. Event with ID '{message_id}' is being processed by another instance."
+                )
+                current_span.set_attribute("is_in_progress", True)
+                raise EventInProgress(message_id)
+            if not claim.acquired:
+                logger.warning(
+                    f"Message discarded. Event with ID '{message_id}' has already been processed (possible duplicate)."
+                )
+                current_span.set_attribute("is_duplicate", True)
+                metrics.discarded_messages.labels(reason="duplicate").inc()
+                await send_observation_to_dead_letter_topic(
+                    message.to_bytes(), attributes, reason="duplicate"
+                )
+                return {
+                    "status": "discarded",
+                    "reason": "Event has already been processed (possible duplicate).",
+                }
+            if (version := message.gundi_version) == "v1":
+                await process_observation(message.payload, attributes, message_id)
+            elif version == "v2":
+                await process_observation_event(message.payload, attributes)
+            else:
+                logger.warning(
+                    f"Message discarded. Version '{version}' is not supported by this dispatcher."
+                )
+                metrics.discarded_messages.labels(reason="unsupported_version").inc()
+                await send_observation_to_dead_letter_topic(
+                    message.to_bytes(), attributes, reason="unsupported_version"
+                )
+                return {
+                    "status": "discarded",
+                    "reason": f"Gundi '{version}' messages are not supported",
+                }
 
         return {"status": "processed"}
@@ -0,0 +1,223 @@
+"""
+Routing plans.
+
+A routing plan holds everything needed to route the messages of a data provider
+that doesn't depend on the message itself: the destinations with their topics,
+message attributes, field mapping rules and transformers. It's compiled once per
+data provider and reused until its connection, route or destination integrations
+change, so the per-message work is just transforming and publishing.
+"""
+import hashlib
+import logging
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+from gundi_core.events import ProviderInfo
+
+from app.core import codec, settings
+from app.core.cache import routing_plans_cache
+from app.core.gundi import ResolvedRouting
+from app.core.pubsub import get_topic_name
+from app.core.utils import Broker, get_provider_key
+from app.services.transformers import (
+    build_field_mapping_rules,
+    build_message_attributes_template,
+    build_observation_attributes,
+    get_transformer_class,
+    transformer_pool,
+)
+
+
+logger = logging.getLogger(__name__)
+
+
+def _uses_generic_model(destination_integration) -> bool:
+    """Whether a destination uses the generic-model path (publish a
+    GundiDelivery for its action runner to transform) instead of a legacy
+    in-process Transformer.
+
+    Decided by the destination's integration *type* (e.g. ``cmore``) via
+    ``settings.GENERIC_MODEL_DESTINATION_TYPES`` so it requires no per-integration
+    config. The legacy per-integration ``additional.generic_model`` flag is still
+    honored as an override for one-off opt-in.
+    """
+    type_value = getattr(getattr(destination_integration, "type", None), "value", None)
+    if type_value and type_value in settings.GENERIC_MODEL_DESTINATION_TYPES:
+        return True
+    return bool((destination_integration.additional or {}).get("generic_model"))
+
+
+def _build_provider_info(provider) -> ProviderInfo:
+    provider_type = ""
+    if getattr(provider, "type", None) is not None:
+        provider_type = getattr(provider.type, "value", "") or ""
+
+    owner_id = ""
+    owner_name = ""
+    if getattr(provider, "owner", None) is not None:
+        owner_id = str(getattr(provider.owner, "id", "") or "")
+        owner_name = getattr(provider.owner, "name", "") or ""
+
+    return ProviderInfo(
+        provider_id=str(provider.id),
+        provider_type=provider_type,
+        provider_name=getattr(provider, "name", "") or "",
+        owner_id=owner_id,
+        owner_name=owner_name,
+    )
+
+
+@dataclass
+class DestinationPlan:
+    destination: object
+    destination_str: str
+    integration: Optional[object] = None
+    broker_config: dict = field(default_factory=dict)
+    broker: str = Broker.GCP_PUBSUB.value
+    topic_name: Optional[str] = None
+    uses_generic_model: bool = False
+    attributes_template: dict = field(default_factory=dict)
+    route_configuration: Optional[object] = None
+    data_provider_id: Optional[str] = None
+    _rules: Dict[str, list] = field(default_factory=dict)
+    _transformers: Dict[str, object] = field(default_factory=dict)
+
+    def build_attributes(self, observation, provider_key=None):
+        return build_observation_attributes(
+            observation=observation,
+            template=self.attributes_template,
+            provider_key=provider_key,
+        )
+
+    def get_rules(self, stream_type):
+        """Field mapping rules for a stream type, compiled on first use."""
+        if (rules := self._rules.get(stream_type)) is None:
+            rules = build_field_mapping_rules(
+                route_configuration=self.route_configuration,
+                data_provider_id=self.data_provider_id,
+                stream_type=stream_type,
+                destination_id=self.destination.id,
+            )
+            self._rules[stream_type] = rules
+        return rules
+
+    def get_transformer(self, stream_type):
+        """The transformer instance for a stream type, taken from the pool on first use."""
+        if not (transformer := self._transformers.get(stream_type)):
+            Transformer = get_transformer_class(
+                stream_type, self.integration.type.value
+            )
+            transformer = transformer_pool.get(Transformer, config=self.integration)
+            self._transformers[stream_type] = transformer
+        return transformer
+
+
+@dataclass
+class RoutingPlan:
+    data_provider_id: str
+    version: str
+    routing: ResolvedRouting
+    provider: object
+    provider_key: str
+    provider_str: str
+    provider_info: Optional[ProviderInfo]
+    route_configuration: Optional[object]
+    destinations: List[DestinationPlan]
+
+    def is_built_from(self, routing: ResolvedRouting):
+        """Whether the plan was compiled from these very objects (i.e. cached in-process)."""
+        return (
+            self.routing.connection is routing.connection
+            and self.routing.route is routing.route
+            and self.routing.integrations.keys() == routing.integrations.keys()
+            and all(
+                self.routing.integrations[integration_id] is integration
+                for integration_id, integration in routing.integrations.items()
+            )
+        )
+
+
+def get_routing_version(routing: ResolvedRouting) -> str:
+    """A stamp that changes whenever the connection, the route or an integration changes."""
+    digest = hashlib.md5(codec.dump_model(routing.connection))
+    if routing.route:
+        digest.update(codec.dump_model(routing.route))
+    for integration_id in sorted(routing.integrations):
+        digest.update(codec.dump_model(routing.integrations[integration_id]))
+    return digest.hexdigest()
+
+
+def _compile_destination(
+    *, destination, integration, data_provider_id, provider_key, route_configuration
+):
+    destination_plan = DestinationPlan(
+        destination=destination,
+        destination_str=f"'{destination.owner.name} - {destination.name}'({destination.id})",
+        integration=integration,
+        route_configuration=route_configuration,
+        data_provider_id=str(data_provider_id),
+        attributes_template=build_message_attributes_template(
+            destination=destination,
+            data_provider_id=data_provider_id,
+            provider_key=provider_key,
+        ),
+    )
+    if integration:  # Missing integrations are reported when a message is routed
+        broker_config = integration.additional or {}
+        destination_plan.broker_config = broker_config
+        destination_plan.broker = (
+            broker_config.get("broker", Broker.GCP_PUBSUB.value).strip().lower()
+        )
+        destination_plan.topic_name = get_topic_name(str(destination.id), broker_config)
+        destination_plan.uses_generic_model = _uses_generic_model(integration)
+    return destination_plan
+
+
+def compile_routing_plan(
+    *, data_provider_id, routing: ResolvedRouting, version=None
+) -> RoutingPlan:
+    connection = routing.connection
+    provider = connection.provider
+    provider_key = get_provider_key(provider)  # i.e. gundi_cellstop_abc1234..
+    route_configuration = routing.route.configuration if routing.route else None
+    return RoutingPlan(
+        data_provider_id=str(data_provider_id),
+        version=version or get_routing_version(routing),
+        routing=routing,
+        provider=provider,
+        provider_key=provider_key,
+        provider_str=f"'{provider.owner.name} - {provider.name}'({provider.id})",
+        provider_info=_build_provider_info(provider),
+        route_configuration=route_configuration,
+        destinations=[
+            _compile_destination(
+                destination=destination,
+                integration=routing.get_integration(destination.id),
+                data_provider_id=data_provider_id,
+                provider_key=provider_key,
+                route_configuration=route_configuration,
+            )
+            for destination in connection.destinations
+        ],
+    )
+
+
+def get_routing_plan(*, data_provider_id, routing: ResolvedRouting) -> RoutingPlan:
+    """Get the routing plan of a data provider, compiling it again only if its reference data changed."""
+    cache_key = str(data_provider_id)
+    plan = routing_plans_cache.get(cache_key)
+    if plan and plan.is_built_from(routing):
+        return plan
+    version = get_routing_version(routing)
+    if plan and plan.version == version:
+        # Same reference data, parsed again after the in-process cache expired
+        plan.routing = routing
+    else:
+        logger.debug(
+            f"Compiling routing plan for data provider {data_provider_id} (version {version}).",
+        )
+        plan = compile_routing_plan(
+            data_provider_id=data_provider_id, routing=routing, version=version
+        )
+    routing_plans_cache.set(cache_key, plan)
+    return plan
@@ -0,0 +1,322 @@
+"""
+Shared cache of SMART data models.
+
+Downloading and parsing the data model of a Conservation Area (and its
+configurable models) is slow, and every instance used to repeat it on each cold
+start. Parsed models are kept in-process and stored in Redis in their compact
+dict form, keyed by SMART endpoint, CA and configurable model, so they are
+downloaded once for all the instances.
+
+A copy older than SMART_DATAMODEL_REFRESH_SECONDS is still used while it's
+refreshed in the background, either when it's read or by the periodic refresher.
+If the SMART server is slow or down, the previous copy keeps being used.
+
+SmartModelIndex indexes the models to resolve event types and details in O(1).
+"""
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from functools import partial
+
+from smartconnect.models import DataModel, ConfigurableDataModel
+
+from app.core import codec, settings
+from app.core.cache import LocalCache, single_flight
+from app.core.utils import create_cache_key, get_redis_db
+
+
+logger = logging.getLogger(__name__)
+
+_cache_db = get_redis_db()
+
+
+def get_datamodel_key(endpoint, ca_uuid):
+    return f"smart_datamodel.{create_cache_key(endpoint)}.{ca_uuid}"
+
+
+def get_configurable_model_key(endpoint, cm_uuid):
+    return f"smart_configurable_model.{create_cache_key(endpoint)}.{cm_uuid}"
+
+
+def _load_datamodel(data):
+    datamodel = DataModel()
+    datamodel.import_from_dict(data)
+    return datamodel
+
+
+def _load_configurable_model(data):
+    configurable_model = ConfigurableDataModel()
+    configurable_model.import_from_dict(data)
+    return configurable_model
+
+
+class _CachedModel:
+    __slots__ = ("model", "fetched_at")
+
+    def __init__(self, model, fetched_at):
+        self.model = model
+        self.fetched_at = fetched_at
+
+    @property
+    def is_stale(self):
+        return time.time() - self.fetched_at > settings.SMART_DATAMODEL_REFRESH_SECONDS
+
+
+class SmartDataModelCache:
+    def __init__(self, *, maxsize, ttl):
+        self._models = LocalCache(name="smart_datamodels", maxsize=maxsize, ttl=ttl)
+        # How to download each model again, used by the periodic refresher
+        self._sources = OrderedDict()  # cache key -> (fetch, load)
+        self._maxsize = maxsize
+        self._ttl = ttl
+        self._background_tasks = set()
+        self._refresher = None
+
+    async def get_data_model(self, client, *, endpoint, ca_uuid):
+        return await self._get(
+            get_datamodel_key(endpoint, ca_uuid),
+            # smartconnect-client 1.7.0 (the pinned version) has no `force` option
+            fetch=partial(client.get_data_model, ca_uuid=ca_uuid),
+            load=_load_datamodel,
+        )
+
+    async def get_configurable_model(self, client, *, endpoint, cm_uuid):
+        return await self._get(
+            get_configurable_model_key(endpoint, cm_uuid),
+            fetch=partial(client.get_configurable_data_model, cm_uuid=cm_uuid),
+            load=_load_configurable_model,
+        )
+
+    async def _get(self, cache_key, *, fetch, load):
+        self._remember_source(cache_key, fetch, load)
+        cached = self._models.get(cache_key)
+        if cached is None:
+            # Concurrent lookups (e.g. a warm-up and the first event) share the same load
+            cached = await single_flight(
+                cache_key, partial(self._load, cache_key, fetch, load)
+            )
+        if cached.is_stale:
+            self._refresh_in_background(cache_key, fetch, load)
+        return cached.model
+
+    def _remember_source(self, cache_key, fetch, load):
+        self._sources[cache_key] = (fetch, load)
+        self._sources.move_to_end(cache_key)
+        while len(self._sources) > self._maxsize:
+            self._sources.popitem(last=False)
+
+    async def _load(self, cache_key, fetch, load):
+        cached = await self._read(cache_key, load)
+        if cached is None:
+            # Nothing to fall back to, so wait for the download
+            cached = await self._download(cache_key, fetch)
+        self._models.set(cache_key, cached)
+        return cached
+
+    async def _read(self, cache_key, load):
+        try:
+            if not (data := await _cache_db.get(cache_key)):
+                return None
+            cached = codec.loads(data)
+            return _CachedModel(load(cached["model"]), cached["fetched_at"])
+        except Exception as e:
+            logger.warning(
+                f"Error reading SMART model '{cache_key}' from cache: {type(e).__name__}: {e}"
+            )
+            return None
+
+    async def _download(self, cache_key, fetch):
+        cached = _CachedModel(await fetch(), time.time())
+        try:
+            await _cache_db.setex(
+                cache_key,
+                self._ttl,
+                codec.dumps(
+                    {
+                        "model": cached.model.export_as_dict(),
+                        "fetched_at": cached.fetched_at,
+                    }
+                ),
+            )
+        except Exception as e:
+            logger.warning(
+                f"Error writing SMART model '{cache_key}' to cache: {type(e).__name__}: {e}"
+            )
+        self._models.set(cache_key, cached)
+        return cached
+
+    async def _refresh(self, cache_key, fetch, load):
+        # Another instance may have refreshed it already
+        cached = await self._read(cache_key, load)
+        if cached is None or cached.is_stale:
+            cached = await self._download(cache_key, fetch)
+        self._models.set(cache_key, cached)
+        return cached
+
+    async def _refresh_safe(self, cache_key, fetch, load):
+        try:
+            await single_flight(
+                f"refresh.{cache_key}", partial(self._refresh, cache_key, fetch, load)
+            )
+        except Exception as e:
+            logger.warning(
+                f"Error refreshing SMART model '{cache_key}', the previous copy is used meanwhile: {type(e).__name__}: {e}"
+            )
+
+    def _refresh_in_background(self, cache_key, fetch, load):
+        task = asyncio.ensure_future(self._refresh_safe(cache_key, fetch, load))
+        self._background_tasks.add(task)
+        task.add_done_callback(self._background_tasks.discard)
+
+    async def refresh_stale_models(self):
+        stale = [
+            (cache_key, fetch, load)
+            for cache_key, (fetch, load) in list(self._sources.items())
+            if (cached := self._models.get(cache_key)) is None or cached.is_stale
+        ]
+        await asyncio.gather(*[self._refresh_safe(*source) for source in stale])
+        return len(stale)
+
+    async def _run_refresher(self):
+        while True:
+            await asyncio.sleep(settings.SMART_DATAMODEL_REFRESH_INTERVAL_SECONDS)
+            try:
+                if refreshed := await self.refresh_stale_models():
+                    logger.info(f"{refreshed} SMART models refreshed.")
+            except Exception as e:
+                logger.warning(
+                    f"Error refreshing SMART models: {type(e).__name__}: {e}"
+                )
+
+    async def start(self):
+        if self._refresher is None:
+            self._refresher = asyncio.ensure_future(self._run_refresher())
+
+    async def close(self):
+        if self._refresher:
+            self._refresher.cancel()
+            self._refresher = None
+        for task in list(self._background_tasks):
+            task.cancel()
+
+    def clear(self):
+        self._models.clear()
+        self._sources.clear()
+
+
+_NOT_FOUND = object()
+
+
+class SmartModelIndex:
+    """
+    Hash indexes over the data model of a CA, its configurable models and the transformation rules.
+
+    The SMART models only offer linear lookups, which add up to most of the CPU time
+    of an event with many details. An index is built once for the models it was built
+    from, and `is_built_from()` tells when they were refreshed and it must be rebuilt.
+    Where a path or key appears more than once, the first match wins as in a linear scan.
+    """
+
+    def __init__(self, *, ca_datamodel, configurable_models, transformation_rules):
+        self._ca_datamodel = ca_datamodel
+        self._configurable_models = list(configurable_models or [])
+        ca_data = ca_datamodel.export_as_dict()
+        self._categories = self._index(ca_data["categories"], "path")
+        self._attributes = self._index(ca_data["attributes"], "key")
+        self._cm_categories = {}
+        self._cm_attributes = {}
+        for cm in self._configurable_models:
+            cm_data = cm.export_as_dict()
+            for path, category in self._index(
+                cm_data["categories"], "hkeyPath"
+            ).items():
+                self._cm_categories.setdefault(path, category)
+            for key, attribute in self._index(cm_data["attributes"], "key").items():
+                self._cm_attributes.setdefault(key, attribute)
+        self._category_rules = {}
+        for category_rule in transformation_rules.category_map:
+            self._category_rules.setdefault(
+                category_rule.event_type, category_rule.category_path
+            )
+        self._attribute_rules = {}
+        self._option_rules = {}
+        for attribute_rule in transformation_rules.attribute_map:
+            if attribute_rule.from_key in self._attribute_rules:
+                continue
+            self._attribute_rules[attribute_rule.from_key] = attribute_rule
+            options = {}
+            for option_rule in attribute_rule.options_map or []:
+                options.setdefault(option_rule.from_key, option_rule.to_key)
+            self._option_rules[attribute_rule.from_key] = options
+        # Resolved event type -> category path
+        self.category_paths = {}
+
+    @staticmethod
+    def _index(items, field):
+        index = {}
+        for item in items or []:
+            index.setdefault(item.get(field), item)
+        return index
+
+    def is_built_from(self, ca_datamodel, configurable_models):
+        configurable_models = configurable_models or []
+        return (
+            self._ca_datamodel is ca_datamodel
+            and len(self._configurable_models) == len(configurable_models)
+            and all(
+                a is b for a, b in zip(self._configurable_models, configurable_models)
+            )
+        )
+
+    def get_category(self, path):
+        return self._categories.get(path)
+
+    def get_configurable_category(self, path):
+        return self._cm_categories.get(path)
+
+    def get_attribute(self, key):
+        """An attribute of the configurable models, or else of the CA data model."""
+        return self._cm_attributes.get(key) or self._attributes.get(key)
+
+    def get_category_rule(self, event_type):
+        return self._category_rules.get(event_type)
+
+    def resolve_attribute(self, key, value):
+        """Resolve an event detail into a SMART attribute key and value."""
+        # Favor a match in the models
+        if self.get_attribute(key):
+            return key, value
+
+        # Find in transformation rules.
+        if not (attribute_rule := self._attribute_rules.get(key)):
+            logger.warning("No attribute map found for key: %s", key)
+            return None, None
+
+        if attribute_rule.options_map:
+            try:
+                option = self._option_rules[key].get(value, _NOT_FOUND)
+            except TypeError:  # Unhashable values can't match an option key
+                option = _NOT_FOUND
+            if option is not _NOT_FOUND:
+                return attribute_rule.to_key, option
+            if attribute_rule.default_option:
+                return attribute_rule.to_key, attribute_rule.default_option
+
+        return attribute_rule.to_key, value
+
+    def get_category_path(self, event_type, resolve):
+        """Memoised `resolve(event_type)`."""
+        if (
+            category_path := self.category_paths.get(event_type, _NOT_FOUND)
+        ) is _NOT_FOUND:
+            category_path = resolve(event_type)
+            if len(self.category_paths) < settings.SMART_CATEGORY_PATHS_MAX_SIZE:
+                self.category_paths[event_type] = category_path
+        return category_path
+
+
+smart_datamodels = SmartDataModelCache(
+    maxsize=settings.SMART_DATAMODEL_CACHE_MAX_SIZE,
+    ttl=settings.SMART_DATAMODEL_CACHE_TTL,
+)
@@ -0,0 +1,106 @@
+"""
+Timezone resolution for locations.
+
+Loading the timezone polygons is expensive, so a single TimezoneFinder is shared
+by the whole process and created on first use. Results are cached on a grid of
+TIMEZONE_CACHE_PRECISION decimal degrees (2 decimals is about 1 km), as events
+and track points of the same area are resolved over and over.
+"""
+import logging
+from collections import OrderedDict
+
+import pytz
+import timezonefinder
+
+from app.core import settings
+
+
+logger = logging.getLogger(__name__)
+
+
+class TimezoneResolver:
+    def __init__(self, *, maxsize, precision):
+        self.maxsize = maxsize
+        self.precision = precision
+        self.hits = 0
+        self.misses = 0
+        self._finder = None
+        self._timezones = OrderedDict()  # (lon, lat) cell -> timezone name
+
+    @property
+    def finder(self):
+        if self._finder is None:
+            self._finder = timezonefinder.TimezoneFinder(
+                in_memory=settings.TIMEZONE_FINDER_IN_MEMORY
+            )
+        return self._finder
+
+    def _get_cell(self, longitude, latitude):
+        return round(float(longitude), self.precision), round(
+            float(latitude), self.precision
+        )
+
+    def _get_timezone_name(self, cell):
+        try:
+            timezone_name = self._timezones[cell]
+        except KeyError:
+            self.misses += 1
+            longitude, latitude = cell
+            timezone_name = self.finder.timezone_at(lng=longitude, lat=latitude)
+            self._timezones[cell] = timezone_name
+            if len(self._timezones) > self.maxsize:
+                self._timezones.popitem(last=False)
+        else:
+            self.hits += 1
+            self._timezones.move_to_end(cell)
+        return timezone_name
+
+    def timezone_at(self, *, longitude, latitude, default=None):
+        """The timezone at a location, or `default` if it can't be determined."""
+        try:
+            timezone_name = self._get_timezone_name(self._get_cell(longitude, latitude))
+            return pytz.timezone(timezone_name) if timezone_name else default
+        except Exception as e:
+            logger.debug(
+                f"Unable to resolve timezone at ({longitude}, {latitude}): {type(e).__name__}: {e}"
+            )
+            return default
+
+    def timezones_at(self, locations, default=None):
+        """
+        Resolve the timezones of many (longitude, latitude) locations at once.
+
+        Locations in the same cell are looked up once. Returns a list in the same order.
+        """
+        by_cell = {}
+        timezones = []
+        for longitude, latitude in locations:
+            try:
+                cell = self._get_cell(longitude, latitude)
+            except (TypeError, ValueError):
+                timezones.append(default)
+                continue
+            if cell not in by_cell:
+                by_cell[cell] = self.timezone_at(
+                    longitude=longitude, latitude=latitude, default=default
+                )
+            timezones.append(by_cell[cell])
+        return timezones
+
+    def clear(self):
+        self._timezones.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self):
+        return {
+            "size": len(self._timezones),
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+timezone_resolver = TimezoneResolver(
+    maxsize=settings.TIMEZONE_CACHE_MAX_SIZE,
+    precision=settings.TIMEZONE_CACHE_PRECISION,
+)
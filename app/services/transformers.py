@@ -1,20 +1,24 @@
+import asyncio
 import json
 import base64
 import logging
 import os
+import time
 
 import backoff
 import pytz
 import pathlib
 import uuid
 from abc import ABC, abstractmethod
+from collections import OrderedDict
+from functools import partial
 from urllib.parse import urlparse
 from typing import Any, List, Union, Optional, Tuple
 from datetime import datetime
 from pydantic.types import UUID
-from app.core import gundi, utils
+from app.core import codec, gundi, metrics, tracing, utils
+from app.core.cache import field_mapping_rules_cache, single_flight
 from app import settings
-import timezonefinder
 from packaging import version
 from gundi_core import schemas
 from gundi_core.schemas import ERPatrol, ERPatrolSegment
@@ -24,6 +28,7 @@ from gundi_core.schemas.v2 import (
     SMARTAuthActionConfig,
     EREventUpdate,
 )
+from opentelemetry.trace import SpanKind
 from pydantic import BaseModel
 from smartconnect import AsyncSmartClient
 from gundi_core.schemas.v2.smart import (
@@ -41,7 +46,9 @@ from gundi_core.schemas.v2.smart import (
 from smartconnect.utils import guess_ca_timezone
 from app.core.gundi import GUNDI_V1, GUNDI_V2
 from app.core.local_logging import ExtraKeys
-from app.core.utils import is_uuid
+from app.core.utils import gather_with_concurrency, is_uuid
+from app.services.smart_datamodels import SmartModelIndex, smart_datamodels
+from app.services.timezones import timezone_resolver
 from app.core.errors import (
     ReferenceDataError,
     ObservationUUIDValueException,
@@ -223,10 +230,9 @@ class SMARTTransformer:
             password=config.password,
             version=self._version,
         )
-        self._ca_datamodel = None
-        self._configurable_models = None
         self.ca = None
         self.cm_uuids = config.additional.get("configurable_models_enabled", [])
+        self._model_index = None
 
         # Let the timezone fall-back to configuration in the OutboundIntegration.
         try:
@@ -260,39 +266,55 @@ class SMARTTransformer:
         return self.ca
 
     async def get_configurable_models(self):
-        if not self._configurable_models:
-            try:
-                self._configurable_models = list(
-                    [
-                        await self.smartconnect_client.get_configurable_data_model(
-                            cm_uuid=cm_uuid
-                        )
-                        for cm_uuid in self.cm_uuids
-                    ]
-                )
-            except Exception as e:
-                self._ca_config_datamodel = []
-                logger.exception(
-                    f"Error getting config data model for SMART CA: {self.ca_uuid}",
-                    extra={ExtraKeys.Error: e},
-                )
-        return self._configurable_models
+        try:
+            return await gather_with_concurrency(
+                [
+                    smart_datamodels.get_configurable_model(
+                        self.smartconnect_client,
+                        endpoint=self._config.endpoint,
+                        cm_uuid=cm_uuid,
+                    )
+                    for cm_uuid in self.cm_uuids
+                ],
+                limit=settings.SMART_WARM_UP_CONCURRENCY,
+            )
+        except Exception as e:
+            logger.exception(
+                f"Error getting config data model for SMART CA: {self.ca_uuid}",
+                extra={ExtraKeys.Error: e},
+            )
+            return []
 
     async def get_ca_datamodel(self):
-        if not self._ca_datamodel:
-            try:
-                self._ca_datamodel = await self.smartconnect_client.get_data_model(
-                    ca_uuid=self.ca_uuid
-                )
-            except Exception as e:
-                logger.exception(
-                    f"Error getting data model for SMART CA: {self.ca_uuid}",
-                    extra={ExtraKeys.Error: e},
-                )
-                raise ReferenceDataError(
-                    f"Error getting data model for SMART CA: {self.ca_uuid}"
-                )
-        return self._ca_datamodel
+        try:
+            return await smart_datamodels.get_data_model(
+                self.smartconnect_client,
+                endpoint=self._config.endpoint,
+                ca_uuid=self.ca_uuid,
+            )
+        except Exception as e:
+            logger.exception(
+                f"Error getting data model for SMART CA: {self.ca_uuid}",
+                extra={ExtraKeys.Error: e},
+            )
+            raise ReferenceDataError(
+                f"Error getting data model for SMART CA: {self.ca_uuid}"
+            )
+
+    async def get_model_index(self):
+        ca_datamodel = await self.get_ca_datamodel()
+        configurable_models = await self.get_configurable_models()
+        # Rebuilt when the models are refreshed
+        if not (
+            self._model_index
+            and self._model_index.is_built_from(ca_datamodel, configurable_models)
+        ):
+            self._model_index = SmartModelIndex(
+                ca_datamodel=ca_datamodel,
+                configurable_models=configurable_models,
+                transformation_rules=self._transformation_rules,
+            )
+        return self._model_index
 
     def guess_location_timezone(
         self, *, longitude: Union[float, int] = None, latitude: Union[float, int] = None
@@ -301,13 +323,9 @@ class SMARTTransformer:
         Guess the timezone at the given location. Gracefully fall back on the timezone that's configured for this
         OutboundConfiguration (which will in turn fall back to Utc).
         """
-        try:
-            predicted_timezone = timezonefinder.TimezoneFinder().timezone_at(
-                lng=longitude, lat=latitude
-            )
-            return pytz.timezone(predicted_timezone)
-        except:
-            return self._default_timezone
+        return timezone_resolver.timezone_at(
+            longitude=longitude, latitude=latitude, default=self._default_timezone
+        )
 
     async def resolve_category_path_for_event(
         self, *, event: [schemas.GeoEvent, schemas.EREvent] = None
@@ -324,76 +342,39 @@ class SMARTTransformer:
 
         # Convert ER event type to CA path syntax
         pruned_event_type = pruned_event_type.replace("_", ".")
-        ca_datamodel = await self.get_ca_datamodel()
+        model_index = await self.get_model_index()
+        return model_index.get_category_path(
+            pruned_event_type, partial(self._find_category_path, model_index)
+        )
+
+    def _find_category_path(self, model_index, event_type):
         # Look in the CA DataModel
-        if matched_category := ca_datamodel.get_category(path=pruned_event_type):
+        if matched_category := model_index.get_category(event_type):
             return matched_category["path"]
 
         # Look in configurable models
-        configurable_models = await self.get_configurable_models()
-        for cm in configurable_models:
-            # favor config datamodel match if present
-            # convert ER event type to CA path syntax
-            if matched_category := cm.get_category(path=pruned_event_type):
-                return matched_category["hkeyPath"]
-
-        # Try a direct data model match
-        if matched_category := ca_datamodel.get_category(path=pruned_event_type):
-            return matched_category["path"]
+        if matched_category := model_index.get_configurable_category(event_type):
+            return matched_category["hkeyPath"]
 
         # Last option is a match in translation rules.
-        for t in self._transformation_rules.category_map:
-            if t.event_type == pruned_event_type:
-                return t.category_path
+        return model_index.get_category_rule(event_type)
 
     async def _resolve_attribute(
         self, key, value
     ) -> Tuple[Union[str, None], Union[str, None]]:
-        attr = None
-
-        # Favor a match in configurable model.
-        configurable_models = await self.get_configurable_models()
-        for cm in configurable_models:
-            attr = cm.get_attribute(key=key)
-            if attr:
-                break
-        else:
-            ca_datamodel = await self.get_ca_datamodel()
-            attr = ca_datamodel.get_attribute(key=key)
-
-        # Favor a match in the CA DataModel attributes dictionary.
-        if attr:
-            return key, value
-
-        return_key = return_value = None
-        # Find in transformation rules.
-        for amap in self._transformation_rules.attribute_map:
-            if amap.from_key == key:
-                return_key = amap.to_key
-                break
-        else:
-            logger.warning("No attribute map found for key: %s", key)
-            return None, None
-
-        if amap.options_map:
-            for options_val in amap.options_map:
-                if options_val.from_key == value:
-                    return_value = options_val.to_key
-                    return return_key, return_value
-            if amap.default_option:
-                return return_key, amap.default_option
-
-        return return_key, value
+        model_index = await self.get_model_index()
+        return model_index.resolve_attribute(key, value)
 
     async def _resolve_attributes_for_event(
         self, *, event: [schemas.GeoEvent, schemas.EREvent] = None
     ) -> dict:
         attributes = {}
+        model_index = await self.get_model_index()
         for k, v in event.event_details.items():
             # some event details are lists like updates
             v = v[0] if isinstance(v, list) and len(v) > 0 else v
 
-            k, v = await self._resolve_attribute(k, v)
+            k, v = model_index.resolve_attribute(k, v)
 
             if k:
                 attributes[k] = v
@@ -404,28 +385,29 @@ class SMARTTransformer:
         *,
         event: Union[schemas.EREvent, schemas.GeoEvent] = None,
         smart_feature_type=None,
+        location_timezone=None,
     ) -> SMARTRequest:
         """
         Common code used to construct a SMART request
 
+        The timezone of the event location is guessed unless `location_timezone` is given.
         """
 
         is_er_event = isinstance(event, schemas.EREvent)
 
         # Sanitize coordinates
         coordinates = [0, 0]
-        location_timezone = self._default_timezone
+        guessed_timezone = self._default_timezone
         if event.location:
             if is_er_event:
                 coordinates = [event.location.longitude, event.location.latitude]
-                location_timezone = self.guess_location_timezone(
-                    longitude=event.location.longitude, latitude=event.location.latitude
-                )
             else:
                 coordinates = [event.location.x, event.location.y]
-                location_timezone = self.guess_location_timezone(
-                    longitude=event.location.x, latitude=event.location.y
+            if location_timezone is None:
+                guessed_timezone = self.guess_location_timezone(
+                    longitude=coordinates[0], latitude=coordinates[1]
                 )
+        location_timezone = location_timezone or guessed_timezone
 
         # Apply Transformation Rules
 
@@ -541,13 +523,16 @@ class SMARTTransformer:
         *,
         event: Union[schemas.EREvent, schemas.GeoEvent] = None,
         smart_feature_type=None,
+        location_timezone=None,
     ) -> SMARTRequest:
         """
         Handle both geo events and er events for version > 7.5 of smart connect
         """
 
         incident_request = await self.event_to_smart_request(
-            event=event, smart_feature_type=smart_feature_type
+            event=event,
+            smart_feature_type=smart_feature_type,
+            location_timezone=location_timezone,
         )
 
         return incident_request
@@ -679,12 +664,24 @@ class SmartERPatrolTransformer(SMARTTransformer, Transformer):
     ):
         incident_requests = []
         incident_request: SMARTRequest
-        for event in patrol_leg.event_details:
+        events = patrol_leg.event_details or []
+        # Resolve the timezones of all the events at once
+        location_timezones = timezone_resolver.timezones_at(
+            (
+                (event.location.longitude, event.location.latitude)
+                if event.location
+                else (None, None)
+                for event in events
+            ),
+            default=self._default_timezone,
+        )
+        for event, location_timezone in zip(events, location_timezones):
             incident_request = await self.event_to_patrol_waypoint(
                 patrol_id=patrol_id,
                 patrol_leg_id=patrol_leg.id,
                 event=event,
                 smart_feature_type="waypoint/new",
+                location_timezone=location_timezone,
             )
             incident_requests.append(incident_request)
 
@@ -719,10 +716,18 @@ class SmartERPatrolTransformer(SMARTTransformer, Transformer):
         return track_point_requests
 
     async def event_to_patrol_waypoint(
-        self, *, patrol_id, patrol_leg_id, event, smart_feature_type
+        self,
+        *,
+        patrol_id,
+        patrol_leg_id,
+        event,
+        smart_feature_type,
+        location_timezone=None,
     ):
         incident_request = await self.event_to_incident(
-            event=event, smart_feature_type=smart_feature_type
+            event=event,
+            smart_feature_type=smart_feature_type,
+            location_timezone=location_timezone,
         )
         # Associate the incident to this patrol leg
         incident_request.properties.smartDataType = "patrol"
@@ -905,6 +910,12 @@ def find_config_for_action(configurations, action_value):
 
 
 class SMARTTransformerV2(Transformer, ABC):
+    """
+    Instances are pooled and shared by concurrent messages (see `TransformerPool`),
+    so per-message values like the CA of an event are passed as arguments instead
+    of being stored in the instance. The SMART client and the data models are kept warm.
+    """
+
     def __init__(self, *, config=None, **kwargs):
         super().__init__(config=config, **kwargs)
         self.logger = logging.getLogger(self.__class__.__name__)
@@ -927,11 +938,9 @@ class SMARTTransformerV2(Transformer, ABC):
                 f"Push Events settings for integration {str(config.id)} are missing. Please fix the integration setup in the portal."
             )
         self.push_config = SMARTPushEventActionConfig.parse_obj(push_events_config.data)
-        self._ca_datamodel = None
-        self._ca_config_datamodel = None
-        self._configurable_models = None
         self.cm_uuids = self.push_config.configurable_models_enabled or []
-        self.ca = None
+        self._model_indexes = {}  # ca_uuid -> SmartModelIndex
+        self._cas = {}  # ca_uuid -> CA metadata
         # Handle 0:N SMART CA Mapping. Look for CA in kwargs, then look in config
         self.ca_uuid = kwargs.get(
             "ca_uuid",
@@ -959,12 +968,12 @@ class SMARTTransformerV2(Transformer, ABC):
         )
         path = url_parse.path or "/server"
         path = path.replace("//", "/")
-        api_url = (
+        self.api_url = (
             getattr(auth_config, "endpoint", None)
             or f"{url_parse.scheme}://{domain}{path}"
         )
         self.smartconnect_client = AsyncSmartClient(
-            api=api_url,
+            api=self.api_url,
             username=self.auth_config.login,
             password=self.auth_config.password,
             version=self._version,
@@ -985,53 +994,117 @@ class SMARTTransformerV2(Transformer, ABC):
             transformation_rules_dict
         )
 
-    async def get_ca(self, config):
-        if not self.ca:
+    async def get_ca(self, config, ca_uuid=None):
+        ca_uuid = ca_uuid or self.ca_uuid
+        if not self._cas.get(ca_uuid):
             try:
-                self.ca = await self.smartconnect_client.get_conservation_area(
-                    ca_uuid=self.ca_uuid
+                self._cas[ca_uuid] = await single_flight(
+                    f"smart.{id(self)}.ca.{ca_uuid}",
+                    partial(
+                        self.smartconnect_client.get_conservation_area, ca_uuid=ca_uuid
+                    ),
                 )
             except Exception as ex:
                 self.logger.warning(
-                    f"Failed to get CA Metadata for endpoint: {self.config.base_url}, username: {config.login}, CA-UUID: {self.ca_uuid}. Exception: {ex}."
+                    f"Failed to get CA Metadata for endpoint: {self.config.base_url}, username: {config.login}, CA-UUID: {ca_uuid}. Exception: {ex}."
                 )
-                self.ca = None
-        return self.ca
+                return None
+        return self._cas[ca_uuid]
 
     async def get_configurable_models(self):
-        if not self._configurable_models:
-            try:
-                self._configurable_models = list(
-                    [
-                        await self.smartconnect_client.get_configurable_data_model(
-                            cm_uuid=cm_uuid
-                        )
-                        for cm_uuid in self.cm_uuids
-                    ]
-                )
-            except Exception as e:
-                self._ca_config_datamodel = []
-                logger.exception(
-                    f"Error getting config data model for SMART CA: {self.ca_uuid}",
-                    extra={ExtraKeys.Error: e},
-                )
-        return self._configurable_models
+        try:
+            return await gather_with_concurrency(
+                [
+                    smart_datamodels.get_configurable_model(
+                        self.smartconnect_client, endpoint=self.api_url, cm_uuid=cm_uuid
+                    )
+                    for cm_uuid in self.cm_uuids
+                ],
+                limit=settings.SMART_WARM_UP_CONCURRENCY,
+            )
+        except Exception as e:
+            logger.exception(
+                f"Error getting config data model for SMART CA: {self.ca_uuid}",
+                extra={ExtraKeys.Error: e},
+            )
+            return []
 
-    async def get_ca_datamodel(self):
-        if not self._ca_datamodel:
-            try:
-                self._ca_datamodel = await self.smartconnect_client.get_data_model(
-                    ca_uuid=self.ca_uuid
-                )
-            except Exception as e:
-                logger.exception(
-                    f"Error getting data model for SMART CA: {self.ca_uuid}",
-                    extra={ExtraKeys.Error: e},
-                )
-                raise ReferenceDataError(
-                    f"Error getting data model for SMART CA: {self.ca_uuid}"
-                )
-        return self._ca_datamodel
+    async def get_ca_datamodel(self, ca_uuid=None):
+        ca_uuid = ca_uuid or self.ca_uuid
+        try:
+            # Shared across instances, and across concurrent messages for the same CA
+            return await smart_datamodels.get_data_model(
+                self.smartconnect_client, endpoint=self.api_url, ca_uuid=ca_uuid
+            )
+        except Exception as e:
+            logger.exception(
+                f"Error getting data model for SMART CA: {ca_uuid}",
+                extra={ExtraKeys.Error: e},
+            )
+            raise ReferenceDataError(
+                f"Error getting data model for SMART CA: {ca_uuid}"
+            )
+
+    async def get_model_index(self, ca_uuid=None):
+        ca_uuid = ca_uuid or self.ca_uuid
+        ca_datamodel = await self.get_ca_datamodel(ca_uuid=ca_uuid)
+        configurable_models = await self.get_configurable_models()
+        model_index = self._model_indexes.get(ca_uuid)
+        # Rebuilt when the models are refreshed
+        if not (
+            model_index and model_index.is_built_from(ca_datamodel, configurable_models)
+        ):
+            model_index = SmartModelIndex(
+                ca_datamodel=ca_datamodel,
+                configurable_models=configurable_models,
+                transformation_rules=self._transformation_rules,
+            )
+            self._model_indexes[ca_uuid] = model_index
+        return model_index
+
+    def get_ca_uuids(self):
+        """All the CAs mapped in the integration."""
+        ca_uuids = [self.ca_uuid]
+        for ca_uuid in self.push_config.ca_uuids or []:
+            if str(ca_uuid) not in ca_uuids:
+                ca_uuids.append(str(ca_uuid))
+        return ca_uuids
+
+    async def _warm_up_ca_datamodel(self, ca_uuid):
+        try:
+            await self.get_ca_datamodel(ca_uuid=ca_uuid)
+        except ReferenceDataError:
+            pass  # Already logged, the first event will try again
+
+    async def warm_up(self):
+        """
+        Prefetch the CA metadata, the CA data models and the configurable models concurrently,
+        so the first event for a CA doesn't wait for them one after another.
+        """
+        with tracing.tracer.start_as_current_span(
+            "routing_service.smart_warm_up", kind=SpanKind.CLIENT
+        ) as current_span:
+            ca_uuids = self.get_ca_uuids()
+            current_span.set_attribute("destination_id", str(self.config.id))
+            current_span.set_attribute("ca_uuids_qty", len(ca_uuids))
+            current_span.set_attribute("configurable_models_qty", len(self.cm_uuids))
+            started_at = time.monotonic()
+            await gather_with_concurrency(
+                [
+                    *[
+                        self.get_ca(self.auth_config, ca_uuid=ca_uuid)
+                        for ca_uuid in ca_uuids
+                    ],
+                    *[self._warm_up_ca_datamodel(ca_uuid) for ca_uuid in ca_uuids],
+                    self.get_configurable_models(),
+                ],
+                limit=settings.SMART_WARM_UP_CONCURRENCY,
+            )
+            latency_ms = (time.monotonic() - started_at) * 1000
+            current_span.set_attribute("warm_up_latency_ms", latency_ms)
+            logger.debug(
+                f"SMART destination {self.config.id} warmed up in {latency_ms:.0f} ms."
+            )
 
     def guess_location_timezone(
         self, *, longitude: Union[float, int] = None, latitude: Union[float, int] = None
@@ -1040,90 +1113,55 @@ class SMARTTransformerV2(Transformer, ABC):
         Guess the timezone at the given location. Gracefully fall back on the timezone that's configured for this
         OutboundConfiguration (which will in turn fall back to Utc).
         """
-        try:
-            predicted_timezone = timezonefinder.TimezoneFinder().timezone_at(
-                lng=longitude, lat=latitude
-            )
-            return pytz.timezone(predicted_timezone)
-        except:
-            return self._default_timezone
+        return timezone_resolver.timezone_at(
+            longitude=longitude, latitude=latitude, default=self._default_timezone
+        )
 
-    async def resolve_category_path_for_event(self, *, event_type: str = None) -> str:
+    async def resolve_category_path_for_event(
+        self, *, event_type: str = None, ca_uuid: str = None
+    ) -> str:
         """
         Favor finding a match in the Config CA Datamodel, then CA Datamodel.
         """
+        model_index = await self.get_model_index(ca_uuid=ca_uuid)
+        return model_index.get_category_path(
+            event_type, partial(self._find_category_path, model_index)
+        )
+
+    def _find_category_path(self, model_index, event_type):
         search_for = event_type.replace("_", ".")
-        configurable_models = await self.get_configurable_models()
-        for cm in configurable_models:
-            # favor config datamodel match if present
-            # convert ER event type to CA path syntax
-            if matched_category := cm.get_category(path=search_for):
-                return matched_category["hkeyPath"]
+        # favor config datamodel match if present
+        # convert ER event type to CA path syntax
+        if matched_category := model_index.get_configurable_category(search_for):
+            return matched_category["hkeyPath"]
 
         # direct data model match
-        ca_datamodel = await self.get_ca_datamodel()
-        if matched_category := ca_datamodel.get_category(path=event_type):
+        if matched_category := model_index.get_category(event_type):
             return matched_category["path"]
 
         # convert event type to CA path syntax
-        if matched_category := ca_datamodel.get_category(
-            path=str.replace(event_type, "_", ".")
-        ):
+        if matched_category := model_index.get_category(search_for):
             return matched_category["path"]
 
         # Last option is a match in translation rules.
-        for t in self._transformation_rules.category_map:
-            if t.event_type == event_type:
-                return t.category_path
+        return model_index.get_category_rule(event_type)
 
     async def _resolve_attribute(
-        self, key, value
+        self, key, value, ca_uuid: str = None
     ) -> Tuple[Union[str, None], Union[str, None]]:
-        attr = None
-
-        # Favor a match in configurable model.
-        configurable_models = await self.get_configurable_models()
-        for cm in configurable_models:
-            attr = cm.get_attribute(key=key)
-            if attr:
-                break
-        else:
-            ca_datamodel = await self.get_ca_datamodel()
-            attr = ca_datamodel.get_attribute(key=key)
-
-        # Favor a match in the CA DataModel attributes dictionary.
-        if attr:
-            return key, value
-
-        return_key = return_value = None
-        # Find in transformation rules.
-        for amap in self._transformation_rules.attribute_map:
-            if amap.from_key == key:
-                return_key = amap.to_key
-                break
-        else:
-            logger.warning("No attribute map found for key: %s", key)
-            return None, None
-
-        if amap.options_map:
-            for options_val in amap.options_map:
-                if options_val.from_key == value:
-                    return_value = options_val.to_key
-                    return return_key, return_value
-            if amap.default_option:
-                return return_key, amap.default_option
-
-        return return_key, value
+        model_index = await self.get_model_index(ca_uuid=ca_uuid)
+        return model_index.resolve_attribute(key, value)
 
     async def _resolve_attributes_for_event_details(
-        self, *, event_details: dict = None
+        self, *, event_details: dict = None, ca_uuid: str = None
     ) -> dict:
         attributes = {}
+        model_index = await self.get_model_index(ca_uuid=ca_uuid)
         for k, v in event_details.items():
             # some event details are lists like updates
             v = v[0] if isinstance(v, list) and len(v) > 0 else v
 
-            k, v = await self._resolve_attribute(k, v)
+            k, v = model_index.resolve_attribute(k, v)
 
             if k:
                 attributes[k] = v
@@ -1134,6 +1172,7 @@ class SMARTTransformerV2(Transformer, ABC):
         *,
         event: schemas.v2.Event = None,
         smart_feature_type=None,
+        ca_uuid: str = None,
     ) -> SMARTRequest:
         """
         Common code used to construct a SMART request
@@ -1150,7 +1189,7 @@ class SMARTTransformerV2(Transformer, ABC):
 
         # Apply SMART Transformation Rules
         category_path = await self.resolve_category_path_for_event(
-            event_type=event.event_type
+            event_type=event.event_type, ca_uuid=ca_uuid
         )
         if not category_path:
             logger.error(f"No category found for event_type: {event.event_type}")
@@ -1159,7 +1198,7 @@ class SMARTTransformerV2(Transformer, ABC):
             )
 
         attributes = await self._resolve_attributes_for_event_details(
-            event_details=event.event_details
+            event_details=event.event_details, ca_uuid=ca_uuid
         )
 
         present_localtime = datetime.now(tz=pytz.utc).astimezone(location_timezone)
@@ -1207,7 +1246,7 @@ class SMARTTransformerV2(Transformer, ABC):
         return smart_request
 
     async def event_to_observation(
-        self, *, event: schemas.v2.Event = None
+        self, *, event: schemas.v2.Event = None, ca_uuid: str = None
     ) -> SMARTRequest:
         """
         Handle events v2 for version > 7.5 of smart connect
@@ -1216,7 +1255,7 @@ class SMARTTransformerV2(Transformer, ABC):
         """
 
         observation_update_request = await self.event_to_smart_request(
-            event=event, smart_feature_type="waypoint/observation"
+            event=event, smart_feature_type="waypoint/observation", ca_uuid=ca_uuid
         )
 
         return observation_update_request
@@ -1226,13 +1265,14 @@ class SMARTTransformerV2(Transformer, ABC):
         *,
         event: schemas.v2.Event = None,
         smart_feature_type=None,
+        ca_uuid: str = None,
     ) -> SMARTRequest:
         """
         Handle events v2 for version > 7.5 of smart connect
         """
 
         incident_request = await self.event_to_smart_request(
-            event=event, smart_feature_type=smart_feature_type
+            event=event, smart_feature_type=smart_feature_type, ca_uuid=ca_uuid
         )
 
         return incident_request
@@ -1384,15 +1424,15 @@ class SmartEventTransformerV2(SMARTTransformerV2):
         if self._version and version.parse(self._version) < version.parse("7.5"):
             raise ValueError("Smart version < 7.5 is not supported")
         message_ca_uuid, pruned_event_type = get_ca_uuid_for_event(event=message)
-        if message_ca_uuid:
-            self.ca_uuid = str(message_ca_uuid)
+        # The CA in the event type takes precedence, without changing the shared instance
+        ca_uuid = str(message_ca_uuid) if message_ca_uuid else self.ca_uuid
         waypoint_requests = []
         incident = await self.event_to_incident(
-            event=message, smart_feature_type="waypoint/new"
+            event=message, smart_feature_type="waypoint/new", ca_uuid=ca_uuid
         )
         waypoint_requests.append(incident)
         smart_request = SMARTCompositeRequest(
-            waypoint_requests=waypoint_requests, ca_uuid=self.ca_uuid
+            waypoint_requests=waypoint_requests, ca_uuid=ca_uuid
         )
         return smart_request
 
@@ -1460,27 +1500,42 @@ class TransformationRule(ABC):
         ...
 
 
+def compile_field_accessor(source: str):
+    """Compile a `__`-separated source path (i.e. "event_details__species") into a getter."""
+    fields = tuple(source.lower().strip().split("__"))
+    if len(fields) == 1:
+        field = fields[0]
+        return lambda message: message.get(field) if message else message
+
+    def get_value(message):
+        value = message
+        for field in fields:
+            if not value:
+                break
+            value = value.get(field)
+        return value
+
+    return get_value
+
+
 class FieldMappingRule(TransformationRule):
     def __init__(self, target: str, default: str, map: dict = None, source: str = None):
         self.map = map
         self.source = source
         self.target = target
         self.default = default
+        # Parse the source path once instead of on every message
+        self._get_source_value = compile_field_accessor(source) if source else None
 
-    def _extract_value(self, message, source):
-        fields = source.lower().strip().split("__")
-        value = message
-        while fields and value:
-            field = fields.pop(0)
-            value = value.get(field)
-        return value
+    def _extract_value(self, message):
+        return self._get_source_value(message)
 
     def apply(self, message: dict, **kwargs):
         if not self.source:
             message[self.target] = self.default
             return
 
-        source_value = self._extract_value(message=message, source=self.source)
+        source_value = self._get_source_value(message)
         if not source_value:
             logger.warning(
                 f"Field Mappings: Couldn't find a valid value for '{self.source}'. Value:'{source_value}'"
@@ -1818,7 +1873,10 @@ async def transform_observation(
         observation, ca_uuid = get_ca_uuid_for_er_patrol(patrol=observation)
         transformer = SmartERPatrolTransformer(config=config, ca_uuid=ca_uuid)
     if transformer:
-        return await transformer.transform(observation, **additional_info)
+        with metrics.timer(
+            metrics.transform_seconds, transformer=type(transformer).__name__
+        ):
+            return await transformer.transform(observation, **additional_info)
     else:
         logger.error(
             "No transformer found for stream type",
@@ -1934,20 +1992,12 @@ def build_transformed_message_attributes(
     observation, destination, gundi_version, provider_key=None
 ):
     if gundi_version == "v2":
-        return {
-            "gundi_version": gundi_version,
-            "provider_key": provider_key,
-            "gundi_id": str(observation.gundi_id),
-            "related_to": str(observation.related_to)
-            if observation.related_to
-            else None,
-            "stream_type": str(observation.observation_type),
-            "source_id": str(observation.source_id),
-            "external_source_id": str(observation.external_source_id),
-            "destination_id": str(destination.id),
-            "data_provider_id": str(get_data_provider_id(observation, gundi_version)),
-            "annotations": json.dumps(observation.annotations),
-        }
+        template = build_message_attributes_template(
+            destination=destination,
+            data_provider_id=get_data_provider_id(observation, gundi_version),
+            provider_key=provider_key,
+        )
+        return build_observation_attributes(observation=observation, template=template)
     else:  # default to v1
         return {
             "observation_type": str(observation.observation_type),
@@ -1957,20 +2007,47 @@ def build_transformed_message_attributes(
         }
 
 
+def build_message_attributes_template(
+    *, destination, data_provider_id, provider_key=None
+):
+    """Attributes of v2 messages that don't depend on the observation."""
+    return {
+        "gundi_version": GUNDI_V2,
+        "provider_key": provider_key,
+        "destination_id": str(destination.id),
+        "data_provider_id": str(data_provider_id),
+    }
+
+
+def build_observation_attributes(*, observation, template, provider_key=None):
+    attributes = {
+        **template,
+        "gundi_id": str(observation.gundi_id),
+        "related_to": str(observation.related_to) if observation.related_to else None,
+        "stream_type": str(observation.observation_type),
+        "source_id": str(observation.source_id),
+        "external_source_id": str(observation.external_source_id),
+        "annotations": codec.dumps_str(observation.annotations),
+    }
+    if provider_key:
+        attributes["provider_key"] = provider_key
+    return attributes
+
+
 def create_message(attributes, observation):
     message = {"attributes": attributes, "data": observation}
     return message
 
 
 def build_gcp_pubsub_message(*, payload):
-    binary_data = json.dumps(payload, default=str).encode("utf-8")
+    binary_data = codec.dumps(payload)
     return binary_data
 
 
 def extract_fields_from_message(message):
     if message:
         data = base64.b64decode(message.get("data", "").encode("utf-8"))
-        observation = json.loads(data)
+        observation = codec.loads(data)
         attributes = message.get("attributes")
         if not observation:
             logger.warning(f"No observation was obtained from {message}")
@@ -1991,15 +2068,8 @@ def get_key_for_transformed_observation(current_key: bytes, destination_id: UUID
         return new_key.encode("utf-8")
 
 
-async def transform_observation_v2(
-    observation, destination, provider, route_configuration=None
-):
-    # Look for a proper transformer for this stream type and destination type
-    stream_type = observation.observation_type
-    destination_type = destination.type.value
-
+def get_transformer_class(stream_type, destination_type):
     Transformer = transformers_map.get(stream_type, {}).get(destination_type)
-
     if not Transformer:
         logger.error(
             f"No transformer found for stream type '{stream_type}' & destination type '{destination_type}'",
@@ -2011,53 +2081,191 @@ async def transform_observation_v2(
         raise TransformerNotFound(
             f"No transformer found for {stream_type} dest: {destination_type}"
         )
+    return Transformer
 
-    # Check for extra configurations to apply
+
+def compile_field_mapping_rules(configuration) -> List[FieldMappingRule]:
+    """Compile the field mappings of a destination, either a single mapping or a list of them."""
     rules = []
-    if route_configuration and (
-        field_mappings := route_configuration.data.get("field_mappings", {})
+    for mapping in (
+        configuration if isinstance(configuration, list) else [configuration]
     ):
-        configuration = (
-            field_mappings.get(
-                # First look for configurations for this data provider
-                str(observation.data_provider_id),
-                {},
-            )
-            .get(  # Then look for configurations for this stream type
-                str(stream_type), {}
-            )
-            .get(
-                # Then look for configurations for this destination
-                str(destination.id),
-                {},
+        destination_field = mapping.get("destination_field")
+        if not destination_field:
+            raise ReferenceDataError(
+                f"No destination_field found in field mapping {mapping}"
             )
-        )
-        if configuration:
-            destination_field = configuration.get("destination_field")
-            if not destination_field:
-                raise ReferenceDataError(
-                    f"No destination_field found in route configuration {route_configuration}"
-                )
-            field_mapping_rule = FieldMappingRule(
+        rules.append(
+            FieldMappingRule(
                 target=destination_field,
-                default=configuration.get("default"),
-                source=configuration.get("provider_field"),
-                map=configuration.get("map"),
+                default=mapping.get("default"),
+                source=mapping.get("provider_field"),
+                map=mapping.get("map"),
             )
-            rules.append(field_mapping_rule)
+        )
+    return rules
+
+
+def build_field_mapping_rules(
+    *, route_configuration, data_provider_id, stream_type, destination_id
+):
+    """Build the rules configured in the route for a data provider, stream type and destination."""
+    if not route_configuration or not (
+        field_mappings := route_configuration.data.get("field_mappings", {})
+    ):
+        return []
+    configuration = (
+        field_mappings.get(
+            # First look for configurations for this data provider
+            str(data_provider_id),
+            {},
+        )
+        .get(str(stream_type), {})  # Then look for configurations for this stream type
+        .get(
+            # Then look for configurations for this destination
+            str(destination_id),
+            {},
+        )
+    )
+    if not configuration:
+        return []
+    # Compiled rules are reused until the route configuration changes
+    version = utils.create_cache_key(codec.dumps(configuration))
+    cache_key = f"{route_configuration.id}.{data_provider_id}.{stream_type}.{destination_id}.{version}"
+    if (rules := field_mapping_rules_cache.get(cache_key)) is None:
+        rules = compile_field_mapping_rules(configuration)
+        field_mapping_rules_cache.set(cache_key, rules)
+    return rules
+
+
+async def transform_observation_v2(
+    observation,
+    destination,
+    provider,
+    route_configuration=None,
+    rules=None,
+    transformer=None,
+):
+    """
+    Transform an observation for a destination. Precompiled `rules` and a reusable
+    `transformer` may be passed in, otherwise they are built from the route configuration.
+    """
+    # Look for a proper transformer for this stream type and destination type
+    if not transformer:
+        Transformer = get_transformer_class(
+            observation.observation_type, destination.type.value
+        )
+        transformer = transformer_pool.get(Transformer, config=destination)
+
+    # Check for extra configurations to apply
+    if rules is None:
+        rules = build_field_mapping_rules(
+            route_configuration=route_configuration,
+            data_provider_id=observation.data_provider_id,
+            stream_type=observation.observation_type,
+            destination_id=destination.id,
+        )
 
     # Apply the transformer
-    transformer = Transformer(config=destination)
     try:
-        return await transformer.transform(
-            message=observation, rules=rules, provider=provider, gundi_version=GUNDI_V2
-        )
+        with metrics.timer(
+            metrics.transform_seconds, transformer=type(transformer).__name__
+        ):
+            return await transformer.transform(
+                message=observation,
+                rules=rules,
+                provider=provider,
+                gundi_version=GUNDI_V2,
+            )
     except Exception as e:
-        msg = f"{Transformer.__name__} failed to transform observation {observation.gundi_id}: {type(e).__name__}:{e}"
+        msg = f"{type(transformer).__name__} failed to transform observation {observation.gundi_id}: {type(e).__name__}:{e}"
         logger.exception(msg)
         raise e
 
 
+class TransformerPool:
+    """
+    LRU pool of transformer instances, keyed by transformer class, integration id and
+    a hash of the integration configuration. It keeps expensive transformers (i.e. SMART
+    clients and data models) warm across messages, and a configuration change in the
+    portal creates a new instance.
+    """
+
+    def __init__(self, *, maxsize):
+        self.maxsize = maxsize
+        self._instances = OrderedDict()
+        self._warm_up_tasks = set()
+
+    @staticmethod
+    def get_key(Transformer, config):
+        config_hash = utils.create_cache_key(codec.dump_model(config))
+        return f"{Transformer.__name__}.{config.id}.{config_hash}"
+
+    def get(self, Transformer, config, warm_up=True):
+        key = self.get_key(Transformer, config)
+        if transformer := self._instances.get(key):
+            self._instances.move_to_end(key)
+            return transformer
+        transformer = Transformer(config=config)
+        if self.maxsize > 0:
+            self._instances[key] = transformer
+            while len(self._instances) > self.maxsize:
+                self._instances.popitem(last=False)
+        if (
+            warm_up
+            and settings.SMART_WARM_UP_ENABLED
+            and hasattr(transformer, "warm_up")
+        ):
+            self._warm_up_in_background(transformer)
+        return transformer
+
+    def _warm_up_in_background(self, transformer):
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:  # Built outside the event loop, it'll warm up on first use
+            return
+        task = asyncio.ensure_future(transformer.warm_up())
+        self._warm_up_tasks.add(task)
+        task.add_done_callback(self._warm_up_tasks.discard)
+
+    def clear(self):
+        self._instances.clear()
+
+    def __len__(self):
+        return len(self._instances)
+
+
+transformer_pool = TransformerPool(maxsize=settings.TRANSFORMER_POOL_MAX_SIZE)
+
+
+async def _warm_up_destination(destination_id):
+    try:
+        destination = await gundi.get_integration(integration_id=destination_id)
+        if not destination:
+            logger.warning(f"Destination {destination_id} not found. Skipping warm-up.")
+            return
+        Transformer = get_transformer_class(
+            schemas.v2.StreamPrefixEnum.event.value, destination.type.value
+        )
+        transformer = transformer_pool.get(
+            Transformer, config=destination, warm_up=False
+        )
+        if hasattr(transformer, "warm_up"):
+            await transformer.warm_up()
+    except Exception as e:
+        logger.warning(
+            f"Error warming up destination {destination_id}: {type(e).__name__}: {e}"
+        )
+
+
+async def warm_up_destinations(destination_ids):
+    """Build the transformers of known-hot destinations and prefetch their reference data (i.e. on startup)."""
+    await gather_with_concurrency(
+        [_warm_up_destination(destination_id) for destination_id in destination_ids],
+        limit=settings.SMART_WARM_UP_CONCURRENCY,
+    )
+
+
 # Map to get the right transformer for the observation type and destination
 transformers_map = {
     schemas.v2.StreamPrefixEnum.event.value: {
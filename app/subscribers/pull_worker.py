@@ -0,0 +1,162 @@
+"""
+Streaming pull worker: an alternative entry point to the push endpoint.
+
+Pulls messages from a PubSub subscription and runs them through the same
+dedup, age and version dispatch logic as the push handler. Run it with:
+
+    python -m app.subscribers.pull_worker
+
+Set PUBSUB_EMULATOR_HOST (e.g. localhost:8085) to run it against the local emulator.
+"""
+import asyncio
+import logging
+from datetime import timezone
+
+import aiohttp
+from gcloud.aio import pubsub
+
+from app.core import settings
+from app.core.ingest import IngestMessage
+from app.services.lifecycle import background_services
+from app.services.process_messages import process_message
+
+
+logger = logging.getLogger(__name__)
+
+
+class FlowController:
+    """Limit the total size of the messages being processed at the same time."""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.outstanding_bytes = 0
+        self._condition = None
+
+    async def acquire(self, size):
+        if self._condition is None:  # Bind to the running loop
+            self._condition = asyncio.Condition()
+        # A single message bigger than the budget must still be processed
+        size = min(size, self.max_bytes)
+        async with self._condition:
+            await self._condition.wait_for(
+                lambda: self.outstanding_bytes + size <= self.max_bytes
+            )
+            self.outstanding_bytes += size
+        return size
+
+    async def release(self, size):
+        async with self._condition:
+            self.outstanding_bytes -= size
+            self._condition.notify_all()
+
+
+def format_publish_time(publish_time):
+    if not publish_time:
+        return None
+    if publish_time.tzinfo is None:  # gcloud-aio parses it as a naive UTC datetime
+        publish_time = publish_time.replace(tzinfo=timezone.utc)
+    return publish_time.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+
+
+class PullWorker:
+    def __init__(
+        self,
+        *,
+        subscription,
+        max_outstanding_messages,
+        max_outstanding_bytes,
+        num_producers,
+        max_messages_per_producer,
+        ack_window,
+        ack_deadline_seconds,
+        process=process_message,
+    ):
+        self.subscription = subscription
+        self.max_outstanding_messages = max_outstanding_messages
+        self.num_producers = num_producers
+        self.max_messages_per_producer = max_messages_per_producer
+        self.ack_window = ack_window
+        self.ack_deadline_seconds = ack_deadline_seconds
+        self.flow_control = FlowController(max_bytes=max_outstanding_bytes)
+        self.subscriber_client = None
+        self._process = process
+
+    async def handle_message(self, message):
+        """
+        Process one message. Returning acks it (in batches, every `ack_window`
+        seconds); raising nacks it so PubSub redelivers it later.
+        """
+        size = await self.flow_control.acquire(len(message.data or b""))
+        lease = asyncio.ensure_future(self._extend_lease(message))
+        try:
+            result = await self._process(
+                IngestMessage(
+                    data=message.data,
+                    attributes=message.attributes,
+                    pubsub_message_id=message.message_id,
+                    timestamp=format_publish_time(message.publish_time),
+                )
+            )
+            logger.debug(f"Message {message.message_id} handled: {result}")
+            return result
+        finally:
+            lease.cancel()
+            await self.flow_control.release(size)
+
+    async def _extend_lease(self, message):
+        # Keep the message leased while it's being processed, so slow
+        # destinations don't cause a redelivery of a message still in progress.
+        # It's extended right away, as the subscription's deadline may be shorter.
+        interval = max(self.ack_deadline_seconds / 2, 1)
+        while True:
+            try:
+                await self.subscriber_client.modify_ack_deadline(
+                    self.subscription,
+                    [message.ack_id],
+                    ack_deadline_seconds=self.ack_deadline_seconds,
+                )
+            except Exception as e:
+                logger.warning(
+                    f"Failed to extend the lease of message {message.message_id}: {type(e).__name__}: {e}"
+                )
+            await asyncio.sleep(interval)
+
+    async def run(self):
+        logger.info(f"Pulling messages from {self.subscription}..")
+        async with aiohttp.ClientSession() as session:
+            self.subscriber_client = pubsub.SubscriberClient(session=session)
+            await pubsub.subscribe(
+                self.subscription,
+                self.handle_message,
+                self.subscriber_client,
+                num_producers=self.num_producers,
+                max_messages_per_producer=self.max_messages_per_producer,
+                ack_window=self.ack_window,
+                # The limit is per producer
+                num_tasks_per_consumer=max(
+                    self.max_outstanding_messages // self.num_producers, 1
+                ),
+                enable_nack=True,
+            )
+
+
+def build_worker():
+    return PullWorker(
+        subscription=f"projects/{settings.GCP_PROJECT_ID}/subscriptions/{settings.PULL_SUBSCRIPTION_NAME}",
+        max_outstanding_messages=settings.PULL_MAX_OUTSTANDING_MESSAGES,
+        max_outstanding_bytes=settings.PULL_MAX_OUTSTANDING_BYTES,
+        num_producers=settings.PULL_NUM_PRODUCERS,
+        max_messages_per_producer=settings.PULL_MAX_MESSAGES_PER_PRODUCER,
+        ack_window=settings.PULL_ACK_WINDOW_SECONDS,
+        ack_deadline_seconds=settings.PULL_ACK_DEADLINE_SECONDS,
+    )
+
+
+async def main():
+    # The same background components as the push endpoint
+    async with background_services():
+        await build_worker().run()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
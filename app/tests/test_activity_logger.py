@@ -14,17 +14,19 @@ def async_return(value):
 
 @pytest.fixture
 def mock_dedup_cache(mocker):
-    """Cache where the dedup key has not been seen yet (set with nx=True returns truthy)."""
+    """Cache where the dedup keys have not been seen yet."""
     cache = mocker.MagicMock()
-    cache.set.return_value = async_return(True)
+    cache.mget.side_effect = lambda keys: async_return([None] * len(keys))
+    cache.pipeline.return_value = cache
+    cache.execute.return_value = async_return([True])
     return cache
 
 
 @pytest.fixture
 def mock_dedup_cache_already_seen(mocker):
-    """Cache where the dedup key already exists (set with nx=True returns None)."""
+    """Cache where the dedup keys already exist."""
     cache = mocker.MagicMock()
-    cache.set.return_value = async_return(None)
+    cache.mget.side_effect = lambda keys: async_return(["1"] * len(keys))
     return cache
 
 
@@ -34,7 +36,7 @@ async def test_logs_first_time_failure(mocker, mock_dedup_cache):
     mock_publish = mocker.patch.object(
         activity_logger,
         "send_event_to_integration_events_topic",
-        return_value=async_return(None),
+        return_value=async_return(True),
     )
 
     await log_portal_lookup_error(
@@ -49,12 +51,16 @@ async def test_logs_first_time_failure(mocker, mock_dedup_cache):
     assert str(event.payload.integration_id) == "abc-123"
     assert event.payload.data["error_type"] == "ValueError"
     assert event.payload.data["error_message"] == "bad slug"
+    # Marked as emitted once published
+    mock_dedup_cache.setex.assert_called_once_with(
+        _dedup_key("get_connection", "abc-123", ValueError("bad slug")),
+        activity_logger.settings.ACTIVITY_LOG_DEDUP_TTL,
+        1,
+    )
 
 
 @pytest.mark.asyncio
-async def test_dedup_within_ttl_does_not_publish(
-    mocker, mock_dedup_cache_already_seen
-):
+async def test_dedup_within_ttl_does_not_publish(mocker, mock_dedup_cache_already_seen):
     mocker.patch.object(activity_logger, "_cache_db", mock_dedup_cache_already_seen)
     mock_publish = mocker.patch.object(
         activity_logger,
@@ -72,9 +78,7 @@ async def test_dedup_within_ttl_does_not_publish(
 
 
 @pytest.mark.asyncio
-async def test_different_error_signature_logs_independently(
-    mocker, mock_dedup_cache
-):
+async def test_different_error_signature_logs_independently(mocker, mock_dedup_cache):
     mocker.patch.object(activity_logger, "_cache_db", mock_dedup_cache)
     mocker.patch.object(
         activity_logger,
@@ -110,7 +114,7 @@ async def test_publish_failure_is_swallowed(mocker, mock_dedup_cache):
 @pytest.mark.asyncio
 async def test_redis_failure_is_swallowed(mocker):
     failing_cache = mocker.MagicMock()
-    failing_cache.set.side_effect = RuntimeError("redis down")
+    failing_cache.mget.side_effect = RuntimeError("redis down")
     mocker.patch.object(activity_logger, "_cache_db", failing_cache)
     mock_publish = mocker.patch.object(
         activity_logger,
@@ -125,3 +129,144 @@ async def test_redis_failure_is_swallowed(mocker):
         exception=ValueError("bad slug"),
     )
     mock_publish.assert_not_called()
+
+
+def _activity_log_emitter(**kwargs):
+    return activity_logger.ActivityLogEmitter(
+        **{
+            "max_queued": 100,
+            "max_messages": 10,
+            "linger_seconds": 0.01,
+            "dedup_window": 60,
+            "dedup_max_size": 100,
+            **kwargs,
+        }
+    )
+
+
+@pytest.mark.asyncio
+async def test_repeats_are_suppressed_in_process_before_redis(mocker, mock_dedup_cache):
+    mocker.patch.object(activity_logger, "_cache_db", mock_dedup_cache)
+    mock_publish = mocker.patch.object(
+        activity_logger,
+        "send_event_to_integration_events_topic",
+        return_value=async_return(True),
+    )
+
+    for _ in range(3):
+        await log_portal_lookup_error(
+            action_id="get_connection",
+            resource_id="abc-123",
+            exception=ValueError("bad slug"),
+        )
+
+    assert mock_dedup_cache.mget.call_count == 1
+    mock_publish.assert_called_once()
+
+
+@pytest.mark.asyncio
+async def test_activity_logs_are_published_in_background_batches(
+    mocker, mock_dedup_cache
+):
+    mocker.patch.object(activity_logger, "_cache_db", mock_dedup_cache)
+    mock_publish = mocker.patch.object(
+        activity_logger,
+        "send_events_to_integration_events_topic",
+        return_value=async_return(True),
+    )
+    emitter = _activity_log_emitter()
+    mocker.patch.object(activity_logger, "activity_log_emitter", emitter)
+    await emitter.start()
+
+    for i in range(3):
+        await log_portal_lookup_error(
+            action_id="get_connection",
+            resource_id=f"abc-{i}",
+            exception=ValueError("bad slug"),
+        )
+    # The caller doesn't wait for Redis or PubSub
+    assert not mock_dedup_cache.mget.called
+    assert not mock_publish.called
+    await asyncio.sleep(0.05)
+    await emitter.close()
+
+    mock_publish.assert_called_once()
+    events = mock_publish.call_args.args[0]
+    assert [str(e.payload.integration_id) for e in events] == [
+        "abc-0",
+        "abc-1",
+        "abc-2",
+    ]
+    assert emitter.stats() == {
+        "queued": 0,
+        "published": 3,
+        "deduplicated": 0,
+        "dropped": 0,
+    }
+
+
+@pytest.mark.asyncio
+async def test_activity_logs_are_dropped_when_the_queue_is_full(
+    mocker, mock_dedup_cache_already_seen
+):
+    mocker.patch.object(activity_logger, "_cache_db", mock_dedup_cache_already_seen)
+    emitter = _activity_log_emitter(max_queued=1)
+    mocker.patch.object(activity_logger, "activity_log_emitter", emitter)
+    await emitter.start()
+
+    for i in range(3):
+        await log_portal_lookup_error(
+            action_id="get_connection",
+            resource_id=f"abc-{i}",
+            exception=ValueError("bad slug"),
+        )
+
+    assert emitter.stats()["dropped"] == 2
+    await emitter.close()
+
+
+@pytest.mark.asyncio
+async def test_failed_publish_is_not_suppressed(mocker, mock_dedup_cache):
+    mocker.patch.object(activity_logger, "_cache_db", mock_dedup_cache)
+    mock_publish = mocker.patch.object(
+        activity_logger,
+        "send_events_to_integration_events_topic",
+        side_effect=[False, True],
+    )
+    emitter = _activity_log_emitter(dedup_window=0)
+    mocker.patch.object(activity_logger, "activity_log_emitter", emitter)
+    await emitter.start()
+
+    for _ in range(2):
+        await log_portal_lookup_error(
+            action_id="get_connection",
+            resource_id="abc-123",
+            exception=ValueError("bad slug"),
+        )
+        await asyncio.sleep(0.05)
+    await emitter.close()
+
+    # The Redis key is written only after the second, successful, publish
+    assert mock_publish.call_count == 2
+    assert mock_dedup_cache.setex.call_count == 1
+    assert emitter.stats()["published"] == 1
+
+
+@pytest.mark.asyncio
+async def test_dropped_activity_log_is_not_suppressed(mocker, mock_dedup_cache):
+    mocker.patch.object(activity_logger, "_cache_db", mock_dedup_cache)
+    emitter = _activity_log_emitter(max_queued=1)
+    mocker.patch.object(activity_logger, "activity_log_emitter", emitter)
+    await emitter.start()
+    emitter.emit("another-key", **{})  # Fills the queue
+
+    await log_portal_lookup_error(
+        action_id="get_connection",
+        resource_id="abc-123",
+        exception=ValueError("bad slug"),
+    )
+    assert emitter.stats()["dropped"] == 1
+
+    key = _dedup_key("get_connection", "abc-123", ValueError("bad slug"))
+    assert not emitter.is_recent(key)
+    await emitter.close()
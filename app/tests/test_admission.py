@@ -0,0 +1,84 @@
+import asyncio
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.core.admission import AdmissionController
+from app.core.errors import AdmissionRejected
+from app.main import app
+
+
+api_client = TestClient(app)
+
+
+@pytest.mark.asyncio
+async def test_requests_above_the_limit_wait_for_a_slot():
+    controller = AdmissionController(max_in_flight=2, max_queued=10, queue_timeout=1)
+    max_in_flight = 0
+
+    async def handle_request():
+        nonlocal max_in_flight
+        async with controller.admit():
+            max_in_flight = max(max_in_flight, controller.in_flight)
+            await asyncio.sleep(0.01)
+
+    await asyncio.gather(*[handle_request() for _ in range(10)])
+
+    assert max_in_flight == 2
+    assert controller.stats() == {"in_flight": 0, "queued": 0, "rejected": 0}
+
+
+@pytest.mark.asyncio
+async def test_requests_are_rejected_when_the_queue_is_full():
+    controller = AdmissionController(max_in_flight=1, max_queued=1, queue_timeout=1)
+    release = asyncio.Event()
+
+    async def handle_request():
+        async with controller.admit():
+            await release.wait()
+
+    in_flight = asyncio.ensure_future(handle_request())
+    queued = asyncio.ensure_future(handle_request())
+    await asyncio.sleep(0)
+
+    with pytest.raises(AdmissionRejected) as e:
+        await controller.acquire()
+
+    assert e.value.status_code == 429
+    assert controller.stats() == {"in_flight": 1, "queued": 1, "rejected": 1}
+    release.set()
+    await asyncio.gather(in_flight, queued)
+    assert controller.in_flight == 0
+
+
+@pytest.mark.asyncio
+async def test_requests_are_rejected_after_the_queue_timeout():
+    controller = AdmissionController(max_in_flight=1, max_queued=10, queue_timeout=0.01)
+    await controller.acquire()
+
+    with pytest.raises(AdmissionRejected) as e:
+        await controller.acquire()
+
+    assert e.value.status_code == 503
+    assert controller.stats() == {"in_flight": 1, "queued": 0, "rejected": 1}
+    controller.release()
+    assert controller.in_flight == 0
+
+
+def test_push_endpoint_sheds_load(
+    mocker, pubsub_request_headers, event_v2_request_payload
+):
+    controller = AdmissionController(max_in_flight=1, max_queued=0, queue_timeout=1)
+    controller.in_flight = 1  # Busy
+    mocker.patch("app.main.admission_controller", controller)
+    mock_process_request = mocker.patch("app.main.process_request")
+
+    response = api_client.post(
+        "/",
+        headers=pubsub_request_headers,
+        json=event_v2_request_payload,
+    )
+
+    assert response.status_code == 429
+    assert response.json() == {"status": "rejected", "reason": "queue_full"}
+    assert not mock_process_request.called
@@ -0,0 +1,148 @@
+import asyncio
+
+import pytest
+
+from app.conftest import async_return
+from app.core import cache
+from app.core.cache import get_stale_key, jittered_ttl
+from app.core.gundi import get_connection
+
+
+@pytest.fixture
+def short_lock_wait(mocker):
+    mocker.patch.object(cache.settings, "CACHE_LOCK_WAIT_SECONDS", 0.2)
+    mocker.patch.object(cache.settings, "CACHE_LOCK_POLL_INTERVAL_SECONDS", 0.01)
+
+
+@pytest.mark.asyncio
+async def test_concurrent_misses_do_a_single_portal_lookup(
+    mocker, mock_cache, connection_v2
+):
+    mocker.patch("app.core.gundi._cache_db", mock_cache)
+    portal = mocker.MagicMock()
+
+    async def slow_lookup(**kwargs):
+        await asyncio.sleep(0.05)
+        return connection_v2
+
+    portal.get_connection_details.side_effect = slow_lookup
+    mocker.patch("app.core.gundi.portal_v2", portal)
+
+    connections = await asyncio.gather(
+        *[get_connection(connection_id=str(connection_v2.id)) for _ in range(10)]
+    )
+
+    assert all(c == connection_v2 for c in connections)
+    assert portal.get_connection_details.call_count == 1
+    # The lock is taken and released once
+    assert mock_cache.set.call_count == 1
+    assert mock_cache.eval.call_count == 1
+
+
+@pytest.mark.asyncio
+async def test_wait_for_another_instance_refreshing_the_key(
+    mocker, mock_cache, connection_v2, mock_gundi_client_v2, short_lock_wait
+):
+    mock_cache.set.return_value = async_return(None)  # Lock taken by another instance
+    mock_cache.get.side_effect = [
+        async_return(None),
+        async_return(None),
+        async_return(connection_v2.json()),
+    ]
+    mocker.patch("app.core.gundi._cache_db", mock_cache)
+    mocker.patch("app.core.gundi.portal_v2", mock_gundi_client_v2)
+
+    connection = await get_connection(connection_id=str(connection_v2.id))
+
+    assert connection == connection_v2
+    assert not mock_gundi_client_v2.get_connection_details.called
+
+
+@pytest.mark.asyncio
+async def test_use_the_previous_value_while_the_key_is_refreshed(
+    mocker, mock_cache, connection_v2, mock_gundi_client_v2, short_lock_wait
+):
+    stale_key = get_stale_key(f"connection_detail.{connection_v2.id}")
+
+    def get(key):
+        return async_return(connection_v2.json() if key == stale_key else None)
+
+    mock_cache.set.return_value = async_return(None)  # Lock taken by another instance
+    mock_cache.get.side_effect = get
+    mocker.patch("app.core.gundi._cache_db", mock_cache)
+    mocker.patch("app.core.gundi.portal_v2", mock_gundi_client_v2)
+
+    connection = await get_connection(connection_id=str(connection_v2.id))
+
+    assert connection == connection_v2
+    assert not mock_gundi_client_v2.get_connection_details.called
+
+
+@pytest.mark.asyncio
+async def test_lookup_writes_a_stale_copy_with_jittered_ttl(
+    mocker, mock_cache, connection_v2, mock_gundi_client_v2
+):
+    mocker.patch("app.core.gundi._cache_db", mock_cache)
+    mocker.patch("app.core.gundi.portal_v2", mock_gundi_client_v2)
+    cache_key = f"connection_detail.{connection_v2.id}"
+
+    await get_connection(connection_id=str(connection_v2.id))
+
+    # Both copies are written in a single transaction
+    mock_cache.pipeline.assert_called_once_with(transaction=True)
+    assert mock_cache.execute.call_count == 1
+    written = {call.args[0]: call.args[1] for call in mock_cache.setex.call_args_list}
+    ttl = cache.settings.PORTAL_CONFIG_OBJECT_CACHE_TTL
+    assert (
+        ttl <= written[cache_key] <= ttl * (1 + cache.settings.CACHE_TTL_JITTER_RATIO)
+    )
+    assert written[get_stale_key(cache_key)] == cache.settings.CACHE_STALE_TTL
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("error", [None, ConnectionError("Portal unavailable")])
+async def test_lock_holder_uses_the_previous_value_if_the_refresh_fails(
+    mocker, mock_cache, connection_v2, error
+):
+    stale_key = get_stale_key(f"connection_detail.{connection_v2.id}")
+
+    def get(key):
+        return async_return(connection_v2.json() if key == stale_key else None)
+
+    mock_cache.get.side_effect = get
+    mocker.patch("app.core.gundi._cache_db", mock_cache)
+    fetch = mocker.patch("app.core.gundi._fetch_connection")
+    fetch.side_effect = error
+    fetch.return_value = None
+
+    connection = await get_connection(connection_id=str(connection_v2.id))
+
+    assert connection == connection_v2
+    assert fetch.call_count == 1
+    assert mock_cache.eval.call_count == 1  # The lock is released
+
+
+@pytest.mark.asyncio
+async def test_lock_holder_propagates_the_error_without_previous_value(
+    mocker, mock_cache
+):
+    fetch = mocker.MagicMock(side_effect=ConnectionError("Portal unavailable"))
+
+    with pytest.raises(ConnectionError):
+        await cache.get_or_refresh(
+            cache_db=mock_cache,
+            cache_key="connection_detail.missing",
+            fetch=fetch,
+            load_cached=mocker.MagicMock(),
+        )
+    assert mock_cache.eval.call_count == 1  # The lock is released
+
+
+def test_jittered_ttl_stays_in_range(mocker):
+    mocker.patch.object(cache.settings, "CACHE_TTL_JITTER_RATIO", 0.5)
+
+    ttls = {jittered_ttl(60) for _ in range(200)}
+
+    assert min(ttls) >= 60
+    assert max(ttls) <= 90
+    assert len(ttls) > 1
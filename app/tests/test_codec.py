@@ -0,0 +1,89 @@
+import importlib.util
+import json
+import sys
+import uuid
+from datetime import date, datetime, timezone
+from unittest import mock
+
+import pytest
+
+from gundi_core import schemas
+
+from app.core import codec
+
+
+def _load_stdlib_codec():
+    # A separate copy of the module, imported without orjson
+    spec = importlib.util.spec_from_file_location("_stdlib_codec", codec.__file__)
+    module = importlib.util.module_from_spec(spec)
+    with mock.patch.dict(sys.modules, {"orjson": None}):
+        spec.loader.exec_module(module)
+    return module
+
+
+def test_codec_serializes_uuids_and_datetimes():
+    gundi_id = uuid.uuid4()
+    recorded_at = datetime(2023, 7, 11, 18, 19, 19, tzinfo=timezone.utc)
+
+    data = codec.loads(codec.dumps({"gundi_id": gundi_id, "recorded_at": recorded_at}))
+
+    assert data == {
+        "gundi_id": str(gundi_id),
+        "recorded_at": "2023-07-11 18:19:19+00:00",
+    }
+
+
+@pytest.mark.parametrize("backend", ["default", "stdlib"])
+def test_codec_keeps_the_datetime_format_sent_to_dispatchers(backend):
+    dumps = codec.dumps if backend == "default" else _load_stdlib_codec().dumps
+    payload = {
+        "recorded_at": datetime(2023, 7, 11, 18, 19, 19, tzinfo=timezone.utc),
+        "created_at": datetime(2023, 7, 11, 18, 19, 19, 215000, tzinfo=timezone.utc),
+        "date": date(2023, 7, 11),
+    }
+
+    # The format of json.dumps(payload, default=str), used before the codec
+    assert json.loads(dumps(payload)) == json.loads(json.dumps(payload, default=str))
+    assert dumps(payload) == (
+        b'{"recorded_at":"2023-07-11 18:19:19+00:00",'
+        b'"created_at":"2023-07-11 18:19:19.215000+00:00",'
+        b'"date":"2023-07-11"}'
+    )
+
+
+def test_codec_serializes_pydantic_models(destination_integration_v2):
+    data = codec.loads(codec.dumps({"destination": destination_integration_v2}))
+
+    assert data["destination"]["id"] == str(destination_integration_v2.id)
+
+
+def test_codec_model_round_trip(destination_integration_v2):
+    cached = codec.dump_model(destination_integration_v2)
+
+    integration = codec.parse_model(schemas.v2.Integration, cached)
+
+    # Same result as pydantic's own round trip
+    assert integration == schemas.v2.Integration.parse_raw(
+        destination_integration_v2.json()
+    )
+
+
+def test_codec_reads_entries_cached_by_pydantic(destination_integration_v2):
+    # Entries written with .json() before the codec was introduced are still readable
+    integration = codec.parse_model(
+        schemas.v2.Integration, destination_integration_v2.json()
+    )
+
+    assert integration == schemas.v2.Integration.parse_raw(
+        destination_integration_v2.json()
+    )
+
+
+def test_to_jsonable_stringifies_attribute_values():
+    destination_id = uuid.uuid4()
+
+    attributes = codec.to_jsonable(
+        {"destination_id": destination_id, "gundi_version": "v2"}
+    )
+
+    assert attributes == {"destination_id": str(destination_id), "gundi_version": "v2"}
@@ -1,5 +1,7 @@
 import asyncio
 import pytest
+from app.core import codec
+from app.core.cache import connections_cache
 from app.core.gundi import get_connection
 from gundi_core import schemas
 
@@ -15,11 +17,11 @@ async def test_get_connection_from_cache(
     mocker, mock_cache_with_cached_connection, connection_v2, mock_gundi_client_v2
 ):
     # Mock external dependencies
-    mocker.patch("app.core.gundi._cache_db", mock_cache_with_cached_connection)  # empty cache
+    mocker.patch(
+        "app.core.gundi._cache_db", mock_cache_with_cached_connection
+    )  # empty cache
     mocker.patch("app.core.gundi.portal_v2", mock_gundi_client_v2)
-    connection = await get_connection(
-        connection_id=str(connection_v2.id)
-    )
+    connection = await get_connection(connection_id=str(connection_v2.id))
     assert mock_cache_with_cached_connection.get.called
     assert not mock_gundi_client_v2.get_connection_details.called
     assert connection == connection_v2
@@ -32,11 +34,11 @@ async def test_get_connection_from_gundi_on_cache_miss(
     # Mock external dependencies
     mocker.patch("app.core.gundi._cache_db", mock_cache)  # faulty cache
     mocker.patch("app.core.gundi.portal_v2", mock_gundi_client_v2)
-    connection = await get_connection(
-        connection_id=str(connection_v2.id)
-    )
+    connection = await get_connection(connection_id=str(connection_v2.id))
     assert mock_cache.get.called
-    mock_gundi_client_v2.get_connection_details.assert_called_once_with(integration_id=str(connection_v2.id))
+    mock_gundi_client_v2.get_connection_details.assert_called_once_with(
+        integration_id=str(connection_v2.id)
+    )
     assert connection == connection_v2
 
 
@@ -45,24 +47,26 @@ async def test_get_connection_from_gundi_on_cache_error(
     mocker, mock_cache_with_connection_error, connection_v2, mock_gundi_client_v2
 ):
     # Mock external dependencies
-    mocker.patch("app.core.gundi._cache_db", mock_cache_with_connection_error)  # empty cache
+    mocker.patch(
+        "app.core.gundi._cache_db", mock_cache_with_connection_error
+    )  # empty cache
     mocker.patch("app.core.gundi.portal_v2", mock_gundi_client_v2)
-    connection = await get_connection(
-        connection_id=str(connection_v2.id)
-    )
+    connection = await get_connection(connection_id=str(connection_v2.id))
     assert mock_cache_with_connection_error.get.called
-    mock_gundi_client_v2.get_connection_details.assert_called_once_with(integration_id=str(connection_v2.id))
+    mock_gundi_client_v2.get_connection_details.assert_called_once_with(
+        integration_id=str(connection_v2.id)
+    )
     assert connection == connection_v2
 
 
 @pytest.mark.asyncio
-async def test_portal_failure_emits_activity_log(
-    mocker, mock_cache, connection_v2
-):
+async def test_portal_failure_emits_activity_log(mocker, mock_cache, connection_v2):
     # Cache miss forces a portal call, portal raises a validation-style error.
     mocker.patch("app.core.gundi._cache_db", mock_cache)
     failing_portal = mocker.MagicMock()
-    failing_portal.get_connection_details.side_effect = ValueError("1 validation error for Connection")
+    failing_portal.get_connection_details.side_effect = ValueError(
+        "1 validation error for Connection"
+    )
     mocker.patch("app.core.gundi.portal_v2", failing_portal)
     mock_log = mocker.patch(
         "app.core.gundi.log_portal_lookup_error",
@@ -78,3 +82,55 @@ async def test_portal_failure_emits_activity_log(
     assert kwargs["resource_id"] == str(connection_v2.id)
     assert isinstance(kwargs["exception"], ValueError)
 
+
+@pytest.mark.asyncio
+async def test_get_connection_from_local_cache_after_redis_hit(
+    mocker, mock_cache_with_cached_connection, connection_v2, mock_gundi_client_v2
+):
+    mocker.patch("app.core.gundi._cache_db", mock_cache_with_cached_connection)
+    mocker.patch("app.core.gundi.portal_v2", mock_gundi_client_v2)
+    mock_parse = mocker.spy(codec, "parse_model")
+
+    for _ in range(3):
+        connection = await get_connection(connection_id=str(connection_v2.id))
+
+    assert connection == connection_v2
+    # Redis and pydantic are used only the first time
+    assert mock_cache_with_cached_connection.get.call_count == 1
+    assert mock_parse.call_count == 1
+    assert connections_cache.hits == 2
+
+
+@pytest.mark.asyncio
+async def test_get_connection_from_local_cache_after_portal_lookup(
+    mocker, mock_cache, connection_v2, mock_gundi_client_v2
+):
+    mocker.patch("app.core.gundi._cache_db", mock_cache)
+    mocker.patch("app.core.gundi.portal_v2", mock_gundi_client_v2)
+
+    await get_connection(connection_id=str(connection_v2.id))
+    connection = await get_connection(connection_id=str(connection_v2.id))
+
+    assert connection == connection_v2
+    assert mock_gundi_client_v2.get_connection_details.call_count == 1
+    assert mock_cache.get.call_count == 1
+
+
+@pytest.mark.asyncio
+async def test_local_cache_entries_expire(
+    mocker, mock_cache_with_cached_connection, connection_v2, mock_gundi_client_v2
+):
+    mocker.patch("app.core.gundi._cache_db", mock_cache_with_cached_connection)
+    mocker.patch("app.core.gundi.portal_v2", mock_gundi_client_v2)
+    mock_cache_with_cached_connection.get.side_effect = [
+        _async_return(connection_v2.json()),
+        _async_return(connection_v2.json()),
+    ]
+    mock_time = mocker.patch("app.core.cache.time")
+    mock_time.monotonic.return_value = 1000.0
+    await get_connection(connection_id=str(connection_v2.id))
+
+    mock_time.monotonic.return_value = 1000.0 + connections_cache.ttl + 1
+    await get_connection(connection_id=str(connection_v2.id))
+
+    assert mock_cache_with_cached_connection.get.call_count == 2
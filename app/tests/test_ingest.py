@@ -0,0 +1,110 @@
+import base64
+import json
+
+import pytest
+
+from app.conftest import async_return
+from app.core import codec
+from app.core.deduplication import EventProcessingStatus
+from app.core.ingest import IngestMessage, decode_push_request, peek_field
+from app.services.process_messages import process_message
+
+
+def test_peek_fields_of_system_event():
+    data = json.dumps(
+        {
+            "event_id": "5d58649d-4ad5-46be-9a0e-f0bfff11c024",
+            "schema_version": "v1",
+            "payload": {"event_type": "animals", "title": "Sneaks detected"},
+            "event_type": "EventUpdateReceived",
+        }
+    ).encode("utf-8")
+
+    assert peek_field(data, "event_id") == "5d58649d-4ad5-46be-9a0e-f0bfff11c024"
+    # The event type of the nested payload is ignored
+    assert peek_field(data, "event_type") == "EventUpdateReceived"
+
+
+def test_peek_returns_none_for_nested_fields():
+    data = json.dumps(
+        {
+            "payload": {"event_id": "nested", "event_type": "animals"},
+            "schema_version": "v1",
+        }
+    ).encode("utf-8")
+
+    assert peek_field(data, "event_id") is None
+    assert peek_field(data, "event_type") is None
+
+
+def test_decode_push_request_does_not_parse_the_payload(
+    pubsub_request_headers, event_update_v2_request_payload
+):
+    body = json.dumps(event_update_v2_request_payload).encode("utf-8")
+
+    message = decode_push_request(body, pubsub_request_headers)
+
+    assert message.event_id == "5d58649d-4ad5-46be-9a0e-f0bfff11c024"
+    assert message.event_type == "EventUpdateReceived"
+    assert message.gundi_version == "v2"
+    assert message.pubsub_message_id == "11960897894856249"
+    assert (
+        message.timestamp == event_update_v2_request_payload["message"]["publish_time"]
+    )
+    assert not message.is_parsed
+    # The payload is parsed on demand
+    expected_data = base64.b64decode(event_update_v2_request_payload["message"]["data"])
+    assert message.payload == codec.loads(expected_data)
+
+
+def test_decode_push_request_falls_back_to_cloud_event_time(
+    eventarc_request_headers, event_v2_eventarc_request_payload
+):
+    body = json.dumps(event_v2_eventarc_request_payload).encode("utf-8")
+
+    message = decode_push_request(body, eventarc_request_headers)
+
+    assert message.timestamp == eventarc_request_headers["ce-time"]
+
+
+def test_v1_messages_have_no_event_id(
+    geoevent_v1_request_payload, pubsub_request_headers
+):
+    body = json.dumps(geoevent_v1_request_payload).encode("utf-8")
+
+    message = decode_push_request(body, pubsub_request_headers)
+
+    assert message.event_id is None
+    assert message.payload["observation_type"] == "ge"
+
+
+@pytest.mark.asyncio
+async def test_duplicates_are_discarded_without_parsing_the_payload(
+    mocker,
+    mock_pubsub,
+    pubsub_request_headers,
+    event_update_v2_request_payload,
+):
+    mocker.patch(
+        "app.core.deduplication.claim_event",
+        mocker.MagicMock(return_value=async_return(EventProcessingStatus.PROCESSED)),
+    )
+    mocker.patch("app.core.pubsub.pubsub", mock_pubsub)
+    body = json.dumps(event_update_v2_request_payload).encode("utf-8")
+    message = decode_push_request(body, pubsub_request_headers)
+
+    result = await process_message(message)
+
+    assert result["status"] == "discarded"
+    assert not message.is_parsed
+    # The message is forwarded to the dead letter topic as received
+    assert mock_pubsub.PubsubMessage.call_args.args[0] == message.data
+
+
+def test_message_built_from_a_decoded_payload(raw_observation_v2):
+    message = IngestMessage.from_payload(
+        raw_observation_v2, attributes={"gundi_version": "v2"}
+    )
+
+    assert message.is_parsed
+    assert message.to_bytes() == codec.dumps(raw_observation_v2)
@@ -0,0 +1,39 @@
+from app.core.cache import LocalCache
+
+
+def test_local_cache_evicts_least_recently_used():
+    cache = LocalCache(name="test", maxsize=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")  # "b" becomes the least recently used
+
+    cache.set("c", 3)
+
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+
+
+def test_local_cache_counts_hits_and_misses():
+    cache = LocalCache(name="test", maxsize=10, ttl=60)
+    cache.set("a", 1)
+
+    cache.get("a")
+    cache.get("a")
+    cache.get("missing")
+
+    assert cache.stats() == {
+        "name": "test",
+        "size": 1,
+        "maxsize": 10,
+        "hits": 2,
+        "misses": 1,
+    }
+
+
+def test_local_cache_can_be_disabled():
+    cache = LocalCache(name="test", maxsize=10, ttl=0)
+    cache.set("a", 1)
+
+    assert cache.get("a") is None
+    assert len(cache) == 0
@@ -0,0 +1,104 @@
+import pytest
+from fastapi.testclient import TestClient
+from prometheus_client import REGISTRY
+
+from app.core import settings
+from app.main import app
+
+
+api_client = TestClient(app)
+
+
+def _sample(name, **labels):
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+
+def test_metrics_endpoint():
+    response = api_client.get("/metrics")
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    assert "routing_in_flight_requests" in response.text
+    assert "routing_decode_seconds_bucket" in response.text
+
+
+@pytest.mark.asyncio
+async def test_stages_of_a_message_are_measured(
+    mocker,
+    mock_cache,
+    mock_deduplication_cache_empty,
+    mock_gundi_client_v2,
+    mock_pubsub,
+    pubsub_request_headers,
+    event_v2_request_payload,
+    destination_integration_v2,
+):
+    mocker.patch("app.core.gundi._cache_db", mock_cache)
+    mocker.patch("app.core.deduplication._cache_db", mock_deduplication_cache_empty)
+    mocker.patch("app.core.gundi.portal_v2", mock_gundi_client_v2)
+    mocker.patch("app.core.pubsub.pubsub", mock_pubsub)
+    topic = destination_integration_v2.additional["topic"]
+    before = {
+        "decode": _sample("routing_decode_seconds_count"),
+        "dedup": _sample("routing_dedup_seconds_count"),
+        "connection": _sample(
+            "routing_lookup_seconds_count", lookup="get_connection", cache="miss"
+        ),
+        "transform": _sample(
+            "routing_transform_seconds_count", transformer="EREventTransformer"
+        ),
+        "publish": _sample("routing_publish_seconds_count", topic=topic),
+    }
+
+    response = api_client.post(
+        "/",
+        headers=pubsub_request_headers,
+        json=event_v2_request_payload,
+    )
+
+    assert response.status_code == 200
+    assert _sample("routing_decode_seconds_count") == before["decode"] + 1
+    assert _sample("routing_dedup_seconds_count") == before["dedup"] + 1
+    assert (
+        _sample("routing_lookup_seconds_count", lookup="get_connection", cache="miss")
+        == before["connection"] + 1
+    )
+    assert (
+        _sample("routing_transform_seconds_count", transformer="EREventTransformer")
+        == before["transform"] + 1
+    )
+    assert (
+        _sample("routing_publish_seconds_count", topic=topic) == before["publish"] + 1
+    )
+
+
+@pytest.mark.asyncio
+async def test_discarded_messages_are_counted(
+    mocker,
+    mock_pubsub,
+    pubsub_request_headers,
+    event_v2_request_payload,
+):
+    mocker.patch("app.services.process_messages.is_too_old", return_value=True)
+    mocker.patch("app.core.pubsub.pubsub", mock_pubsub)
+    discarded = _sample("routing_discarded_messages_total", reason="too_old")
+    dead_lettered = _sample("routing_dead_lettered_messages_total", reason="too_old")
+
+    response = api_client.post(
+        "/",
+        headers=pubsub_request_headers,
+        json=event_v2_request_payload,
+    )
+
+    assert response.status_code == 200
+    assert (
+        _sample("routing_discarded_messages_total", reason="too_old") == discarded + 1
+    )
+    assert (
+        _sample("routing_dead_lettered_messages_total", reason="too_old")
+        == dead_lettered + 1
+    )
+    # The topic of the dead letters is measured too
+    assert (
+        _sample("routing_publish_seconds_count", topic=settings.DEAD_LETTER_TOPIC) > 0
+    )
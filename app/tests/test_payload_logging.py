@@ -0,0 +1,87 @@
+import logging
+from unittest.mock import MagicMock
+
+from app.core import payload_logging
+from app.core.payload_logging import (
+    TRUNCATION_MARKER,
+    LazyPayload,
+    format_payload,
+    log_payload,
+    set_payload_attribute,
+)
+
+
+def test_format_payload_truncates_big_strings():
+    formatted = format_payload("x" * 5000, max_length=100)
+    assert formatted == "x" * 100 + TRUNCATION_MARKER
+
+
+def test_format_payload_truncates_big_bodies():
+    formatted = format_payload(b"y" * 5000, max_length=100)
+    assert formatted == "y" * 100 + TRUNCATION_MARKER
+
+
+def test_format_payload_bounds_nested_payloads(raw_observation_v2):
+    big_patrol = {"segments": [raw_observation_v2] * 1000}
+    formatted = format_payload(big_patrol, max_length=500)
+    assert len(formatted) <= 500 + len(TRUNCATION_MARKER)
+
+
+def test_format_payload_supports_pydantic_models(destination_integration_v2):
+    formatted = format_payload(destination_integration_v2, max_length=2000)
+    assert formatted.startswith("Integration(")
+
+
+def test_log_payload_is_lazy_when_level_is_disabled():
+    logger = logging.getLogger("test_payload_logging")
+    logger.setLevel(logging.INFO)
+    formatted = []
+
+    class Payload:
+        def __repr__(self):
+            formatted.append(True)
+            return "payload"
+
+    log_payload(logger, "Payload: %s", Payload())
+
+    assert not formatted
+
+
+def test_log_payload_respects_sample_rate(mocker):
+    mocker.patch.object(payload_logging.settings, "PAYLOAD_LOG_SAMPLE_RATE", 0.0)
+    logger = MagicMock()
+    logger.isEnabledFor.return_value = True
+
+    log_payload(logger, "Payload: %s", {"foo": "bar"})
+
+    logger.log.assert_not_called()
+
+
+def test_log_payload_defers_formatting_to_the_logger():
+    logger = MagicMock()
+    logger.isEnabledFor.return_value = True
+
+    log_payload(logger, "Payload: %s", {"foo": "bar"})
+
+    level, msg, payload = logger.log.call_args.args
+    assert isinstance(payload, LazyPayload)
+    assert str(payload) == "{'foo': 'bar'}"
+
+
+def test_set_payload_attribute_is_capped(mocker):
+    mocker.patch.object(payload_logging.settings, "PAYLOAD_LOG_MAX_LENGTH", 50)
+    span = MagicMock()
+    span.is_recording.return_value = True
+
+    set_payload_attribute(span, "payload", "z" * 1000)
+
+    span.set_attribute.assert_called_once_with("payload", "z" * 50 + TRUNCATION_MARKER)
+
+
+def test_set_payload_attribute_skips_non_recording_spans():
+    span = MagicMock()
+    span.is_recording.return_value = False
+
+    set_payload_attribute(span, "payload", {"foo": "bar"})
+
+    span.set_attribute.assert_not_called()
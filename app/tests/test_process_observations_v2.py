@@ -1,6 +1,9 @@
+import uuid
+
 import pytest
 
 from app.conftest import async_return
+from app.core.errors import ReferenceDataError
 from app.services.process_messages import process_observation_event
 from app.core.utils import get_provider_key
 
@@ -129,3 +132,70 @@ async def test_default_provider_key(
     provider = connection_v2.provider
     provider_key = get_provider_key(provider)
     assert provider_key == f"gundi_{provider.type.value}_{str(provider.id)}"
+
+
+def _connection_with_destinations(connection, quantity):
+    destination = connection.destinations[0]
+    connection.destinations = [
+        destination.copy(update={"id": uuid.uuid4()}) for _ in range(quantity)
+    ]
+    return connection
+
+
+@pytest.mark.asyncio
+async def test_fan_out_skips_only_the_destination_with_transformer_error(
+    mocker,
+    mock_cache,
+    mock_gundi_client_v2,
+    connection_v2,
+    raw_observation_v2,
+    raw_observation_v2_attributes,
+):
+    connection = _connection_with_destinations(connection_v2, quantity=3)
+    mock_gundi_client_v2.get_connection_details.return_value = async_return(connection)
+    mocker.patch("app.core.gundi._cache_db", mock_cache)
+    mocker.patch("app.core.gundi.portal_v2", mock_gundi_client_v2)
+    mocker.patch(
+        "app.services.event_handlers.settings.DESTINATION_FANOUT_CONCURRENCY", 3
+    )
+    mocker.patch(
+        "app.services.event_handlers.transform_observation_v2",
+        side_effect=[{"foo": "bar"}, ValueError("Bad data"), {"foo": "bar"}],
+    )
+    mock_send_message_to_gcp_pubsub_dispatcher = mocker.AsyncMock()
+    mocker.patch(
+        "app.services.event_handlers.send_message_to_gcp_pubsub_dispatcher",
+        mock_send_message_to_gcp_pubsub_dispatcher,
+    )
+
+    await process_observation_event(raw_observation_v2, raw_observation_v2_attributes)
+
+    # The failing destination is discarded, the other two are still published
+    assert mock_send_message_to_gcp_pubsub_dispatcher.call_count == 2
+
+
+@pytest.mark.asyncio
+async def test_fan_out_fails_the_message_on_reference_data_error(
+    mocker,
+    mock_cache,
+    mock_gundi_client_v2,
+    connection_v2,
+    raw_observation_v2,
+    raw_observation_v2_attributes,
+):
+    connection = _connection_with_destinations(connection_v2, quantity=3)
+    mock_gundi_client_v2.get_connection_details.return_value = async_return(connection)
+    mocker.patch("app.core.gundi._cache_db", mock_cache)
+    mocker.patch("app.core.gundi.portal_v2", mock_gundi_client_v2)
+    mocker.patch(
+        "app.services.event_handlers.settings.DESTINATION_FANOUT_CONCURRENCY", 3
+    )
+    mocker.patch(
+        "app.services.event_handlers.send_message_to_gcp_pubsub_dispatcher",
+        side_effect=[None, ReferenceDataError("Topic not found"), None],
+    )
+
+    with pytest.raises(ReferenceDataError):
+        await process_observation_event(
+            raw_observation_v2, raw_observation_v2_attributes
+        )
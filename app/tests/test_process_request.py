@@ -1,21 +1,42 @@
+import asyncio
 import unittest.mock
 
 import pytest
 from fastapi.testclient import TestClient
 
-from app.conftest import async_return
+from app.conftest import async_return, mock_event_claims
 from app.core import settings
-from app.core.deduplication import EventProcessingStatus, get_event_status_key
+from app.core import deduplication
+from app.core.deduplication import (
+    EventClaim,
+    EventProcessingStatus,
+    get_deliveries_key,
+    get_event_status_key,
+)
+from app.core.errors import ReferenceDataError
 from app.main import app
 from app.services.transformers import extract_fields_from_message
 
 api_client = TestClient(app)
 
 
-@pytest.mark.parametrize("request_headers, request_payload", [
-    ("pubsub_request_headers", "geoevent_v1_request_payload",),
-    ("eventarc_request_headers", "geoevent_v1_eventarc_request_payload",),
-])
+def _scripts_run(mock_cache):
+    return [call.args[0] for call in mock_cache.eval.call_args_list]
+
+
+@pytest.mark.parametrize(
+    "request_headers, request_payload",
+    [
+        (
+            "pubsub_request_headers",
+            "geoevent_v1_request_payload",
+        ),
+        (
+            "eventarc_request_headers",
+            "geoevent_v1_eventarc_request_payload",
+        ),
+    ],
+)
 @pytest.mark.asyncio
 async def test_process_geoevent_v1_successfully(
     mocker,
@@ -25,7 +46,7 @@ async def test_process_geoevent_v1_successfully(
     mock_gundi_client,
     mock_pubsub,
     request_headers,
-    request_payload
+    request_payload,
 ):
     request_headers = request.getfixturevalue(request_headers)
     request_payload = request.getfixturevalue(request_payload)
@@ -45,10 +66,19 @@ async def test_process_geoevent_v1_successfully(
     assert mock_pubsub.PublisherClient.return_value.publish.called
 
 
-@pytest.mark.parametrize("request_headers, request_payload", [
-    ("pubsub_request_headers", "event_v2_request_payload",),
-    ("eventarc_request_headers", "event_v2_eventarc_request_payload",),
-])
+@pytest.mark.parametrize(
+    "request_headers, request_payload",
+    [
+        (
+            "pubsub_request_headers",
+            "event_v2_request_payload",
+        ),
+        (
+            "eventarc_request_headers",
+            "event_v2_eventarc_request_payload",
+        ),
+    ],
+)
 @pytest.mark.asyncio
 async def test_process_event_v2_successfully(
     mocker,
@@ -59,7 +89,7 @@ async def test_process_event_v2_successfully(
     mock_pubsub,
     request_headers,
     request_payload,
-    destination_integration_v2
+    destination_integration_v2,
 ):
     request_headers = request.getfixturevalue(request_headers)
     request_payload = request.getfixturevalue(request_payload)
@@ -123,7 +153,7 @@ async def test_message_deduplication(
     mock_pubsub,
     pubsub_request_headers,
     event_update_v2_request_payload,
-    destination_integration_v2
+    destination_integration_v2,
 ):
     # Mock external dependencies
     mocker.patch("app.core.gundi._cache_db", mock_cache)
@@ -143,12 +173,16 @@ async def test_message_deduplication(
     mocked_publish = mock_pubsub.PublisherClient.return_value.publish
     assert mocked_publish.call_count == 1
     # Check that the status was set to processed
-    data, attributes = extract_fields_from_message(event_update_v2_request_payload["message"])
+    data, attributes = extract_fields_from_message(
+        event_update_v2_request_payload["message"]
+    )
     event_id = data["event_id"]
     key = get_event_status_key(event_id=event_id)
     ttl = settings.EVENT_PROCESSING_STATUS_TTL
     value = EventProcessingStatus.PROCESSED.value
-    mock_deduplication_cache_one_miss.setex.assert_called_once_with(key, ttl, value)
+    mock_deduplication_cache_one_miss.eval.assert_any_call(
+        deduplication._COMPLETE_CLAIM_SCRIPT, 1, key, unittest.mock.ANY, value, ttl
+    )
     # Send the same request a second time
     response = api_client.post(
         "/",
@@ -170,7 +204,7 @@ async def test_message_v2_deduplication(
     mock_pubsub,
     pubsub_request_headers,
     event_update_v2_request_payload,
-    destination_integration_v2
+    destination_integration_v2,
 ):
     # Mock external dependencies
     mocker.patch("app.core.gundi._cache_db", mock_cache)
@@ -190,12 +224,16 @@ async def test_message_v2_deduplication(
     mocked_topic.assert_called_once_with(settings.GCP_PROJECT_ID, topic)
     assert mocked_publish.call_count == 1
     # Check that the status was set to processed
-    data, attributes = extract_fields_from_message(event_update_v2_request_payload["message"])
+    data, attributes = extract_fields_from_message(
+        event_update_v2_request_payload["message"]
+    )
     event_id = data["event_id"]
     key = get_event_status_key(event_id=event_id)
     ttl = settings.EVENT_PROCESSING_STATUS_TTL
     value = EventProcessingStatus.PROCESSED.value
-    mock_deduplication_cache_one_miss.setex.assert_called_once_with(key, ttl, value)
+    mock_deduplication_cache_one_miss.eval.assert_any_call(
+        deduplication._COMPLETE_CLAIM_SCRIPT, 1, key, unittest.mock.ANY, value, ttl
+    )
 
     # Send the same request a second time
     response = api_client.post(
@@ -219,7 +257,7 @@ async def test_message_v1_deduplication(
     mock_pubsub,
     pubsub_request_headers,
     geoevent_v1_request_payload,
-    outbound_integration_config
+    outbound_integration_config,
 ):
     # Mock external dependencies
     mocker.patch("app.core.gundi._cache_db", mock_cache)
@@ -241,7 +279,10 @@ async def test_message_v1_deduplication(
     mocked_topic = mock_pubsub.PublisherClient.return_value.topic_path
     mocked_topic.assert_called_once_with(settings.GCP_PROJECT_ID, topic)
     # Check that the processing status was saved
-    assert mock_deduplication_cache_one_miss.setex.called
+    assert _scripts_run(mock_deduplication_cache_one_miss) == [
+        deduplication._CLAIM_EVENT_SCRIPT,
+        deduplication._COMPLETE_CLAIM_SCRIPT,
+    ]
 
     # Send the same message again
     response = api_client.post(
@@ -254,3 +295,256 @@ async def test_message_v1_deduplication(
     mocked_topic = mock_pubsub.PublisherClient.return_value.topic_path
     mocked_topic.assert_called_with(settings.GCP_PROJECT_ID, settings.DEAD_LETTER_TOPIC)
     assert mocked_publish.call_count == 2
+
+
+@pytest.mark.asyncio
+async def test_message_being_processed_is_rejected_to_be_redelivered(
+    mocker,
+    mock_cache,
+    mock_deduplication_cache_empty,
+    mock_gundi_client_v2,
+    mock_pubsub,
+    pubsub_request_headers,
+    event_v2_request_payload,
+):
+    # Another instance holds the claim of the event
+    mock_event_claims(
+        mock_deduplication_cache_empty,
+        f"{EventProcessingStatus.IN_PROGRESS.value}:another-token",
+    )
+    mocker.patch("app.core.gundi._cache_db", mock_cache)
+    mocker.patch("app.core.deduplication._cache_db", mock_deduplication_cache_empty)
+    mocker.patch("app.core.gundi.portal_v2", mock_gundi_client_v2)
+    mocker.patch("app.core.pubsub.pubsub", mock_pubsub)
+    response = api_client.post(
+        "/",
+        headers=pubsub_request_headers,
+        json=event_v2_request_payload,
+    )
+    # Not acked, so PubSub redelivers it in case the other instance fails
+    assert response.status_code == 409
+    assert response.json()["status"] == "rejected"
+    # Not processed nor sent to the dead-letter
+    assert not mock_gundi_client_v2.get_route_details.called
+    assert not mock_pubsub.PublisherClient.return_value.publish.called
+    # Checked in a single round trip, and the claim of the other instance is left alone
+    assert _scripts_run(mock_deduplication_cache_empty) == [
+        deduplication._CLAIM_EVENT_SCRIPT
+    ]
+
+
+@pytest.mark.parametrize(
+    "value, status",
+    [
+        (0, EventProcessingStatus.UNPROCESSED),
+        ("1", EventProcessingStatus.PROCESSED),
+        ("2:another-token", EventProcessingStatus.IN_PROGRESS),
+    ],
+)
+@pytest.mark.asyncio
+async def test_event_claim_tells_processed_and_in_progress_events_apart(
+    mocker, mock_deduplication_cache_empty, value, status
+):
+    mock_event_claims(mock_deduplication_cache_empty, value)
+    mocker.patch("app.core.deduplication._cache_db", mock_deduplication_cache_empty)
+
+    async with EventClaim("event-1") as claim:
+        assert claim.status == status
+        assert claim.acquired == (status == EventProcessingStatus.UNPROCESSED)
+
+    # A single round trip to claim it
+    mock_deduplication_cache_empty.eval.assert_any_call(
+        deduplication._CLAIM_EVENT_SCRIPT,
+        1,
+        get_event_status_key("event-1"),
+        f"{EventProcessingStatus.IN_PROGRESS.value}:{claim.token}",
+        settings.EVENT_PROCESSING_CLAIM_TTL,
+    )
+    assert _scripts_run(mock_deduplication_cache_empty)[0] == (
+        deduplication._CLAIM_EVENT_SCRIPT
+    )
+
+
+@pytest.mark.asyncio
+async def test_event_claim_is_extended_while_processing(
+    mocker, mock_deduplication_cache_empty
+):
+    mocker.patch.object(settings, "EVENT_PROCESSING_CLAIM_TTL", 0.03)
+    mocker.patch("app.core.deduplication._cache_db", mock_deduplication_cache_empty)
+
+    async with EventClaim("event-1") as claim:
+        await asyncio.sleep(0.1)
+
+    mock_deduplication_cache_empty.eval.assert_any_call(
+        deduplication._EXTEND_CLAIM_SCRIPT,
+        1,
+        get_event_status_key("event-1"),
+        f"{EventProcessingStatus.IN_PROGRESS.value}:{claim.token}",
+        0.03,
+    )
+    extended = _scripts_run(mock_deduplication_cache_empty).count(
+        deduplication._EXTEND_CLAIM_SCRIPT
+    )
+    await asyncio.sleep(0.05)
+    # Not extended after the event is processed
+    assert (
+        _scripts_run(mock_deduplication_cache_empty).count(
+            deduplication._EXTEND_CLAIM_SCRIPT
+        )
+        == extended
+    )
+
+
+@pytest.mark.asyncio
+async def test_event_claim_is_promoted_when_processed(
+    mocker, mock_deduplication_cache_empty
+):
+    mocker.patch("app.core.deduplication._cache_db", mock_deduplication_cache_empty)
+    key = get_event_status_key("event-1")
+
+    async with EventClaim("event-1") as claim:
+        assert claim.acquired
+
+    # Only if the claim is still ours
+    mock_deduplication_cache_empty.eval.assert_called_with(
+        deduplication._COMPLETE_CLAIM_SCRIPT,
+        1,
+        key,
+        f"{EventProcessingStatus.IN_PROGRESS.value}:{claim.token}",
+        EventProcessingStatus.PROCESSED.value,
+        settings.EVENT_PROCESSING_STATUS_TTL,
+    )
+    assert not mock_deduplication_cache_empty.setex.called
+    assert not mock_deduplication_cache_empty.delete.called
+
+
+@pytest.mark.asyncio
+async def test_event_claim_is_released_when_processing_fails(
+    mocker, mock_deduplication_cache_empty
+):
+    mocker.patch("app.core.deduplication._cache_db", mock_deduplication_cache_empty)
+
+    with pytest.raises(ReferenceDataError):
+        async with EventClaim("event-1") as claim:
+            raise ReferenceDataError("Portal unavailable")
+
+    # Released, only if the claim is still ours, so the redelivery of the message is processed
+    mock_deduplication_cache_empty.eval.assert_called_with(
+        deduplication._RELEASE_CLAIM_SCRIPT,
+        1,
+        get_event_status_key("event-1"),
+        f"{EventProcessingStatus.IN_PROGRESS.value}:{claim.token}",
+    )
+    assert not mock_deduplication_cache_empty.delete.called
+
+
+@pytest.mark.asyncio
+async def test_expired_claim_taken_by_another_instance_is_left_alone(
+    mocker, mock_deduplication_cache_empty
+):
+    mocker.patch.object(settings, "EVENT_PROCESSING_CLAIM_TTL", 0.03)
+    mocker.patch("app.core.deduplication._cache_db", mock_deduplication_cache_empty)
+
+    async with EventClaim("event-1"):
+        # The claim expired and another instance took it: the scripts find another token
+        mock_deduplication_cache_empty.eval.side_effect = lambda *args: async_return(0)
+        await asyncio.sleep(0.1)
+
+    # It stops extending the claim of the other instance
+    assert (
+        _scripts_run(mock_deduplication_cache_empty).count(
+            deduplication._EXTEND_CLAIM_SCRIPT
+        )
+        == 1
+    )
+    # And the key is only changed through the scripts, which compare the token
+    assert not mock_deduplication_cache_empty.setex.called
+    assert not mock_deduplication_cache_empty.delete.called
+
+
+@pytest.mark.asyncio
+async def test_deliveries_are_recorded_per_destination(
+    mocker,
+    mock_cache,
+    mock_deduplication_cache_empty,
+    mock_gundi_client_v2,
+    mock_pubsub,
+    pubsub_request_headers,
+    event_v2_request_payload,
+    destination_integration_v2,
+):
+    mocker.patch("app.core.gundi._cache_db", mock_cache)
+    mocker.patch("app.core.deduplication._cache_db", mock_deduplication_cache_empty)
+    mocker.patch("app.core.gundi.portal_v2", mock_gundi_client_v2)
+    mocker.patch("app.core.pubsub.pubsub", mock_pubsub)
+    response = api_client.post(
+        "/",
+        headers=pubsub_request_headers,
+        json=event_v2_request_payload,
+    )
+    assert response.status_code == 200
+    data, attributes = extract_fields_from_message(event_v2_request_payload["message"])
+    # A field in the ledger of the event, written with its TTL in one round trip
+    key = get_deliveries_key(data["event_id"])
+    mock_deduplication_cache_empty.hset.assert_called_once_with(
+        key, str(destination_integration_v2.id), 1
+    )
+    mock_deduplication_cache_empty.expire.assert_called_once_with(
+        key, settings.DELIVERY_LEDGER_TTL
+    )
+    assert mock_deduplication_cache_empty.execute.call_count == 1
+    assert not mock_deduplication_cache_empty.setex.called
+
+
+@pytest.mark.asyncio
+async def test_retry_skips_destinations_already_delivered(
+    mocker,
+    mock_cache,
+    mock_deduplication_cache_empty,
+    mock_gundi_client_v2,
+    mock_pubsub,
+    pubsub_request_headers,
+    event_v2_request_payload,
+    destination_integration_v2,
+):
+    # The observation was delivered to the destination in a previous attempt
+    mock_deduplication_cache_empty.hmget.side_effect = None
+    mock_deduplication_cache_empty.hmget.return_value = async_return(["1"])
+    mocker.patch("app.core.gundi._cache_db", mock_cache)
+    mocker.patch("app.core.deduplication._cache_db", mock_deduplication_cache_empty)
+    mocker.patch("app.core.gundi.portal_v2", mock_gundi_client_v2)
+    mocker.patch("app.core.pubsub.pubsub", mock_pubsub)
+    response = api_client.post(
+        "/",
+        headers=pubsub_request_headers,
+        json=event_v2_request_payload,
+    )
+    assert response.status_code == 200
+    data, attributes = extract_fields_from_message(event_v2_request_payload["message"])
+    mock_deduplication_cache_empty.hmget.assert_called_once_with(
+        get_deliveries_key(data["event_id"]), [str(destination_integration_v2.id)]
+    )
+    # Not published again
+    assert not mock_pubsub.PublisherClient.return_value.publish.called
+
+
+@pytest.mark.asyncio
+async def test_too_old_message_is_discarded_before_deduplication(
+    mocker,
+    mock_deduplication_cache_empty,
+    mock_pubsub,
+    pubsub_request_headers,
+    event_v2_request_payload,
+):
+    mocker.patch("app.services.process_messages.is_too_old", return_value=True)
+    mocker.patch("app.core.deduplication._cache_db", mock_deduplication_cache_empty)
+    mocker.patch("app.core.pubsub.pubsub", mock_pubsub)
+    response = api_client.post(
+        "/",
+        headers=pubsub_request_headers,
+        json=event_v2_request_payload,
+    )
+    assert response.status_code == 200
+    assert response.json()["status"] == "discarded"
+    # No round trip to Redis
+    assert not mock_deduplication_cache_empty.eval.called
@@ -0,0 +1,322 @@
+import asyncio
+
+import aiohttp
+import pytest
+from prometheus_client import REGISTRY
+
+from app.core import pubsub as pubsub_module
+from app.core import settings
+from app.core.pubsub import (
+    BatchPublisher,
+    DeadLetterSpooler,
+    PublisherManager,
+    send_message_to_gcp_pubsub_dispatcher,
+    send_observation_to_dead_letter_topic,
+)
+
+
+@pytest.mark.asyncio
+async def test_running_publisher_reuses_one_client(
+    mocker, mock_pubsub, destination_integration_v2
+):
+    mocker.patch("app.core.pubsub.pubsub", mock_pubsub)
+    manager = PublisherManager(
+        pool_size=10, pool_size_per_host=5, keepalive_timeout=30.0
+    )
+    mocker.patch.object(pubsub_module, "publisher", manager)
+    await manager.start()
+    for _ in range(3):
+        await send_message_to_gcp_pubsub_dispatcher(
+            message=b"{}",
+            attributes={},
+            destination=destination_integration_v2,
+            broker_config=destination_integration_v2.additional,
+        )
+    await send_observation_to_dead_letter_topic({"foo": "bar"}, {})
+    session = mock_pubsub.PublisherClient.call_args.kwargs["session"]
+    await manager.close()
+
+    # One client (and one session) created at startup, shared by every publish
+    assert mock_pubsub.PublisherClient.call_count == 1
+    mocked_publish = mock_pubsub.PublisherClient.return_value.publish
+    assert mocked_publish.call_count == 4
+    # A stalled connection can't hang a handler
+    assert session.timeout.total == manager.timeout
+    assert all(call.kwargs.get("timeout") for call in mocked_publish.call_args_list)
+
+
+@pytest.mark.asyncio
+async def test_publisher_falls_back_to_short_lived_session_when_not_started(
+    mocker, mock_pubsub, destination_integration_v2
+):
+    mocker.patch("app.core.pubsub.pubsub", mock_pubsub)
+    manager = PublisherManager(
+        pool_size=10, pool_size_per_host=5, keepalive_timeout=30.0
+    )
+    mocker.patch.object(pubsub_module, "publisher", manager)
+    assert not manager.is_running
+
+    await send_message_to_gcp_pubsub_dispatcher(
+        message=b"{}",
+        attributes={},
+        destination=destination_integration_v2,
+        broker_config=destination_integration_v2.additional,
+    )
+    await send_message_to_gcp_pubsub_dispatcher(
+        message=b"{}",
+        attributes={},
+        destination=destination_integration_v2,
+        broker_config=destination_integration_v2.additional,
+    )
+
+    assert mock_pubsub.PublisherClient.call_count == 2
+
+
+@pytest.mark.asyncio
+async def test_publisher_close_is_idempotent():
+    manager = PublisherManager(
+        pool_size=10, pool_size_per_host=5, keepalive_timeout=30.0
+    )
+    await manager.start()
+    assert manager.is_running
+    await manager.close()
+    await manager.close()
+    assert not manager.is_running
+
+
+@pytest.mark.asyncio
+async def test_batch_publisher_flushes_on_max_messages(mocker, mock_pubsub):
+    mocker.patch("app.core.pubsub.pubsub", mock_pubsub)
+    batcher = BatchPublisher(
+        max_messages=3, max_bytes=1024, linger_seconds=10.0, timeout=5.0
+    )
+    await batcher.start()
+
+    responses = await asyncio.gather(
+        *[batcher.publish("test-topic", f"message-{i}", size=10) for i in range(3)]
+    )
+
+    # Three messages reached the size limit so they were sent in one call, without waiting for the linger time
+    mocked_publish = mock_pubsub.PublisherClient.return_value.publish
+    assert mocked_publish.call_count == 1
+    assert len(mocked_publish.call_args.args[1]) == 3
+    assert len(responses) == 3
+
+
+@pytest.mark.asyncio
+async def test_batch_publisher_flushes_after_linger_time(mocker, mock_pubsub):
+    mocker.patch("app.core.pubsub.pubsub", mock_pubsub)
+    batcher = BatchPublisher(
+        max_messages=100, max_bytes=1024, linger_seconds=0.01, timeout=5.0
+    )
+    await batcher.start()
+
+    await asyncio.gather(
+        batcher.publish("test-topic", "message-1", size=10),
+        batcher.publish("test-topic", "message-2", size=10),
+    )
+
+    mocked_publish = mock_pubsub.PublisherClient.return_value.publish
+    assert mocked_publish.call_count == 1
+    assert mocked_publish.call_args.args[1] == ["message-1", "message-2"]
+
+
+@pytest.mark.asyncio
+async def test_batch_publisher_propagates_errors_to_every_caller(
+    mocker, mock_pubsub_client_with_timeout_once
+):
+    mocker.patch("app.core.pubsub.pubsub", mock_pubsub_client_with_timeout_once)
+    batcher = BatchPublisher(
+        max_messages=2, max_bytes=1024, linger_seconds=10.0, timeout=5.0
+    )
+    await batcher.start()
+
+    results = await asyncio.gather(
+        batcher.publish("test-topic", "message-1", size=10),
+        batcher.publish("test-topic", "message-2", size=10),
+        return_exceptions=True,
+    )
+
+    assert all(isinstance(r, asyncio.TimeoutError) for r in results)
+
+
+@pytest.mark.asyncio
+async def test_batch_publisher_flushes_pending_messages_on_close(mocker, mock_pubsub):
+    mocker.patch("app.core.pubsub.pubsub", mock_pubsub)
+    batcher = BatchPublisher(
+        max_messages=100, max_bytes=1024, linger_seconds=60.0, timeout=5.0
+    )
+    await batcher.start()
+    pending = asyncio.ensure_future(batcher.publish("test-topic", "message-1"))
+    await asyncio.sleep(0)
+
+    await batcher.close()
+
+    assert pending.done()
+    assert mock_pubsub.PublisherClient.return_value.publish.call_count == 1
+
+
+def _sample(name, **labels):
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+
+async def _wait_until(condition, timeout=2.0):
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while not condition():
+        assert loop.time() < deadline, "Timed out"
+        await asyncio.sleep(0.01)
+
+
+def _dead_letter_spooler(tmp_path, **kwargs):
+    return DeadLetterSpooler(
+        **{
+            "max_queued": 100,
+            "max_messages": 10,
+            "linger_seconds": 0.01,
+            "timeout": 1.0,
+            "spool_path": str(tmp_path / "dead_letters.jsonl"),
+            "replay_interval": 60.0,
+            **kwargs,
+        }
+    )
+
+
+@pytest.mark.asyncio
+async def test_dead_letters_are_published_in_background_batches(
+    mocker, mock_pubsub, tmp_path
+):
+    mocker.patch("app.core.pubsub.pubsub", mock_pubsub)
+    spooler = _dead_letter_spooler(tmp_path)
+    mocker.patch.object(pubsub_module, "dead_letter_spooler", spooler)
+    await spooler.start()
+
+    for i in range(3):
+        await send_observation_to_dead_letter_topic(
+            {"foo": i}, {"gundi_version": "v2"}, reason="too_old"
+        )
+    # The handlers don't wait for the publish
+    assert not mock_pubsub.PublisherClient.return_value.publish.called
+    await asyncio.sleep(0.05)
+    await spooler.close()
+
+    mocked_publish = mock_pubsub.PublisherClient.return_value.publish
+    assert mocked_publish.call_count == 1
+    topic, messages = mocked_publish.call_args.args
+    assert len(messages) == 3
+    mock_pubsub.PublisherClient.return_value.topic_path.assert_called_with(
+        settings.GCP_PROJECT_ID, settings.DEAD_LETTER_TOPIC
+    )
+    assert mock_pubsub.PubsubMessage.call_args.kwargs == {
+        "gundi_version": "v2",
+        "dead_letter_reason": "too_old",
+    }
+    assert spooler.stats() == {"queued": 0, "published": 3, "spooled": 0}
+
+
+@pytest.mark.asyncio
+async def test_dead_letters_are_spooled_and_replayed_on_next_start(
+    mocker, mock_pubsub, tmp_path
+):
+    mocker.patch("app.core.pubsub.pubsub", mock_pubsub)
+    mocked_publish = mock_pubsub.PublisherClient.return_value.publish
+    mocked_publish.side_effect = aiohttp.ClientError("PubSub unavailable")
+    spooler = _dead_letter_spooler(tmp_path)
+    await spooler.start()
+
+    spooler.enqueue(b'{"foo": "bar"}', {"dead_letter_reason": "duplicate"})
+    await asyncio.sleep(0.05)
+    await spooler.close()
+
+    assert spooler.stats()["spooled"] == 1
+    assert (tmp_path / "dead_letters.jsonl").exists()
+
+    # PubSub is back on the next start
+    mocked_publish.side_effect = None
+    spooler = _dead_letter_spooler(tmp_path)
+    await spooler.start()
+    await asyncio.sleep(0.05)
+    await spooler.close()
+
+    assert spooler.stats()["published"] == 1
+    assert mock_pubsub.PubsubMessage.call_args.args == (b'{"foo": "bar"}',)
+    assert not (tmp_path / "dead_letters.jsonl").exists()
+
+
+@pytest.mark.asyncio
+async def test_dead_letters_are_spooled_when_the_queue_is_full(
+    mocker, mock_pubsub, tmp_path
+):
+    mocker.patch("app.core.pubsub.pubsub", mock_pubsub)
+    spooler = _dead_letter_spooler(tmp_path, max_queued=1)
+    await spooler.start()
+
+    spooler.enqueue(b"1", {})
+    spooler.enqueue(b"2", {})
+
+    assert spooler.stats()["queued"] == 1
+    await spooler.close()  # The file is written in the background
+    assert spooler.stats() == {"queued": 0, "published": 1, "spooled": 1}
+
+
+@pytest.mark.asyncio
+async def test_spooled_dead_letters_are_replayed_while_running(
+    mocker, mock_pubsub, tmp_path
+):
+    mocker.patch("app.core.pubsub.pubsub", mock_pubsub)
+    mocked_publish = mock_pubsub.PublisherClient.return_value.publish
+    mocked_publish.side_effect = aiohttp.ClientError("PubSub unavailable")
+    spooler = _dead_letter_spooler(tmp_path, replay_interval=0.05)
+    await spooler.start()
+
+    spooler.enqueue(b'{"foo": "bar"}', {"dead_letter_reason": "duplicate"})
+    await _wait_until(lambda: spooler.stats()["spooled"] == 1)
+
+    # PubSub is back, the spool file is replayed without a restart
+    mocked_publish.side_effect = None
+    await _wait_until(lambda: spooler.stats()["published"] == 1)
+
+    assert not (tmp_path / "dead_letters.jsonl").exists()
+    await spooler.close()
+
+
+@pytest.mark.asyncio
+async def test_dead_letter_spooler_requires_a_spool_path(tmp_path):
+    spooler = _dead_letter_spooler(tmp_path, spool_path=None)
+
+    with pytest.raises(ValueError):
+        await spooler.start()
+    assert not spooler.is_running
+
+
+@pytest.mark.asyncio
+async def test_dead_letters_are_counted_once_published_or_spooled(
+    mocker, mock_pubsub, tmp_path
+):
+    mocker.patch("app.core.pubsub.pubsub", mock_pubsub)
+    mocked_publish = mock_pubsub.PublisherClient.return_value.publish
+    mocked_publish.side_effect = aiohttp.ClientError("PubSub unavailable")
+    spooler = _dead_letter_spooler(tmp_path, replay_interval=0.05)
+    mocker.patch.object(pubsub_module, "dead_letter_spooler", spooler)
+    published = _sample("routing_dead_lettered_messages_total", reason="too_old")
+    spooled = _sample("routing_dead_letters_spooled_total", reason="too_old")
+    await spooler.start()
+
+    await send_observation_to_dead_letter_topic({"foo": "bar"}, {}, reason="too_old")
+    await _wait_until(lambda: spooler.stats()["spooled"] == 1)
+
+    # Not counted as sent to the dead letter topic until it's published
+    assert _sample("routing_dead_letters_spooled_total", reason="too_old") == (
+        spooled + 1
+    )
+    assert (
+        _sample("routing_dead_lettered_messages_total", reason="too_old") == published
+    )
+
+    mocked_publish.side_effect = None
+    await _wait_until(lambda: spooler.stats()["published"] == 1)
+    await spooler.close()
+
+    assert _sample("routing_dead_lettered_messages_total", reason="too_old") == (
+        published + 1
+    )
@@ -0,0 +1,266 @@
+import asyncio
+import json
+import os
+import time
+from datetime import datetime, timezone
+from unittest.mock import MagicMock
+
+import pytest
+from gcloud.aio.pubsub import SubscriberMessage
+
+from app.conftest import async_return
+from app.core import settings
+from app.subscribers import pull_worker
+from app.subscribers.pull_worker import PullWorker
+
+
+def _build_worker(process, **kwargs):
+    config = dict(
+        subscription="projects/test/subscriptions/routing-test",
+        max_outstanding_messages=10,
+        max_outstanding_bytes=1024 * 1024,
+        num_producers=1,
+        max_messages_per_producer=10,
+        ack_window=0.1,
+        ack_deadline_seconds=10,
+    )
+    config.update(kwargs)
+    worker = PullWorker(process=process, **config)
+    worker.subscriber_client = MagicMock()
+    worker.subscriber_client.modify_ack_deadline.return_value = async_return(None)
+    return worker
+
+
+@pytest.fixture
+def non_utc_host(monkeypatch):
+    monkeypatch.setenv("TZ", "America/New_York")
+    time.tzset()
+    yield
+    monkeypatch.undo()
+    time.tzset()
+
+
+def _build_message(payload, attributes):
+    return SubscriberMessage(
+        ack_id="test-ack-id",
+        message_id="2514321",
+        # Parsed by gcloud-aio as a naive UTC datetime
+        publish_time=datetime(2023, 7, 11, 18, 19, 19, 215000),
+        data=json.dumps(payload).encode("utf-8"),
+        attributes=attributes,
+    )
+
+
+@pytest.mark.asyncio
+async def test_pull_worker_dispatches_decoded_message(
+    mocker, raw_observation_v2, raw_observation_v2_attributes
+):
+    process = mocker.MagicMock(return_value=async_return({"status": "processed"}))
+    worker = _build_worker(process)
+
+    result = await worker.handle_message(
+        _build_message(raw_observation_v2, raw_observation_v2_attributes)
+    )
+
+    assert result == {"status": "processed"}
+    message = process.call_args.args[0]
+    assert message.payload == raw_observation_v2
+    assert message.attributes == raw_observation_v2_attributes
+    assert message.pubsub_message_id == "2514321"
+    assert message.timestamp == "2023-07-11T18:19:19.215000Z"
+    assert worker.flow_control.outstanding_bytes == 0
+
+
+@pytest.mark.asyncio
+async def test_pull_worker_raises_on_error_so_the_message_is_nacked(
+    mocker, raw_observation_v2, raw_observation_v2_attributes
+):
+    process = mocker.MagicMock(side_effect=Exception("Unexpected error"))
+    worker = _build_worker(process)
+
+    with pytest.raises(Exception):
+        await worker.handle_message(
+            _build_message(raw_observation_v2, raw_observation_v2_attributes)
+        )
+
+    # The byte budget is released even if processing fails
+    assert worker.flow_control.outstanding_bytes == 0
+
+
+@pytest.mark.asyncio
+async def test_pull_worker_extends_the_lease_of_slow_messages(
+    mocker, raw_observation_v2, raw_observation_v2_attributes
+):
+    async def slow_process(message):
+        await asyncio.sleep(2.5)
+        return {"status": "processed"}
+
+    worker = _build_worker(slow_process, ack_deadline_seconds=2)
+
+    await worker.handle_message(
+        _build_message(raw_observation_v2, raw_observation_v2_attributes)
+    )
+
+    worker.subscriber_client.modify_ack_deadline.assert_called_with(
+        "projects/test/subscriptions/routing-test",
+        ["test-ack-id"],
+        ack_deadline_seconds=2,
+    )
+    # Right away, then every half deadline
+    assert worker.subscriber_client.modify_ack_deadline.call_count == 3
+
+
+@pytest.mark.asyncio
+async def test_pull_worker_extends_the_lease_when_the_message_arrives(
+    mocker, raw_observation_v2, raw_observation_v2_attributes
+):
+    async def process(message):
+        await asyncio.sleep(0.01)
+        return {"status": "processed"}
+
+    worker = _build_worker(process, ack_deadline_seconds=60)
+
+    await worker.handle_message(
+        _build_message(raw_observation_v2, raw_observation_v2_attributes)
+    )
+
+    # The subscription's deadline may be shorter than half of ours
+    worker.subscriber_client.modify_ack_deadline.assert_called_once_with(
+        "projects/test/subscriptions/routing-test",
+        ["test-ack-id"],
+        ack_deadline_seconds=60,
+    )
+
+
+@pytest.mark.parametrize(
+    "publish_time",
+    [
+        datetime(2023, 7, 11, 12, 0, 0),
+        datetime(2023, 7, 11, 12, 0, 0, tzinfo=timezone.utc),
+    ],
+)
+def test_publish_time_is_formatted_as_utc_on_any_host(non_utc_host, publish_time):
+    formatted = pull_worker.format_publish_time(publish_time)
+
+    assert formatted == "2023-07-11T12:00:00.000000Z"
+
+
+@pytest.mark.asyncio
+async def test_pull_worker_splits_the_outstanding_messages_across_producers(mocker):
+    subscribe = mocker.patch(
+        "app.subscribers.pull_worker.pubsub.subscribe",
+        return_value=async_return(None),
+    )
+    mocker.patch("app.subscribers.pull_worker.pubsub.SubscriberClient")
+    worker = _build_worker(None, max_outstanding_messages=50, num_producers=2)
+
+    await worker.run()
+
+    assert subscribe.call_args.kwargs["num_tasks_per_consumer"] == 25
+
+
+@pytest.mark.asyncio
+async def test_pull_worker_limits_outstanding_bytes(
+    raw_observation_v2, raw_observation_v2_attributes
+):
+    message = _build_message(raw_observation_v2, raw_observation_v2_attributes)
+    in_progress = 0
+    max_in_progress = 0
+
+    async def process(message):
+        nonlocal in_progress, max_in_progress
+        in_progress += 1
+        max_in_progress = max(max_in_progress, in_progress)
+        await asyncio.sleep(0.01)
+        in_progress -= 1
+        return {"status": "processed"}
+
+    # Room for two messages at a time
+    worker = _build_worker(process, max_outstanding_bytes=len(message.data) * 2)
+
+    await asyncio.gather(*[worker.handle_message(message) for _ in range(6)])
+
+    assert max_in_progress == 2
+
+
+@pytest.mark.asyncio
+async def test_pull_worker_runs_the_same_background_services_as_the_push_endpoint(
+    mocker,
+):
+    mocker.patch.object(settings, "DEAD_LETTER_SPOOLER_ENABLED", True)
+    mocker.patch.object(settings, "ACTIVITY_LOG_EMITTER_ENABLED", True)
+    components = {
+        name: mocker.patch(f"app.services.lifecycle.{name}")
+        for name in (
+            "publisher",
+            "dead_letter_spooler",
+            "activity_log_emitter",
+            "smart_datamodels",
+        )
+    }
+    for component in components.values():
+        component.start.return_value = async_return(None)
+        component.close.return_value = async_return(None)
+    mocker.patch("app.services.lifecycle.warm_up_destinations")
+    mocker.patch("app.services.lifecycle.asyncio.ensure_future")
+    worker = MagicMock()
+    worker.run.return_value = async_return(None)
+    mocker.patch("app.subscribers.pull_worker.build_worker", return_value=worker)
+
+    await pull_worker.main()
+
+    assert worker.run.called
+    for component in components.values():
+        assert component.start.called
+        assert component.close.called
+
+
+@pytest.mark.skipif(
+    not os.environ.get("PUBSUB_EMULATOR_HOST"),
+    reason="Requires the PubSub emulator (set PUBSUB_EMULATOR_HOST)",
+)
+@pytest.mark.asyncio
+async def test_pull_worker_against_emulator(
+    raw_observation_v2, raw_observation_v2_attributes
+):
+    import aiohttp
+    from gcloud.aio import pubsub
+
+    project = "test-project"
+    topic = f"projects/{project}/topics/routing-pull-test"
+    subscription = f"projects/{project}/subscriptions/routing-pull-test"
+    received = asyncio.Queue()
+
+    async def process(message):
+        await received.put(message)
+        return {"status": "processed"}
+
+    async with aiohttp.ClientSession() as session:
+        publisher = pubsub.PublisherClient(session=session)
+        subscriber = pubsub.SubscriberClient(session=session)
+        try:
+            await publisher.create_topic(topic)
+        except aiohttp.ClientResponseError:
+            pass  # Already exists
+        try:
+            await subscriber.create_subscription(subscription, topic)
+        except aiohttp.ClientResponseError:
+            pass
+        await publisher.publish(
+            topic,
+            [
+                pubsub.PubsubMessage(
+                    json.dumps(raw_observation_v2), **raw_observation_v2_attributes
+                )
+            ],
+        )
+
+        worker = _build_worker(process, subscription=subscription)
+        task = asyncio.ensure_future(worker.run())
+        try:
+            message = await asyncio.wait_for(received.get(), timeout=30)
+        finally:
+            task.cancel()
+
+    assert message.payload == raw_observation_v2
+    assert message.attributes == raw_observation_v2_attributes
@@ -0,0 +1,109 @@
+import asyncio
+
+import pytest
+
+from gundi_core import schemas
+
+from app.conftest import async_return
+from app.core.gundi import resolve_routing
+
+
+@pytest.mark.asyncio
+async def test_resolve_routing_reads_route_and_integrations_in_one_round_trip(
+    mocker,
+    mock_cache_with_cached_connection,
+    mock_gundi_client_v2,
+    connection_v2,
+    route_v2,
+    destination_integration_v2,
+):
+    mock_cache_with_cached_connection.mget.return_value = async_return(
+        [route_v2.json(), destination_integration_v2.json()]
+    )
+    mocker.patch("app.core.gundi._cache_db", mock_cache_with_cached_connection)
+    mocker.patch("app.core.gundi.portal_v2", mock_gundi_client_v2)
+
+    routing = await resolve_routing(data_provider_id=str(connection_v2.id))
+
+    assert routing.connection == connection_v2
+    assert routing.route == route_v2
+    destination_id = connection_v2.destinations[0].id
+    assert routing.get_integration(destination_id) == (
+        schemas.v2.Integration.parse_raw(destination_integration_v2.json())
+    )
+    mock_cache_with_cached_connection.mget.assert_called_once_with(
+        [
+            f"route_detail.{connection_v2.default_route.id}",
+            f"integration_v2_detail.{destination_id}",
+        ]
+    )
+    assert not mock_gundi_client_v2.get_route_details.called
+    assert not mock_gundi_client_v2.get_integration_details.called
+
+
+@pytest.mark.asyncio
+async def test_resolve_routing_retrieves_cache_misses_concurrently(
+    mocker, mock_cache, connection_v2, route_v2, destination_integration_v2
+):
+    mocker.patch("app.core.gundi._cache_db", mock_cache)
+    in_progress = 0
+    max_in_progress = 0
+
+    def slow_lookup(result):
+        async def lookup(**kwargs):
+            nonlocal in_progress, max_in_progress
+            in_progress += 1
+            max_in_progress = max(max_in_progress, in_progress)
+            await asyncio.sleep(0.05)
+            in_progress -= 1
+            return result
+
+        return lookup
+
+    portal = mocker.MagicMock()
+    portal.get_connection_details.return_value = async_return(connection_v2)
+    portal.get_route_details.side_effect = slow_lookup(route_v2)
+    portal.get_integration_details.side_effect = slow_lookup(destination_integration_v2)
+    mocker.patch("app.core.gundi.portal_v2", portal)
+
+    routing = await resolve_routing(data_provider_id=str(connection_v2.id))
+
+    assert routing.route == route_v2
+    assert routing.get_integration(connection_v2.destinations[0].id) == (
+        destination_integration_v2
+    )
+    assert max_in_progress == 2
+    assert mock_cache.mget.call_count == 1
+
+
+@pytest.mark.asyncio
+async def test_resolve_routing_uses_local_cache_on_next_messages(
+    mocker, mock_cache, mock_gundi_client_v2, connection_v2, route_v2
+):
+    mocker.patch("app.core.gundi._cache_db", mock_cache)
+    mocker.patch("app.core.gundi.portal_v2", mock_gundi_client_v2)
+
+    await resolve_routing(data_provider_id=str(connection_v2.id))
+    routing = await resolve_routing(data_provider_id=str(connection_v2.id))
+
+    assert routing.route == route_v2
+    assert mock_cache.mget.call_count == 1
+    assert mock_gundi_client_v2.get_route_details.call_count == 1
+    assert mock_gundi_client_v2.get_integration_details.call_count == 1
+
+
+@pytest.mark.asyncio
+async def test_resolve_routing_without_connection(mocker, mock_cache, connection_v2):
+    mocker.patch("app.core.gundi._cache_db", mock_cache)
+    portal = mocker.MagicMock()
+    portal.get_connection_details.side_effect = Exception("Not found")
+    mocker.patch("app.core.gundi.portal_v2", portal)
+    mocker.patch(
+        "app.core.gundi.log_portal_lookup_error", return_value=async_return(None)
+    )
+
+    routing = await resolve_routing(data_provider_id=str(connection_v2.id))
+
+    assert routing.connection is None
+    assert routing.route is None
+    assert not mock_cache.mget.called
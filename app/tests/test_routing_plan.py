@@ -0,0 +1,173 @@
+import copy
+
+import pytest
+
+from app.core.gundi import ResolvedRouting
+from app.services.routing_plan import get_routing_plan
+from app.services.transformers import (
+    ERObservationTransformer,
+    FieldMappingRule,
+    build_field_mapping_rules,
+)
+
+
+def _build_routing(connection, route, integration):
+    return ResolvedRouting(
+        connection=connection,
+        route=route,
+        integrations={str(integration.id): integration},
+    )
+
+
+def test_routing_plan_is_compiled_once(
+    connection_v2, route_v2, destination_integration_v2
+):
+    routing = _build_routing(connection_v2, route_v2, destination_integration_v2)
+
+    plan = get_routing_plan(data_provider_id=connection_v2.id, routing=routing)
+
+    assert get_routing_plan(data_provider_id=connection_v2.id, routing=routing) is plan
+    destination_plan = plan.destinations[0]
+    assert destination_plan.integration == destination_integration_v2
+    assert destination_plan.topic_name == destination_integration_v2.additional["topic"]
+    assert not destination_plan.uses_generic_model
+    assert destination_plan.attributes_template["destination_id"] == str(
+        destination_integration_v2.id
+    )
+
+
+def test_routing_plan_is_kept_when_reference_data_is_parsed_again(
+    connection_v2, route_v2, destination_integration_v2
+):
+    routing = _build_routing(connection_v2, route_v2, destination_integration_v2)
+    plan = get_routing_plan(data_provider_id=connection_v2.id, routing=routing)
+
+    # Same content, new objects (e.g. read from Redis again)
+    same_routing = _build_routing(
+        copy.deepcopy(connection_v2),
+        copy.deepcopy(route_v2),
+        copy.deepcopy(destination_integration_v2),
+    )
+    assert (
+        get_routing_plan(data_provider_id=connection_v2.id, routing=same_routing)
+        is plan
+    )
+
+
+def test_routing_plan_is_rebuilt_when_an_integration_changes(
+    connection_v2, route_v2, destination_integration_v2
+):
+    routing = _build_routing(connection_v2, route_v2, destination_integration_v2)
+    plan = get_routing_plan(data_provider_id=connection_v2.id, routing=routing)
+
+    updated_integration = copy.deepcopy(destination_integration_v2)
+    updated_integration.additional = {
+        **updated_integration.additional,
+        "topic": "updated-topic",
+    }
+    new_plan = get_routing_plan(
+        data_provider_id=connection_v2.id,
+        routing=_build_routing(connection_v2, route_v2, updated_integration),
+    )
+
+    assert new_plan is not plan
+    assert new_plan.version != plan.version
+    assert new_plan.destinations[0].topic_name == "updated-topic"
+
+
+def test_routing_plan_reuses_transformers_and_rules(
+    connection_v2,
+    route_v2_with_provider_key_field_mapping,
+    destination_integration_v2,
+):
+    routing = _build_routing(
+        connection_v2,
+        route_v2_with_provider_key_field_mapping,
+        destination_integration_v2,
+    )
+    destination_plan = get_routing_plan(
+        data_provider_id=connection_v2.provider.id, routing=routing
+    ).destinations[0]
+
+    transformer = destination_plan.get_transformer("obv")
+    rules = destination_plan.get_rules("obv")
+
+    assert isinstance(transformer, ERObservationTransformer)
+    assert destination_plan.get_transformer("obv") is transformer
+    assert len(rules) == 1
+    assert rules[0].target == "provider_key"
+    assert destination_plan.get_rules("obv") is rules
+
+
+def test_field_mapping_rules_are_compiled_once_per_route_version(
+    connection_v2, route_v2_with_provider_key_field_mapping
+):
+    route = route_v2_with_provider_key_field_mapping
+    kwargs = dict(
+        data_provider_id=connection_v2.provider.id,
+        stream_type="obv",
+        destination_id=connection_v2.destinations[0].id,
+    )
+
+    rules = build_field_mapping_rules(route_configuration=route.configuration, **kwargs)
+    assert (
+        build_field_mapping_rules(
+            route_configuration=copy.deepcopy(route.configuration), **kwargs
+        )
+        is rules
+    )
+
+    updated_configuration = copy.deepcopy(route.configuration)
+    mapping = updated_configuration.data["field_mappings"][
+        str(connection_v2.provider.id)
+    ]["obv"][str(connection_v2.destinations[0].id)]
+    mapping["default"] = "updated-collars"
+    updated_rules = build_field_mapping_rules(
+        route_configuration=updated_configuration, **kwargs
+    )
+    assert updated_rules is not rules
+    assert updated_rules[0].default == "updated-collars"
+
+
+def test_field_mapping_supports_many_rules_per_destination(
+    connection_v2, route_v2_with_provider_key_field_mapping
+):
+    configuration = copy.deepcopy(
+        route_v2_with_provider_key_field_mapping.configuration
+    )
+    configuration.data["field_mappings"][str(connection_v2.provider.id)]["ev"] = {
+        str(connection_v2.destinations[0].id): [
+            {
+                "provider_field": "event_details__species",
+                "destination_field": "event_type",
+                "map": {"leopard": "leopard_sighting"},
+                "default": "wildlife_sighting",
+            },
+            {"destination_field": "priority", "default": 300},
+        ]
+    }
+
+    rules = build_field_mapping_rules(
+        route_configuration=configuration,
+        data_provider_id=connection_v2.provider.id,
+        stream_type="ev",
+        destination_id=connection_v2.destinations[0].id,
+    )
+    message = {"event_details": {"species": "leopard"}}
+    for rule in rules:
+        rule.apply(message=message)
+
+    assert len(rules) == 2
+    assert message["event_type"] == "leopard_sighting"
+    assert message["priority"] == 300
+
+
+def test_field_mapping_rule_reads_nested_fields():
+    rule = FieldMappingRule(
+        source=" Event_Details__Species ", target="event_type", default="other"
+    )
+    message = {"event_details": {"species": "lion"}}
+
+    rule.apply(message=message)
+
+    assert message["event_type"] == "lion"
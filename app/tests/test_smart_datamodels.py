@@ -0,0 +1,178 @@
+import asyncio
+import json
+import time
+
+import pytest
+
+from smartconnect.models import DataModel
+
+from app.conftest import async_return
+from app.core import settings
+from app.services.smart_datamodels import (
+    SmartModelIndex,
+    get_datamodel_key,
+    smart_datamodels,
+)
+
+
+SMART_ENDPOINT = "https://smart.example.org/server"
+
+
+def _cached_datamodel(datamodel, fetched_at):
+    return json.dumps({"model": datamodel.export_as_dict(), "fetched_at": fetched_at})
+
+
+@pytest.mark.asyncio
+async def test_datamodel_is_read_from_the_shared_cache(
+    mocker, mock_cache, mock_smart_async_client, smart_ca_uuid, smart_ca_data_model
+):
+    mock_cache.get.return_value = async_return(
+        _cached_datamodel(smart_ca_data_model, time.time())
+    )
+    mocker.patch("app.services.smart_datamodels._cache_db", mock_cache)
+
+    datamodel = await smart_datamodels.get_data_model(
+        mock_smart_async_client, endpoint=SMART_ENDPOINT, ca_uuid=smart_ca_uuid
+    )
+
+    assert datamodel.export_as_dict() == smart_ca_data_model.export_as_dict()
+    mock_cache.get.assert_called_once_with(
+        get_datamodel_key(SMART_ENDPOINT, smart_ca_uuid)
+    )
+    assert not mock_smart_async_client.get_data_model.called
+    # Next reads are served in-process
+    assert (
+        await smart_datamodels.get_data_model(
+            mock_smart_async_client, endpoint=SMART_ENDPOINT, ca_uuid=smart_ca_uuid
+        )
+        is datamodel
+    )
+    assert mock_cache.get.call_count == 1
+
+
+@pytest.mark.asyncio
+async def test_datamodel_is_downloaded_once_and_shared(
+    mocker, mock_cache, mock_smart_async_client, smart_ca_uuid
+):
+    mocker.patch("app.services.smart_datamodels._cache_db", mock_cache)
+
+    await asyncio.gather(
+        *[
+            smart_datamodels.get_data_model(
+                mock_smart_async_client, endpoint=SMART_ENDPOINT, ca_uuid=smart_ca_uuid
+            )
+            for _ in range(3)
+        ]
+    )
+
+    mock_smart_async_client.get_data_model.assert_called_once_with(
+        ca_uuid=smart_ca_uuid
+    )
+    key, ttl, _ = mock_cache.setex.call_args.args
+    assert key == get_datamodel_key(SMART_ENDPOINT, smart_ca_uuid)
+    assert ttl == settings.SMART_DATAMODEL_CACHE_TTL
+
+
+@pytest.mark.asyncio
+async def test_stale_datamodel_is_used_while_refreshed_in_background(
+    mocker, mock_cache, mock_smart_async_client, smart_ca_uuid, smart_ca_data_model
+):
+    stale_since = time.time() - settings.SMART_DATAMODEL_REFRESH_SECONDS - 60
+    mock_cache.get.return_value = async_return(
+        _cached_datamodel(smart_ca_data_model, stale_since)
+    )
+    mocker.patch("app.services.smart_datamodels._cache_db", mock_cache)
+
+    datamodel = await smart_datamodels.get_data_model(
+        mock_smart_async_client, endpoint=SMART_ENDPOINT, ca_uuid=smart_ca_uuid
+    )
+    await asyncio.sleep(0.01)  # Let the refresh run
+
+    assert datamodel.export_as_dict() == smart_ca_data_model.export_as_dict()
+    mock_smart_async_client.get_data_model.assert_called_once_with(
+        ca_uuid=smart_ca_uuid
+    )
+    assert mock_cache.setex.called
+
+
+@pytest.mark.asyncio
+async def test_stale_datamodel_is_kept_when_smart_is_down(
+    mocker, mock_cache, mock_smart_async_client, smart_ca_uuid, smart_ca_data_model
+):
+    stale_since = time.time() - settings.SMART_DATAMODEL_REFRESH_SECONDS - 60
+    mock_cache.get.return_value = async_return(
+        _cached_datamodel(smart_ca_data_model, stale_since)
+    )
+    mocker.patch("app.services.smart_datamodels._cache_db", mock_cache)
+    mock_smart_async_client.get_data_model.side_effect = Exception("Timeout")
+
+    await smart_datamodels.get_data_model(
+        mock_smart_async_client, endpoint=SMART_ENDPOINT, ca_uuid=smart_ca_uuid
+    )
+    await asyncio.sleep(0.01)
+    datamodel = await smart_datamodels.get_data_model(
+        mock_smart_async_client, endpoint=SMART_ENDPOINT, ca_uuid=smart_ca_uuid
+    )
+
+    assert datamodel.export_as_dict() == smart_ca_data_model.export_as_dict()
+    assert mock_smart_async_client.get_data_model.called
+    assert not mock_cache.setex.called
+
+
+def test_model_index_resolves_like_the_data_model(
+    smart_ca_data_model, smart_transformation_rules
+):
+    index = SmartModelIndex(
+        ca_datamodel=smart_ca_data_model,
+        configurable_models=[],
+        transformation_rules=smart_transformation_rules,
+    )
+
+    assert index.get_category("humanactivity.people") == (
+        smart_ca_data_model.get_category(path="humanactivity.people")
+    )
+    assert index.get_attribute("wildlifestate") == (
+        smart_ca_data_model.get_attribute(key="wildlifestate")
+    )
+    assert index.get_category_rule("poacher_camp") == "humanactivity.people"
+    assert index.resolve_attribute("wildlifestate", "x") == ("wildlifestate", "x")
+    assert index.resolve_attribute("camp_state", "active") == ("wildlifestate", "alive")
+    assert index.resolve_attribute("camp_state", "gone") == ("wildlifestate", "unknown")
+    assert index.resolve_attribute("camp_state", ["active"]) == (
+        "wildlifestate",
+        "unknown",
+    )
+    assert index.resolve_attribute("not_mapped", "x") == (None, None)
+
+
+def test_model_index_memoises_category_paths(
+    mocker, smart_ca_data_model, smart_transformation_rules
+):
+    index = SmartModelIndex(
+        ca_datamodel=smart_ca_data_model,
+        configurable_models=[],
+        transformation_rules=smart_transformation_rules,
+    )
+    resolve = mocker.MagicMock(return_value="humanactivity.people")
+
+    for _ in range(3):
+        assert (
+            index.get_category_path("poacher_camp", resolve) == "humanactivity.people"
+        )
+
+    resolve.assert_called_once_with("poacher_camp")
+
+
+def test_model_index_is_rebuilt_when_the_data_model_is_refreshed(
+    smart_ca_data_model, smart_transformation_rules
+):
+    index = SmartModelIndex(
+        ca_datamodel=smart_ca_data_model,
+        configurable_models=[],
+        transformation_rules=smart_transformation_rules,
+    )
+    refreshed_datamodel = DataModel()
+    refreshed_datamodel.import_from_dict(smart_ca_data_model.export_as_dict())
+
+    assert index.is_built_from(smart_ca_data_model, [])
+    assert not index.is_built_from(refreshed_datamodel, [])
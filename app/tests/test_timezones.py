@@ -0,0 +1,103 @@
+import pytest
+import pytz
+
+from app.services.timezones import TimezoneResolver
+from app.services.transformers import SmartERPatrolTransformer
+
+
+def test_timezone_resolver_caches_by_grid_cell(mocker):
+    resolver = TimezoneResolver(maxsize=10, precision=2)
+    finder = mocker.MagicMock()
+    finder.timezone_at.return_value = "Africa/Nairobi"
+    resolver._finder = finder
+
+    for lon_offset in (0.0, 0.001, 0.002):
+        timezone = resolver.timezone_at(longitude=36.8 + lon_offset, latitude=-1.28)
+        assert timezone == pytz.timezone("Africa/Nairobi")
+
+    finder.timezone_at.assert_called_once_with(lng=36.8, lat=-1.28)
+    assert resolver.stats() == {"size": 1, "hits": 2, "misses": 1}
+
+
+def test_timezone_resolver_falls_back_to_default(mocker):
+    resolver = TimezoneResolver(maxsize=10, precision=2)
+    finder = mocker.MagicMock()
+    finder.timezone_at.return_value = None
+    resolver._finder = finder
+
+    assert resolver.timezone_at(longitude=0, latitude=0, default=pytz.utc) == pytz.utc
+    assert (
+        resolver.timezone_at(longitude=None, latitude=0, default=pytz.utc) == pytz.utc
+    )
+
+
+def test_timezone_resolver_evicts_least_recently_used(mocker):
+    resolver = TimezoneResolver(maxsize=2, precision=0)
+    finder = mocker.MagicMock()
+    finder.timezone_at.return_value = "UTC"
+    resolver._finder = finder
+
+    resolver.timezone_at(longitude=1, latitude=1)
+    resolver.timezone_at(longitude=2, latitude=2)
+    resolver.timezone_at(longitude=1, latitude=1)
+    resolver.timezone_at(longitude=3, latitude=3)  # Evicts (2, 2)
+    resolver.timezone_at(longitude=1, latitude=1)
+
+    assert finder.timezone_at.call_count == 3
+
+
+def test_timezone_resolver_batch(mocker):
+    resolver = TimezoneResolver(maxsize=10, precision=2)
+    finder = mocker.MagicMock()
+    finder.timezone_at.side_effect = lambda lng, lat: (
+        "Africa/Nairobi" if lng > 30 else "America/Bogota"
+    )
+    resolver._finder = finder
+
+    timezones = resolver.timezones_at(
+        [(36.8, -1.28), (-74.08, 4.6), (36.801, -1.281), (None, None)],
+        default=pytz.utc,
+    )
+
+    assert timezones == [
+        pytz.timezone("Africa/Nairobi"),
+        pytz.timezone("America/Bogota"),
+        pytz.timezone("Africa/Nairobi"),
+        pytz.utc,
+    ]
+    assert finder.timezone_at.call_count == 2
+
+
+@pytest.mark.asyncio
+async def test_patrol_leg_events_use_the_batch_resolved_timezones(
+    mocker, smart_outbound_configuration_gcp_pubsub
+):
+    resolver = mocker.patch("app.services.transformers.timezone_resolver")
+    nairobi, bogota = pytz.timezone("Africa/Nairobi"), pytz.timezone("America/Bogota")
+    resolver.timezones_at.return_value = [nairobi, bogota]
+    transformer = SmartERPatrolTransformer(
+        config=smart_outbound_configuration_gcp_pubsub,
+        ca_uuid="b48f15a7-dd87-4fb0-af42-a6a7d893705f",
+    )
+    transformer.event_to_incident = mocker.AsyncMock(
+        side_effect=lambda **kwargs: mocker.MagicMock()
+    )
+    located_event = mocker.MagicMock()
+    located_event.location.longitude, located_event.location.latitude = 36.8, -1.28
+    unlocated_event = mocker.MagicMock(location=None)
+    patrol_leg = mocker.MagicMock(event_details=[located_event, unlocated_event])
+
+    requests = await transformer.get_incident_requests_from_er_patrol_leg(
+        patrol_id="patrol", patrol_leg=patrol_leg
+    )
+
+    assert len(requests) == 2
+    assert list(resolver.timezones_at.call_args.args[0]) == [
+        (36.8, -1.28),
+        (None, None),
+    ]
+    resolver.timezone_at.assert_not_called()
+    assert [
+        call.kwargs["location_timezone"]
+        for call in transformer.event_to_incident.call_args_list
+    ] == [nairobi, bogota]
@@ -0,0 +1,93 @@
+import json
+
+import pytest
+from opentelemetry.sdk.trace import TracerProvider
+from opentelemetry.sdk.trace.export import SimpleSpanProcessor
+from opentelemetry.sdk.trace.export.in_memory_span_exporter import InMemorySpanExporter
+from opentelemetry.sdk.trace.sampling import Decision
+
+from app.core import tracing
+from app.core.ingest import decode_push_request
+from app.core.tracing.config import StreamTypeSampler, Tracer, build_sampler
+from app.services.process_messages import process_message
+
+
+@pytest.fixture
+def span_exporter(mocker):
+    mocker.patch("app.core.settings.TRACE_SAMPLE_RATIO", 0.0)
+    mocker.patch("app.core.settings.TRACE_SAMPLE_RATIOS_BY_STREAM_TYPE", {"evu": 1.0})
+    exporter = InMemorySpanExporter()
+    provider = TracerProvider(sampler=build_sampler())
+    provider.add_span_processor(SimpleSpanProcessor(exporter))
+    mocker.patch.object(tracing, "tracer", Tracer(provider.get_tracer("test")))
+    return exporter
+
+
+def test_sampling_ratio_by_stream_type():
+    sampler = StreamTypeSampler(ratio=0.0, ratios_by_stream_type={"ev": 1.0})
+
+    def decision(stream_type):
+        return sampler.should_sample(
+            None, 12345, "span", attributes={"observation_type": stream_type}
+        ).decision
+
+    assert decision("ev") == Decision.RECORD_AND_SAMPLE
+    assert decision("obv") == Decision.DROP
+
+
+def test_nested_spans_follow_the_sampled_root(span_exporter):
+    with tracing.tracer.start_as_current_span(
+        "root", attributes={"observation_type": "evu"}
+    ):
+        with tracing.tracer.start_as_current_span("child"):
+            pass
+    with tracing.tracer.start_as_current_span(
+        "root", attributes={"observation_type": "obv"}
+    ):
+        with tracing.tracer.start_as_current_span("child"):
+            pass
+
+    spans = span_exporter.get_finished_spans()
+    assert [span.name for span in spans] == ["child", "root"]
+    assert spans[1].attributes["observation_type"] == "evu"
+
+
+def test_no_spans_are_created_within_skip_spans(span_exporter):
+    with tracing.skip_spans():
+        with tracing.tracer.start_as_current_span(
+            "root", attributes={"observation_type": "evu"}
+        ) as span:
+            span.set_attribute("foo", "bar")  # No-op
+            assert not span.is_recording()
+
+    assert not span_exporter.get_finished_spans()
+
+
+@pytest.mark.parametrize(
+    "lightweight_stream_types, spans_expected",
+    [
+        ([], True),
+        (["evu"], False),
+    ],
+)
+@pytest.mark.asyncio
+async def test_lightweight_stream_types_are_processed_without_spans(
+    mocker,
+    span_exporter,
+    mock_pubsub,
+    pubsub_request_headers,
+    event_update_v2_request_payload,
+    lightweight_stream_types,
+    spans_expected,
+):
+    mocker.patch(
+        "app.core.settings.TRACING_LIGHTWEIGHT_STREAM_TYPES", lightweight_stream_types
+    )
+    mocker.patch("app.services.process_messages.is_too_old", return_value=True)
+    mocker.patch("app.core.pubsub.pubsub", mock_pubsub)
+    body = json.dumps(event_update_v2_request_payload).encode("utf-8")
+
+    result = await process_message(decode_push_request(body, pubsub_request_headers))
+
+    assert result["status"] == "discarded"
+    assert bool(span_exporter.get_finished_spans()) == spans_expected
@@ -1,11 +1,17 @@
+import asyncio
 import os
 from datetime import datetime
 import pytest
 import pytz
 from smartconnect.models import SMARTCONNECT_DATFORMAT
 from gundi_core import schemas
+from app.conftest import async_return
 from app.core.errors import ReferenceDataError
-from app.services.transformers import transform_observation_v2
+from app.services.transformers import (
+    SmartEventTransformerV2,
+    transform_observation_v2,
+    transformer_pool,
+)
 
 
 @pytest.mark.asyncio
@@ -866,3 +872,155 @@ async def test_transform_text_message_for_inreach(
         transformed_observation.Recipients == text_message_from_earthranger.recipients
     )
     assert transformed_observation.Timestamp == text_message_from_earthranger.created_at
+
+
+@pytest.mark.asyncio
+async def test_smart_transformer_is_reused_across_messages(
+    mocker,
+    mock_smart_async_client,
+    mock_smart_async_client_class,
+    animals_sign_event_v2,
+    connection_v2,
+    destination_integration_v2_smart,
+):
+    mocker.patch(
+        "app.services.transformers.AsyncSmartClient", mock_smart_async_client_class
+    )
+
+    for _ in range(3):
+        transformed_observation = await transform_observation_v2(
+            observation=animals_sign_event_v2,
+            destination=destination_integration_v2_smart,
+            provider=connection_v2.provider,
+            route_configuration=None,
+        )
+
+    assert transformed_observation
+    # The client and the data model are kept warm
+    assert mock_smart_async_client_class.call_count == 1
+    assert mock_smart_async_client.get_data_model.call_count == 1
+    assert len(transformer_pool) == 1
+
+
+def test_transformer_pool_creates_a_new_instance_when_the_config_changes(
+    mocker, mock_smart_async_client_class, destination_integration_v2_smart
+):
+    mocker.patch(
+        "app.services.transformers.AsyncSmartClient", mock_smart_async_client_class
+    )
+    transformer = transformer_pool.get(
+        SmartEventTransformerV2, config=destination_integration_v2_smart
+    )
+
+    updated_config = destination_integration_v2_smart.copy(deep=True)
+    updated_config.base_url = "https://smart.updated.org"
+
+    assert (
+        transformer_pool.get(
+            SmartEventTransformerV2, config=destination_integration_v2_smart
+        )
+        is transformer
+    )
+    assert (
+        transformer_pool.get(SmartEventTransformerV2, config=updated_config)
+        is not transformer
+    )
+
+
+@pytest.mark.asyncio
+async def test_smart_transformer_doesnt_keep_the_ca_of_the_event(
+    mocker,
+    smart_ca_uuid,
+    mock_smart_async_client_class,
+    animals_sign_event_v2,
+    destination_integration_v2_smart,
+):
+    mocker.patch(
+        "app.services.transformers.AsyncSmartClient", mock_smart_async_client_class
+    )
+    transformer = transformer_pool.get(
+        SmartEventTransformerV2, config=destination_integration_v2_smart
+    )
+    other_ca_uuid = "b13b9201-6228-45e0-a75b-abe5b6a9f98f"
+    event = animals_sign_event_v2.copy(
+        update={"event_type": f"{other_ca_uuid}_animals_sign"}
+    )
+    event_to_incident = mocker.patch.object(
+        transformer, "event_to_incident", side_effect=RuntimeError("Stop here")
+    )
+
+    with pytest.raises(RuntimeError):
+        await transformer.transform(message=event)
+
+    assert event_to_incident.call_args.kwargs["ca_uuid"] == other_ca_uuid
+    assert transformer.ca_uuid == smart_ca_uuid
+
+
+@pytest.mark.asyncio
+async def test_smart_transformer_warm_up_fetches_reference_data_concurrently(
+    mocker,
+    mock_cache,
+    mock_smart_async_client,
+    mock_smart_async_client_class,
+    smart_ca_data_model,
+    destination_integration_v2_smart,
+):
+    mocker.patch(
+        "app.services.transformers.AsyncSmartClient", mock_smart_async_client_class
+    )
+    mocker.patch("app.services.smart_datamodels._cache_db", mock_cache)
+    in_progress = 0
+    max_in_progress = 0
+
+    def slow_lookup(result):
+        async def lookup(**kwargs):
+            nonlocal in_progress, max_in_progress
+            in_progress += 1
+            max_in_progress = max(max_in_progress, in_progress)
+            await asyncio.sleep(0.05)
+            in_progress -= 1
+            return result
+
+        return lookup
+
+    mock_smart_async_client.get_conservation_area.side_effect = slow_lookup(None)
+    mock_smart_async_client.get_data_model.side_effect = slow_lookup(
+        smart_ca_data_model
+    )
+    mock_smart_async_client.get_configurable_data_model.side_effect = slow_lookup(
+        smart_ca_data_model
+    )
+    transformer = transformer_pool.get(
+        SmartEventTransformerV2, config=destination_integration_v2_smart, warm_up=False
+    )
+    transformer.cm_uuids = [
+        "06fdf0aa-6d72-4a31-9d63-0bc5d1a6a4a8",
+        "f3ba4c3b-8b3b-4b9a-9d2e-2a35d0b8d0c1",
+    ]
+
+    await transformer.warm_up()
+
+    # CA metadata, data model and both configurable models at once
+    assert max_in_progress == 4
+    assert mock_smart_async_client.get_data_model.call_count == 1
+    assert mock_smart_async_client.get_configurable_data_model.call_count == 2
+
+
+@pytest.mark.asyncio
+async def test_transformer_pool_warms_up_new_smart_transformers(
+    mocker, mock_smart_async_client_class, destination_integration_v2_smart
+):
+    mocker.patch(
+        "app.services.transformers.AsyncSmartClient", mock_smart_async_client_class
+    )
+    warm_up = mocker.patch.object(
+        SmartEventTransformerV2, "warm_up", return_value=async_return(None)
+    )
+
+    for _ in range(3):
+        transformer_pool.get(
+            SmartEventTransformerV2, config=destination_integration_v2_smart
+        )
+    await asyncio.sleep(0)
+
+    warm_up.assert_called_once()